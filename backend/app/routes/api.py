@@ -1,4 +1,6 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
+from flask_socketio import emit, join_room, leave_room
+from app import socketio
 
 # 创建API蓝图
 api_bp = Blueprint('api', __name__, url_prefix='/api')
@@ -31,12 +33,55 @@ def api_status():
         "message": "Video monitoring API is operational"
     })
 
+@api_bp.route("/event_sink")
+def event_sink_stats():
+    """获取事件写入器状态端点
+    ---
+    tags:
+      - 通用API
+    description: >
+      告警、行为检测和人脸识别记录通过后台线程批量写入数据库，
+      该接口返回写入统计和队列背压指标。
+    responses:
+      200:
+        description: 写入统计（已提交、已写入、队列满丢弃、写入失败、队列深度等）.
+    """
+    from app.services.event_sink import event_sink
+    return jsonify(event_sink.stats())
+
 @api_bp.route("/alerts")
 def get_alerts():
     """获取告警信息端点
     ---
     tags:
       - 通用API
+    parameters:
+      - name: offset
+        in: query
+        type: integer
+        required: false
+        description: 分页起始位置.
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: 每页条数，不传时返回全部（最多为告警存储容量）.
+      - name: since_id
+        in: query
+        type: integer
+        required: false
+        description: 只返回id大于该值的告警，用于增量拉取.
+      - name: severity
+        in: query
+        type: string
+        enum: ['info', 'warning', 'critical']
+        required: false
+        description: 最低告警级别.
+      - name: stream
+        in: query
+        type: string
+        required: false
+        description: 只返回该视频流的告警.
     responses:
       200:
         description: 当前的警报列表.
@@ -48,6 +93,62 @@ def get_alerts():
               items:
                 type: string
               description: 警报信息列表.
+            items:
+              type: array
+              items:
+                type: object
+              description: 带级别、时间、规则、追踪ID和重复次数的告警详情.
+            total:
+              type: integer
+              description: 过滤后的告警总数.
+            last_id:
+              type: integer
+              description: 当前最新一条告警的id（不受过滤影响），订阅 /alerts 推送时作为 since_id 的起点.
     """
-    from app.services.alerts import get_alerts
-    return jsonify({"alerts": get_alerts()}) 
\ No newline at end of file
+    from app.services.alerts import alert_store
+    items, total = alert_store.query(
+        offset=max(0, request.args.get('offset', 0, type=int)),
+        limit=request.args.get('limit', type=int),
+        since_id=request.args.get('since_id', type=int),
+        min_severity=request.args.get('severity'),
+        stream=request.args.get('stream')
+    )
+    return jsonify({
+        "alerts": [item['message'] for item in items],
+        "items": items,
+        "total": total,
+        "last_id": alert_store.last_id()
+    }) 
+
+
+# 告警推送的SocketIO事件处理
+@socketio.on('connect', namespace='/alerts')
+def handle_alerts_connect():
+    emit('status', {'message': '已连接到告警推送服务'})
+
+@socketio.on('subscribe', namespace='/alerts')
+def handle_alerts_subscribe(data=None):
+    """
+    订阅告警推送：stream 为空时订阅全部视频流。
+
+    传入 since_id（上次收到的 last_id）时先补发断线期间错过的告警；先加入房间再查询，
+    保证补发和实时推送之间没有遗漏。
+    """
+    from app.services.alerts import alert_store
+    from app.services.alert_push import batch_message, stream_room
+    data = data or {}
+    stream = data.get('stream')
+    join_room(stream_room(stream))
+    since_id = data.get('since_id')
+    if since_id is not None:
+        items, _ = alert_store.query(since_id=int(since_id), stream=stream)
+        if items:
+            emit('alerts', batch_message(stream, items, replay=True))
+    emit('subscribed', {'stream': stream})
+
+@socketio.on('unsubscribe', namespace='/alerts')
+def handle_alerts_unsubscribe(data=None):
+    from app.services.alert_push import stream_room
+    stream = (data or {}).get('stream')
+    leave_room(stream_room(stream))
+    emit('unsubscribed', {'stream': stream})
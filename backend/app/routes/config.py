@@ -2,10 +2,12 @@ from flask import Blueprint, request, jsonify
 import numpy as np
 
 from app.services import system_state
+from app.services import danger_zone as danger_zone_service
 from app.services.danger_zone import (
-    DANGER_ZONE, SAFETY_DISTANCE, LOITERING_THRESHOLD,
     update_danger_zone as save_danger_zone,  # 使用别名以减少代码改动
-    update_thresholds as save_thresholds
+    update_thresholds as save_thresholds,
+    update_inference_roi as save_inference_roi,
+    update_zones as save_zones
 )
 
 # 创建配置蓝图
@@ -40,10 +42,11 @@ def get_config():
               type: number
               description: 停留时间警报阈值.
     """
+    # 读取服务维护的内存配置（按值导入的变量在配置更新后会过期）
     return jsonify({
-        "danger_zone": DANGER_ZONE.tolist(),
-        "safety_distance": SAFETY_DISTANCE,
-        "loitering_threshold": LOITERING_THRESHOLD
+        "danger_zone": np.asarray(danger_zone_service.DANGER_ZONE).tolist(),
+        "safety_distance": danger_zone_service.SAFETY_DISTANCE,
+        "loitering_threshold": danger_zone_service.LOITERING_THRESHOLD
     })
 
 @config_bp.route("/update_danger_zone", methods=["POST"])
@@ -72,14 +75,12 @@ def update_danger_zone():
       400:
         description: 无效的坐标数据.
     """
-    global DANGER_ZONE
     data = request.json
     new_zone = data.get('danger_zone')
     
     if new_zone and len(new_zone) >= 3:  # 确保至少有3个点形成多边形
-        DANGER_ZONE = np.array(new_zone, np.int32)
         # V5: 使用新的服务函数保存配置
-        save_danger_zone(DANGER_ZONE)
+        save_danger_zone(np.array(new_zone, np.int32))
         return jsonify({"status": "success", "message": "Danger zone updated and saved successfully"})
     else:
         return jsonify({"status": "error", "message": "Invalid danger zone coordinates"}), 400
@@ -109,11 +110,12 @@ def update_thresholds():
       400:
         description: 无效的输入值.
     """
-    global SAFETY_DISTANCE, LOITERING_THRESHOLD
     data = request.json
     
     safety_distance = data.get('safety_distance')
     loitering_threshold = data.get('loitering_threshold')
+    SAFETY_DISTANCE = danger_zone_service.SAFETY_DISTANCE
+    LOITERING_THRESHOLD = danger_zone_service.LOITERING_THRESHOLD
     
     if safety_distance is not None:
         try:
@@ -136,6 +138,104 @@ def update_thresholds():
         "loitering_threshold": LOITERING_THRESHOLD
     })
 
+@config_bp.route("/update_inference_roi", methods=["POST"])
+def update_inference_roi():
+    """更新推理ROI端点
+    ---
+    tags:
+      - 配置管理
+    description: >
+      目标检测只在推理ROI的外接矩形内运行，结果映射回整帧坐标。
+      inference_roi 为空时由危险区域加安全距离自动推导。
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            inference_roi:
+              type: array
+              items:
+                type: array
+                items:
+                  type: integer
+              description: "推理ROI的坐标点列表，为空表示自动推导."
+            roi_enabled:
+              type: boolean
+              description: 是否启用ROI裁剪, false为整帧检测.
+    responses:
+      200:
+        description: 推理ROI更新成功.
+      400:
+        description: 无效的坐标数据.
+    """
+    data = request.json
+    new_roi = data.get('inference_roi') or []
+    roi_enabled = data.get('roi_enabled', True)
+
+    if new_roi and len(new_roi) < 3:
+        return jsonify({"status": "error", "message": "Invalid inference ROI coordinates"}), 400
+
+    save_inference_roi(new_roi, roi_enabled)
+    return jsonify({
+        "status": "success",
+        "message": "Inference ROI updated and saved successfully",
+        "inference_roi": new_roi,
+        "roi_enabled": bool(roi_enabled)
+    })
+
+@config_bp.route("/zones", methods=["GET", "POST"])
+def zones():
+    """获取或更新命名区域
+    ---
+    tags:
+      - 配置管理
+    description: >
+      除全局危险区域外，还可以配置多个命名区域（禁入区、排队区等），
+      每个区域有自己的安全距离和停留时间阈值。POST 会整体替换区域列表。
+    parameters:
+      - name: body
+        in: body
+        required: false
+        schema:
+          type: object
+          properties:
+            zones:
+              type: array
+              items:
+                type: object
+                properties:
+                  name:
+                    type: string
+                  type:
+                    type: string
+                    enum: ['danger', 'restricted', 'queue', 'custom']
+                  polygon:
+                    type: array
+                    items:
+                      type: array
+                      items:
+                        type: integer
+                  safety_distance:
+                    type: number
+                  loitering_threshold:
+                    type: number
+    responses:
+      200:
+        description: 返回当前的命名区域列表.
+      400:
+        description: 无效的区域配置.
+    """
+    if request.method == "POST":
+        data = request.json or {}
+        try:
+            zones = save_zones(data.get('zones', []))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        return jsonify({"status": "success", "message": "Zones updated and saved successfully", "zones": zones})
+    return jsonify({"zones": danger_zone_service.ZONES})
+
 @config_bp.route("/toggle_edit_mode", methods=["POST"])
 def toggle_edit_mode():
     """切换危险区域编辑模式端点
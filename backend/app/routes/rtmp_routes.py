@@ -2,6 +2,7 @@ from flask import Blueprint, request, jsonify, Response
 from flask_socketio import emit, join_room, leave_room
 from app import socketio
 from app.services.rtmp_manager import rtmp_manager
+from app.services.live_egress import fmp4_response
 import cv2
 import json
 from datetime import datetime
@@ -74,6 +75,91 @@ def delete_stream(stream_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+@rtmp_bp.route('/streams/<stream_id>/motion_gate', methods=['PUT'])
+def update_motion_gate(stream_id):
+    """更新视频流的运动门控参数"""
+    try:
+        data = request.get_json() or {}
+        gate_config = rtmp_manager.update_motion_gate(stream_id, data)
+        return jsonify({
+            'motion_gate': gate_config,
+            'message': '运动门控参数已更新'
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@rtmp_bp.route('/streams/<stream_id>/pacing', methods=['PUT'])
+def update_stream_pacing(stream_id):
+    """更新视频流的目标输出帧率、分析帧率和最长帧龄"""
+    try:
+        data = request.get_json() or {}
+        pacing_config = rtmp_manager.update_pacing(stream_id, data)
+        return jsonify({
+            'pacing': pacing_config,
+            'message': '帧调度参数已更新'
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@rtmp_bp.route('/streams/<stream_id>/pacing', methods=['GET'])
+def get_stream_pacing_stats(stream_id):
+    """获取视频流的帧调度统计"""
+    try:
+        return jsonify(rtmp_manager.get_pacing_stats(stream_id)), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@rtmp_bp.route('/streams/<stream_id>/roi', methods=['PUT'])
+def update_stream_roi(stream_id):
+    """更新视频流的推理ROI多边形"""
+    try:
+        data = request.get_json() or {}
+        roi = rtmp_manager.update_roi(stream_id, data.get('roi', []))
+        return jsonify({
+            'roi': roi,
+            'message': '推理ROI已更新'
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@rtmp_bp.route('/streams/<stream_id>/zones', methods=['GET'])
+def get_stream_zones(stream_id):
+    """获取视频流的命名区域"""
+    stream = rtmp_manager.streams.get(stream_id)
+    if stream is None:
+        return jsonify({'error': '流不存在'}), 404
+    return jsonify({'zones': stream.get('zones', [])}), 200
+
+@rtmp_bp.route('/streams/<stream_id>/zones', methods=['PUT'])
+def update_stream_zones(stream_id):
+    """更新视频流的命名区域（危险区、禁入区、排队区等，每个区域有自己的阈值）"""
+    try:
+        data = request.get_json() or {}
+        zones = rtmp_manager.update_zones(stream_id, data.get('zones', []))
+        return jsonify({
+            'zones': zones,
+            'message': '区域配置已更新'
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@rtmp_bp.route('/streams/<stream_id>/motion_gate', methods=['GET'])
+def get_motion_gate_stats(stream_id):
+    """获取视频流的运动门控统计"""
+    try:
+        return jsonify(rtmp_manager.get_motion_stats(stream_id)), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@rtmp_bp.route('/streams/<stream_id>/live.mp4')
+def stream_live_fmp4(stream_id):
+    """获取视频流的 H.264 分片MP4直播输出（Media Source Extensions 播放，编码字符串见响应头 X-MSE-Codec）"""
+    try:
+        subscription = rtmp_manager.open_live_egress(stream_id)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+    return fmp4_response(subscription)
+
 @rtmp_bp.route('/streams/<stream_id>/feed')
 def stream_feed(stream_id):
     """获取指定流的视频feed"""
@@ -97,17 +183,20 @@ def handle_rtmp_connect():
 @socketio.on('disconnect', namespace='/rtmp')
 def handle_rtmp_disconnect():
     print('客户端从RTMP命名空间断开')
+    rtmp_manager.remove_viewer_everywhere(request.sid)
 
 @socketio.on('join_stream', namespace='/rtmp')
 def handle_join_stream(data):
     stream_id = data.get('stream_id')
     if stream_id:
         join_room(stream_id)
-        emit('status', {'message': f'已加入流 {stream_id}'})
+        viewers = rtmp_manager.add_viewer(stream_id, request.sid)
+        emit('status', {'message': f'已加入流 {stream_id}', 'viewers': viewers})
 
 @socketio.on('leave_stream', namespace='/rtmp')
 def handle_leave_stream(data):
     stream_id = data.get('stream_id')
     if stream_id:
         leave_room(stream_id)
-        emit('status', {'message': f'已离开流 {stream_id}'})
\ No newline at end of file
+        viewers = rtmp_manager.remove_viewer(stream_id, request.sid)
+        emit('status', {'message': f'已离开流 {stream_id}', 'viewers': viewers})
@@ -6,7 +6,6 @@ from werkzeug.utils import secure_filename
 
 from app.services.detection import process_image, process_video
 from app.services.video import video_feed, stop_video_feed_service
-from app.services.alerts import reset_alerts
 
 # 创建视频蓝图
 video_bp = Blueprint('video', __name__, url_prefix='/api')
@@ -37,15 +36,25 @@ def get_video_feed():
       - 视频处理
     description: >
       提供实时视频流。
-      此端点返回一个 multipart/x-mixed-replace 响应，用于视频流。
+      默认返回 multipart/x-mixed-replace 响应（逐帧JPEG），
       浏览器中的 `<img>` 标签可以直接使用此端点的URL作为 `src`。
+      format=fmp4 时返回 H.264 分片MP4，通过 Media Source Extensions 播放，
+      编码字符串见响应头 X-MSE-Codec。
+    parameters:
+      - name: format
+        in: query
+        type: string
+        enum: ['mjpeg', 'fmp4']
+        required: false
+        description: 输出格式，默认 mjpeg.
     produces:
       - multipart/x-mixed-replace; boundary=frame
+      - video/mp4
     responses:
       200:
         description: 视频流正在传输.
     """
-    return video_feed()
+    return video_feed(request.args.get('format', 'mjpeg'))
 
 @video_bp.route('/stop_video_feed', methods=['POST'])
 def stop_video_feed():
@@ -93,9 +102,6 @@ def upload_file():
       400:
         description: 请求错误，例如没有文件、文件类型不支持等.
     """
-    # 重置警报
-    reset_alerts()
-    
     if 'file' not in request.files:
         return jsonify({"status": "error", "message": "No file part"}), 400
         
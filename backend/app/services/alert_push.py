@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+
+from app import socketio
+
+
+# 告警推送使用的 Socket.IO 命名空间
+ALERT_NAMESPACE = '/alerts'
+# 合并窗口（秒）：窗口内产生的告警合并为一条消息推送
+ALERT_PUSH_WINDOW = float(os.environ.get('ALERT_PUSH_WINDOW', 0.25))
+# 订阅全部视频流告警的房间
+ALL_STREAMS_ROOM = 'alerts:*'
+
+
+def stream_room(stream):
+    """某个视频流的告警房间名"""
+    return ALL_STREAMS_ROOM if stream is None else f'alerts:{stream}'
+
+
+class AlertBroadcaster:
+    """
+    通过 Socket.IO 实时推送告警，替代前端轮询 /api/alerts。
+
+    AlertStore 记录的每条新告警先放入按视频流分组的待发送缓冲区；第一条告警到达后
+    等待一个合并窗口，窗口内的所有告警按视频流合并为一条 'alerts' 消息发送到该流的
+    房间，同时合并发送一条到订阅全部视频流的房间。告警突发时消息数只与窗口数有关，
+    推送延迟不超过一个窗口。
+    """
+
+    def __init__(self, window=ALERT_PUSH_WINDOW, namespace=ALERT_NAMESPACE):
+        self.window = max(0.0, window)
+        self.namespace = namespace
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stats = {'published': 0, 'messages': 0, 'errors': 0}
+
+    def publish(self, entry):
+        """登记一条新告警，只放入缓冲区，不等待发送"""
+        with self._condition:
+            self._pending.setdefault(entry['stream'], []).append(dict(entry))
+            self._stats['published'] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='alert-push', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+            # 第一条告警到达后等待一个窗口，收集这段时间内的其他告警
+            time.sleep(self.window)
+            with self._condition:
+                pending, self._pending = self._pending, {}
+            self._send(pending)
+
+    def _send(self, pending):
+        merged = []
+        for stream, alerts in pending.items():
+            self._emit(stream_room(stream), stream, alerts)
+            merged.extend(alerts)
+        if merged:
+            merged.sort(key=lambda alert: alert['id'])
+            self._emit(ALL_STREAMS_ROOM, None, merged)
+
+    def _emit(self, room, stream, alerts):
+        try:
+            socketio.emit('alerts', batch_message(stream, alerts), namespace=self.namespace, to=room)
+            self._stats['messages'] += 1
+        except Exception as e:
+            self._stats['errors'] += 1
+            print(f"❌ 告警推送失败: {e}")
+
+    def stats(self):
+        with self._condition:
+            pending = sum(len(alerts) for alerts in self._pending.values())
+        return dict(self._stats, pending=pending, window=self.window)
+
+
+def batch_message(stream, alerts, replay=False):
+    """
+    一批告警的推送消息。
+
+    last_id 是本批最大的告警 id，客户端重连后把它作为 since_id 重新订阅即可补发
+    断线期间错过的告警；补发与实时推送可能重叠，客户端按 id 去重。
+    """
+    return {
+        'stream': stream,
+        'alerts': alerts,
+        'last_id': max((alert['id'] for alert in alerts), default=None),
+        'replay': replay,
+    }
+
+
+# 全局告警推送器
+alert_broadcaster = AlertBroadcaster()
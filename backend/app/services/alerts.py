@@ -1,52 +1,256 @@
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
+import itertools
+import os
+import threading
 import time
+import uuid
 
-# 用于跟踪目标在危险区域内的停留时间
-target_loitering_time = defaultdict(float)
+from app.services.alert_push import alert_broadcaster
+from app.services.event_sink import event_sink
 
-# 上次检测的时间戳
-last_detection_time = time.time()
+# 告警保留的最大条数（环形缓冲区，超出后丢弃最旧的告警）
+ALERT_CAPACITY = int(os.environ.get('ALERT_CAPACITY', 1000))
+# 同一 (视频流, 规则, 追踪ID) 的告警在该时间窗口（秒）内只记录一次
+ALERT_SUPPRESS_WINDOW = float(os.environ.get('ALERT_SUPPRESS_WINDOW', 10.0))
+# 最多为多少个视频流保留去重状态，超出后丢弃最久没有告警的流
+ALERT_MAX_STREAMS = 256
+# 告警级别，数值越大越严重
+SEVERITY_LEVELS = {'info': 0, 'warning': 1, 'critical': 2}
+DEFAULT_STREAM = 'default'
 
-# 用于存储告警信息
-alerts = []
+
+class AlertStore:
+    """
+    有界、去重的告警存储。
+
+    告警保存在固定容量的环形缓冲区中，插入为 O(1)；去重按 (视频流, 规则, 追踪ID)
+    的哈希键进行，同一个键在抑制窗口内重复触发时只累加计数并更新最新的消息，
+    除非新告警的级别更高。抑制窗口按各视频流自己的媒体时间计算（未提供时使用墙上时钟），
+    处理速度慢于实时时不会提前放行重复告警。读取支持按级别、视频流过滤和分页。
+    """
+
+    def __init__(self, capacity=ALERT_CAPACITY, suppress_window=ALERT_SUPPRESS_WINDOW):
+        self.suppress_window = suppress_window
+        self._entries = deque(maxlen=capacity)
+        # 视频流 -> {去重键: 抑制窗口内最近一次记录的告警}；各流的时间轴不同，分开保存，
+        # 流内按记录时间排序，便于清理过期的键；流按最近告警时间排序，数量有上限
+        self._recent = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, message, rule=None, track=None, severity='warning', stream=DEFAULT_STREAM, media_time=None):
+        """
+        记录一条告警，被抑制时返回 False
+
+        media_time 为触发告警的帧在该视频流上的媒体时间（秒），用于抑制窗口；
+        为 None 时使用墙上时钟。timestamp 始终记录墙上时钟，用于展示和入库。
+        """
+        key = (stream, rule or message, track)
+        now = time.time()
+        clock = now if media_time is None else media_time
+        with self._lock:
+            recent = self._recent.pop(stream, None)
+            if recent is None:
+                recent = OrderedDict()
+            self._recent[stream] = recent
+            if len(self._recent) > ALERT_MAX_STREAMS:
+                self._recent.popitem(last=False)
+            # 清理该流已经超出抑制窗口的去重键（媒体时间回退时，如视频重新开始，也视为过期）
+            while recent:
+                elapsed = clock - next(iter(recent.values()))['media_time']
+                if 0 <= elapsed < self.suppress_window:
+                    break
+                recent.popitem(last=False)
+
+            previous = recent.get(key)
+            if previous is not None and SEVERITY_LEVELS.get(severity, 0) <= SEVERITY_LEVELS.get(previous['severity'], 0):
+                previous['count'] += 1
+                previous['message'] = message
+                previous['last_seen'] = now
+                return False
+
+            entry = {
+                'id': next(self._ids),
+                'timestamp': now,
+                'last_seen': now,
+                'media_time': clock,
+                'message': message,
+                'severity': severity,
+                'rule': rule,
+                'track': None if track is None else str(track),
+                'stream': stream,
+                'count': 1,
+            }
+            self._entries.append(entry)
+            recent.pop(key, None)
+            recent[key] = entry
+            # 入库和推送使用锁内的快照：之后的去重会在锁内修改 entry 的计数和消息
+            snapshot = dict(entry)
+        print(f"Alert: {message}")
+        # 异步写入数据库（只放入队列，不等待）
+        event_sink.record_alert(snapshot)
+        # 实时推送给订阅的客户端（按窗口合并发送）
+        alert_broadcaster.publish(snapshot)
+        return True
+
+    def query(self, offset=0, limit=None, since_id=None, min_severity=None, stream=None):
+        """
+        分页读取告警（按时间从旧到新）。
+
+        参数:
+            offset / limit: 过滤后的分页位置和条数，limit 为 None 时返回全部
+            since_id: 只返回 id 大于该值的告警，用于增量拉取
+            min_severity: 最低告警级别
+            stream: 只返回该视频流的告警
+
+        返回:
+            (items, total): 当前页的告警副本和过滤后的总数
+        """
+        min_level = SEVERITY_LEVELS.get(min_severity, 0)
+        with self._lock:
+            entries = list(self._entries)
+        if since_id is not None:
+            entries = [e for e in entries if e['id'] > since_id]
+        if min_level > 0:
+            entries = [e for e in entries if SEVERITY_LEVELS.get(e['severity'], 0) >= min_level]
+        if stream is not None:
+            entries = [e for e in entries if e['stream'] == stream]
+        total = len(entries)
+        end = None if limit is None else offset + limit
+        return [dict(e) for e in entries[offset:end]], total
+
+    def last_id(self):
+        """最新一条告警的 id，没有告警时为 0（订阅推送前用作 since_id 的起点）"""
+        with self._lock:
+            return self._entries[-1]['id'] if self._entries else 0
+
+    def messages(self):
+        """所有告警的消息文本"""
+        with self._lock:
+            return [entry['message'] for entry in self._entries]
+
+    def clear(self, stream=None):
+        """清空告警，指定 stream 时只清空该视频流的告警"""
+        with self._lock:
+            if stream is None:
+                self._entries.clear()
+                self._recent.clear()
+                return
+            kept = [entry for entry in self._entries if entry['stream'] != stream]
+            self._entries.clear()
+            self._entries.extend(kept)
+            self._recent.pop(stream, None)
+
+
+# 全局告警存储
+alert_store = AlertStore()
+
+
+class DetectionSession:
+    """
+    一个处理任务（上传的图片/视频、实时摄像头会话、RTMP流）独立的告警、停留时间和计时状态。
+
+    告警写入共享的 alert_store 并用 stream_id 区分，同时在会话内保存一份有界的告警消息列表：
+    共享存储是所有任务共用的环形缓冲区，长时间任务自己的早期告警可能已被其他任务挤出。
+    停留时间和帧间计时保存在会话内，多个任务并行处理时不会互相覆盖或清空对方的状态。
+    """
+
+    def __init__(self, stream_id=None, store=None, capacity=ALERT_CAPACITY):
+        self.stream_id = stream_id or f"session:{uuid.uuid4().hex}"
+        self.store = store or alert_store
+        # 本会话记录成功（未被去重抑制）的告警消息
+        self.alerts = deque(maxlen=capacity)
+        # 目标在区域内的停留时间
+        self.loitering_time = defaultdict(float)
+        # 追踪ID -> 当前停留的区域名，目标换到另一个区域时停留时间重新计时
+        self.loitering_zones = {}
+        # 上次检测的时间戳，以及当前帧的时间（秒）；提供了媒体时间时两者都在媒体时间轴上
+        self.last_detection_time = None
+        self.current_time = None
+
+    def add_alert(self, alert_message, rule=None, track=None, severity='warning'):
+        """添加本会话的告警，去重规则见 AlertStore.add（抑制窗口使用当前帧的媒体时间）"""
+        added = self.store.add(alert_message, rule, track, severity, self.stream_id, self.current_time)
+        if added:
+            self.alerts.append(alert_message)
+        return added
+
+    def get_alerts(self):
+        """本会话的所有告警信息（最多保留 capacity 条）"""
+        return list(self.alerts)
+
+    def update_loitering_time(self, target_id, time_diff):
+        """更新目标在危险区域的停留时间"""
+        self.loitering_time[target_id] += time_diff
+        return self.loitering_time[target_id]
+
+    def reset_loitering_time(self, target_id):
+        """重置目标的停留时间"""
+        self.loitering_time.pop(target_id, None)
+        self.loitering_zones.pop(target_id, None)
+
+    def get_loitering_time(self, target_id):
+        """获取目标的停留时间"""
+        return self.loitering_time.get(target_id, 0.0)
+
+    def update_detection_time(self, media_time=None):
+        """
+        更新检测时间并返回与上一帧的时间差
+
+        media_time 为当前帧的媒体时间（PTS 或 帧号/帧率，秒），提供时所有时间相关的判断
+        都与处理速度无关；为 None 时使用墙上时钟。
+        """
+        current_time = time.time() if media_time is None else media_time
+        time_diff = 0.0 if self.last_detection_time is None else max(0.0, current_time - self.last_detection_time)
+        self.last_detection_time = current_time
+        self.current_time = current_time
+        return time_diff
+
+    def reset(self):
+        """清空本会话的告警和状态"""
+        self.store.clear(self.stream_id)
+        self.alerts.clear()
+        self.loitering_time.clear()
+        self.loitering_zones.clear()
+        self.last_detection_time = None
+        self.current_time = None
+
+
+# 未指定会话的调用（旧接口）使用的默认会话
+default_session = DetectionSession(DEFAULT_STREAM)
 
 def reset_alerts():
-    """重置所有警报信息"""
-    global alerts, target_loitering_time, last_detection_time
-    alerts = []
-    target_loitering_time = defaultdict(float)
-    last_detection_time = time.time()
-
-def add_alert(alert_message):
-    """添加新的警报信息"""
-    global alerts
-    if alert_message not in alerts:
-        alerts.append(alert_message)
-        print(f"Alert: {alert_message}")
+    """重置默认会话的警报信息和状态"""
+    default_session.reset()
+
+def add_alert(alert_message, rule=None, track=None, severity='warning', stream=DEFAULT_STREAM):
+    """
+    添加新的警报信息
+
+    rule/track 用于去重：同一视频流、同一规则、同一追踪ID的告警在抑制窗口内只记录一次
+    （未指定 rule 时按消息文本去重）。
+    """
+    return alert_store.add(alert_message, rule, track, severity, stream)
 
 def get_alerts():
     """获取当前所有警报信息"""
-    return alerts
+    return alert_store.messages()
 
 def update_loitering_time(target_id, time_diff):
     """更新目标在危险区域的停留时间"""
-    global target_loitering_time
-    target_loitering_time[target_id] += time_diff
-    return target_loitering_time[target_id]
+    return default_session.update_loitering_time(target_id, time_diff)
 
 def reset_loitering_time(target_id):
     """重置目标的停留时间"""
-    global target_loitering_time
-    target_loitering_time[target_id] = 0
+    default_session.reset_loitering_time(target_id)
 
 def get_loitering_time(target_id):
     """获取目标的停留时间"""
-    return target_loitering_time[target_id]
+    return default_session.get_loitering_time(target_id)
 
 def update_detection_time():
     """更新检测时间并返回时间差"""
-    global last_detection_time
-    current_time = time.time()
-    time_diff = current_time - last_detection_time
-    last_detection_time = current_time
-    return time_diff 
\ No newline at end of file
+    return default_session.update_detection_time()
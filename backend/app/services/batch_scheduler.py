@@ -0,0 +1,78 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from app.services.model_registry import model_registry
+
+
+class BatchInferenceScheduler:
+    """
+    跨流批量推理调度器。
+
+    各个流的分析线程通过 submit() 提交待检测的帧，调度线程在 max_wait 秒的
+    窗口内尽量收集更多的帧（最多 max_batch_size 张），然后对整批帧执行一次
+    YOLO 推理，再把每张帧的结果通过 Future 交还给对应的分析线程。
+    """
+
+    def __init__(self, model_name='object', max_batch_size=16, max_wait=0.02, **predict_kwargs):
+        self.model_name = model_name
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait))
+        self.predict_kwargs = {'verbose': False, **predict_kwargs}
+        self._queue = queue.Queue()
+        self._model = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, frame):
+        """提交一帧进行检测，返回一个 Future，其结果为该帧的 Results 对象"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((frame, future))
+        return future
+
+    def _ensure_started(self):
+        """首次提交时才创建模型句柄并启动调度线程"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                # 调度线程独占一个句柄，不与其他流共享 predictor
+                self._model = model_registry.create_handle(self.model_name)
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _collect_batch(self):
+        """阻塞等待第一帧，然后在等待窗口内继续收集，直到达到批大小上限"""
+        batch = [self._queue.get()]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """调度线程主循环"""
+        print(f"🧮 批量推理调度线程启动: {self.model_name}")
+        while True:
+            batch = self._collect_batch()
+            # 跳过已被调用方取消的请求
+            batch = [(frame, future) for frame, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            try:
+                frames = [frame for frame, _ in batch]
+                results = self._model(frames, **self.predict_kwargs)
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                print(f"批量推理错误 ({self.model_name}, batch={len(batch)}): {e}")
+                for _, future in batch:
+                    future.set_exception(e)
@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+
+from app.services.inference_backend import box_iou
+
+
+# 级联检测：第一级用轻量的目标检测模型判断画面中是否有人，
+# 只有检测到人时才在人框内运行人脸、姿态、抽烟等较重的模型
+PERSON_CLASS = 0
+PERSON_MIN_CONF = float(os.environ.get('CASCADE_PERSON_CONF', 0.35))
+# 人脸只会出现在人框的上半部分
+FACE_REGION_RATIO = 0.5
+# 裁剪人框时四周额外保留的比例，避免人脸/手部被截断
+CROP_PADDING_RATIO = 0.1
+# 重叠的人框可能检出同一个目标，按该 IoU 阈值去重
+MERGE_IOU = 0.5
+
+
+def person_boxes(results, min_conf=PERSON_MIN_CONF):
+    """从第一级检测结果中取出人框，返回 (N, 4) 的 xyxy 数组"""
+    if not results or results[0].boxes is None or len(results[0].boxes) == 0:
+        return np.zeros((0, 4), dtype=np.float32)
+    data = results[0].boxes.data.cpu().numpy()
+    keep = (data[:, -1] == PERSON_CLASS) & (data[:, -2] >= min_conf)
+    return data[keep, :4]
+
+
+def empty_results(frame, names=None):
+    """构造一个没有检测框的 Results，供下游按"无检测"处理"""
+    return [Results(frame, path='', names=names or {}, boxes=torch.zeros((0, 6)))]
+
+
+def _merge_boxes(data):
+    """按置信度贪心去除重叠框 (data 为 (N, 6+) 的检测数组)"""
+    if len(data) <= 1:
+        return data
+    boxes = data.cpu().numpy()
+    order = np.argsort(-boxes[:, -2])
+    iou = box_iou(boxes[:, :4], boxes[:, :4])
+    keep = []
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    for i in order:
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= (iou[i] >= MERGE_IOU) & (boxes[:, -1] == boxes[i, -1])
+    return data[torch.as_tensor(keep, dtype=torch.long, device=data.device)]
+
+
+def detect_in_person_boxes(model, frame, boxes, region_ratio=1.0, **predict_kwargs):
+    """
+    第二级检测：只在人框（的上部 region_ratio 区域）内运行模型。
+
+    所有人框的裁剪图一次性批量送入模型，检测结果平移回整帧坐标后合并为
+    一个 Results，因此下游逻辑与整帧检测时一致。没有人框时不运行模型。
+    """
+    if len(boxes) == 0:
+        return empty_results(frame, getattr(model, 'names', None))
+
+    frame_h, frame_w = frame.shape[:2]
+    crops, offsets = [], []
+    for x1, y1, x2, y2 in boxes:
+        pad_x = (x2 - x1) * CROP_PADDING_RATIO
+        pad_y = (y2 - y1) * CROP_PADDING_RATIO
+        cx1, cy1 = int(max(0, x1 - pad_x)), int(max(0, y1 - pad_y))
+        cx2 = int(min(frame_w, x2 + pad_x))
+        cy2 = int(min(frame_h, y1 + (y2 - y1) * region_ratio + pad_y))
+        if cx2 - cx1 < 8 or cy2 - cy1 < 8:
+            continue
+        crops.append(frame[cy1:cy2, cx1:cx2])
+        offsets.append((cx1, cy1))
+    if not crops:
+        return empty_results(frame, getattr(model, 'names', None))
+
+    results = model.predict(crops, verbose=False, **predict_kwargs)
+    merged = []
+    for result, (dx, dy) in zip(results, offsets):
+        if result.boxes is None or len(result.boxes) == 0:
+            continue
+        data = result.boxes.data.clone()
+        data[:, [0, 2]] += dx
+        data[:, [1, 3]] += dy
+        merged.append(data)
+    if not merged:
+        return empty_results(frame, results[0].names)
+    return [Results(frame, path=results[0].path, names=results[0].names, boxes=_merge_boxes(torch.cat(merged)))]
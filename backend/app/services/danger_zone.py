@@ -1,8 +1,13 @@
 import json
 import os
+import threading
+import time
 import numpy as np
 import logging
 
+from app.services.zone_raster import ZoneDistanceField
+from app.services.zones import Zone, ZoneIndex, parse_zones
+
 # V5: Use a JSON file as the single source of truth for the danger zone
 CONFIG_DIR = os.path.join(os.path.dirname(__file__), '..', 'config')
 ZONE_CONFIG_FILE = os.path.join(CONFIG_DIR, 'danger_zone.json')
@@ -15,22 +20,65 @@ DANGER_ZONE = []
 SAFETY_DISTANCE = 50
 LOITERING_THRESHOLD = 2.0
 TARGET_CLASSES = [0] # 'person'
+# 推理ROI：只在该多边形的外接矩形内运行目标检测；为空时由危险区域加安全距离推导
+INFERENCE_ROI = []
+ROI_ENABLED = True
+# 除全局危险区域外的命名区域（禁入区、排队区等），每个区域有自己的阈值
+ZONES = []
+# 全局危险区域在多区域判定中的名称
+LEGACY_ZONE_NAME = 'danger zone'
+# 危险区域的距离场栅格缓存，按帧尺寸 (高, 宽) 区分；区域变化时重建
+_distance_fields = {}
+# 配置版本号：内存中的配置每次变化（接口更新或文件被外部修改）都会加一，
+# 处理循环只需比较版本号即可知道是否要重新推导依赖配置的状态，不必每帧读文件
+CONFIG_VERSION = 0
+# 监视配置文件修改时间的间隔（秒），0 表示不监视外部修改
+CONFIG_WATCH_INTERVAL = float(os.environ.get('ZONE_CONFIG_WATCH_INTERVAL', 1.0))
+_config_mtime = None
+_config_lock = threading.RLock()
+_watcher_thread = None
+# 区域空间索引缓存：(配置版本, 全部区域的索引, 命名区域列表)
+_zone_index_cache = (None, None, [])
+
+def _file_mtime():
+    try:
+        return os.path.getmtime(ZONE_CONFIG_FILE)
+    except OSError:
+        return None
+
+def _bump_version():
+    global CONFIG_VERSION
+    CONFIG_VERSION += 1
 
 def load_config():
     """从JSON文件加载配置到全局变量中"""
-    global DANGER_ZONE, SAFETY_DISTANCE, LOITERING_THRESHOLD
+    with _config_lock:
+        _load_config()
+        _bump_version()
+
+def _load_config():
+    global DANGER_ZONE, SAFETY_DISTANCE, LOITERING_THRESHOLD, INFERENCE_ROI, ROI_ENABLED, ZONES, _config_mtime
     try:
         if os.path.exists(ZONE_CONFIG_FILE):
+            _config_mtime = _file_mtime()
             with open(ZONE_CONFIG_FILE, 'r') as f:
                 config_data = json.load(f)
                 # 将点列表转换为numpy数组
-                DANGER_ZONE = np.array(config_data.get('danger_zone', []))
+                new_zone = np.array(config_data.get('danger_zone', []))
+                zone_changed = not np.array_equal(new_zone, DANGER_ZONE)
+                DANGER_ZONE = new_zone
+                if zone_changed:
+                    _rebuild_distance_fields()
                 SAFETY_DISTANCE = config_data.get('safety_distance', 50)
                 LOITERING_THRESHOLD = config_data.get('loitering_threshold', 2.0)
+                INFERENCE_ROI = np.array(config_data.get('inference_roi', []))
+                ROI_ENABLED = config_data.get('roi_enabled', True)
+                ZONES = config_data.get('zones', [])
                 logging.info(f"成功从 {ZONE_CONFIG_FILE} 加载危险区域配置。")
         else:
             # 如果文件不存在，使用默认值并创建文件
             DANGER_ZONE = np.array([[200, 200], [600, 200], [600, 400], [200, 400]])
+            _rebuild_distance_fields()
             save_config()
             logging.warning(f"配置文件 {ZONE_CONFIG_FILE} 不存在，已使用默认值创建。")
     except (json.JSONDecodeError, IOError) as e:
@@ -38,33 +86,146 @@ def load_config():
         DANGER_ZONE = np.array([[200, 200], [600, 200], [600, 400], [200, 400]])
         SAFETY_DISTANCE = 50
         LOITERING_THRESHOLD = 2.0
+        _rebuild_distance_fields()
+
+def _rebuild_distance_fields():
+    """危险区域变化后，为已经出现过的每种帧尺寸重建距离场（在配置锁内执行）"""
+    with _config_lock:
+        shapes = list(_distance_fields)
+        _distance_fields.clear()
+        for shape in shapes:
+            get_distance_field(shape)
+
+def get_distance_field(frame_shape):
+    """获取当前危险区域在指定帧尺寸下的距离场（首次使用该尺寸时构建），区域无效时返回 None"""
+    key = tuple(frame_shape[:2])
+    field = _distance_fields.get(key)
+    if field is not None:
+        return field
+    # 构建和写入缓存都在配置锁内进行：与区域更新、重建互斥，
+    # 不会把按旧区域构建的距离场写回已经清空的缓存
+    with _config_lock:
+        if DANGER_ZONE is None or len(DANGER_ZONE) < 3:
+            return None
+        field = _distance_fields.get(key)
+        if field is None:
+            field = _distance_fields[key] = ZoneDistanceField(DANGER_ZONE, key)
+        return field
 
 def save_config():
     """将当前的全局配置变量保存到JSON文件"""
+    global _config_mtime
     try:
         config_data = {
             # 将numpy数组转换为原生列表以便JSON序列化
             'danger_zone': DANGER_ZONE.tolist() if isinstance(DANGER_ZONE, np.ndarray) else DANGER_ZONE,
             'safety_distance': SAFETY_DISTANCE,
-            'loitering_threshold': LOITERING_THRESHOLD
+            'loitering_threshold': LOITERING_THRESHOLD,
+            'inference_roi': INFERENCE_ROI.tolist() if isinstance(INFERENCE_ROI, np.ndarray) else INFERENCE_ROI,
+            'roi_enabled': ROI_ENABLED,
+            'zones': ZONES
         }
         with open(ZONE_CONFIG_FILE, 'w') as f:
             json.dump(config_data, f, indent=4)
+        # 记录自己写入后的修改时间，监视线程不会把这次写入当作外部修改
+        _config_mtime = _file_mtime()
     except IOError as e:
         print(f"Error saving config file: {e}")
 
 def update_danger_zone(new_zone):
     """更新危险区域并保存到文件"""
     global DANGER_ZONE
-    DANGER_ZONE = np.array(new_zone)
-    save_config()
+    with _config_lock:
+        DANGER_ZONE = np.array(new_zone)
+        _rebuild_distance_fields()
+        save_config()
+        _bump_version()
 
 def update_thresholds(new_safety_distance, new_loitering_threshold):
     """更新阈值并保存到文件"""
     global SAFETY_DISTANCE, LOITERING_THRESHOLD
-    SAFETY_DISTANCE = new_safety_distance
-    LOITERING_THRESHOLD = new_loitering_threshold
-    save_config()
+    with _config_lock:
+        SAFETY_DISTANCE = new_safety_distance
+        LOITERING_THRESHOLD = new_loitering_threshold
+        save_config()
+        _bump_version()
+
+def update_inference_roi(new_roi, enabled=True):
+    """更新推理ROI并保存到文件（new_roi 为空表示由危险区域自动推导）"""
+    global INFERENCE_ROI, ROI_ENABLED
+    with _config_lock:
+        INFERENCE_ROI = np.array(new_roi if new_roi else [])
+        ROI_ENABLED = bool(enabled)
+        save_config()
+        _bump_version()
+
+def update_zones(new_zones):
+    """更新命名区域列表并保存到文件，配置无效时抛出 ValueError"""
+    global ZONES
+    zones = parse_zones(new_zones)
+    if any(zone.name == LEGACY_ZONE_NAME for zone in zones):
+        raise ValueError(f"区域名称 {LEGACY_ZONE_NAME} 已被全局危险区域使用")
+    with _config_lock:
+        ZONES = [zone.to_dict() for zone in zones]
+        save_config()
+        _bump_version()
+    return ZONES
+
+def _build_zone_index():
+    named = []
+    try:
+        named = parse_zones(ZONES)
+    except ValueError as e:
+        logging.error(f"命名区域配置无效，已忽略: {e}")
+    zones = list(named)
+    if DANGER_ZONE is not None and len(DANGER_ZONE) >= 3:
+        zones.insert(0, Zone(LEGACY_ZONE_NAME, DANGER_ZONE, 'danger', SAFETY_DISTANCE, LOITERING_THRESHOLD,
+                             distance_field=get_distance_field))
+    return ZoneIndex(zones), named
+
+def get_zone_index():
+    """获取全局危险区域和命名区域的空间索引，只在配置版本变化时重建"""
+    global _zone_index_cache
+    version, index, _ = _zone_index_cache
+    if version != CONFIG_VERSION:
+        version = CONFIG_VERSION
+        index, named = _build_zone_index()
+        _zone_index_cache = (version, index, named)
+    return index
+
+def get_named_zones():
+    """获取命名区域（不含全局危险区域）的 Zone 列表"""
+    get_zone_index()
+    return _zone_index_cache[2]
+
+def reload_if_changed():
+    """配置文件被外部修改（修改时间变化）时重新加载，返回是否重新加载"""
+    mtime = _file_mtime()
+    if mtime is None or mtime == _config_mtime:
+        return False
+    with _config_lock:
+        if _file_mtime() == _config_mtime:
+            return False
+        load_config()
+    print(f"🔄 检测到危险区域配置文件被修改，已重新加载 (版本 {CONFIG_VERSION})")
+    return True
+
+def _watch_config():
+    while True:
+        time.sleep(CONFIG_WATCH_INTERVAL)
+        try:
+            reload_if_changed()
+        except Exception as e:
+            logging.error(f"监视配置文件 {ZONE_CONFIG_FILE} 时出错: {e}")
+
+def start_config_watcher():
+    """启动后台线程，按 CONFIG_WATCH_INTERVAL 检查配置文件是否被外部修改"""
+    global _watcher_thread
+    if CONFIG_WATCH_INTERVAL <= 0 or _watcher_thread is not None:
+        return
+    _watcher_thread = threading.Thread(target=_watch_config, name='danger-zone-config-watcher', daemon=True)
+    _watcher_thread.start()
 
-# 在模块首次加载时，立即从文件加载配置
-load_config() 
\ No newline at end of file
+# 在模块首次加载时，立即从文件加载配置，之后只在配置变化时更新内存缓存
+load_config()
+start_config_watcher() 
\ No newline at end of file
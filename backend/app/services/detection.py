@@ -1,20 +1,17 @@
 import cv2
 import numpy as np
-from ultralytics import YOLO
 import os
 # --- V4: 修正模块导入问题 ---
 from app.services import danger_zone as danger_zone_service
-from app.services.danger_zone import SAFETY_DISTANCE, LOITERING_THRESHOLD, TARGET_CLASSES
+from app.services.danger_zone import TARGET_CLASSES
 # --- 结束 V4 ---
-from app.services.alerts import (
-    add_alert, update_loitering_time, reset_loitering_time, get_loitering_time,
-    update_detection_time, get_alerts, reset_alerts
-)
-from app.utils.geometry import point_in_polygon, distance_to_polygon
+from app.services.alerts import DetectionSession, default_session
+from app.utils.geometry import distances_to_polygon
+from app.utils.media_clock import media_timestamp
 from app.services.dlib_service import dlib_face_service
 from app.services import system_state
-from app.services.smoking_detection_service import SmokingDetectionService
 import time
+import uuid
 from concurrent.futures import ThreadPoolExecutor
 from app.services import violenceDetect
 # --- 新增：导入config模块以访问其状态 ---
@@ -22,63 +19,56 @@ from app.routes import config as config_state
 # --- 结束新增 ---
 
 
-# --- 模型管理 (使用相对路径) ---
-# 路径是相对于 backend/app/services/ 目录的
-# '..' 回退到 backend/app/
-# '../..' 回退到 backend/
-# '../../..' 回退到项目根目录
-BASE_PATH = os.path.join(os.path.dirname(__file__), '..', '..', '..')
-MODEL_DIR = os.path.join(BASE_PATH, 'yolo-Weights') # 统一存放在 yolo-Weights 文件夹
-
-POSE_MODEL_PATH = os.path.join(MODEL_DIR, "yolov8s-pose.pt")
-OBJECT_MODEL_PATH = os.path.join(MODEL_DIR, "yolov8n.pt")
-FACE_MODEL_PATH = os.path.join(MODEL_DIR, "yolov8n-face-lindevs.pt")
-SMOKING_MODEL_PATH = os.path.join(MODEL_DIR, "smoking_detection.pt")
-
-
-# 全局变量来持有加载的模型
-pose_model = None
-object_model = None
-face_model = None
-smoking_model = None
+# --- 模型管理 ---
+# 权重路径与加载逻辑统一放在 model_registry 中，每个权重文件只加载一次
+from app.services.model_registry import (
+    model_registry, MODEL_DIR, POSE_MODEL_PATH, OBJECT_MODEL_PATH, FACE_MODEL_PATH, SMOKING_MODEL_PATH
+)
+from app.services.keyframe_tracker import KeyframeTracker
+from app.services.inference_roi import danger_zone_roi_bounds, detect_in_roi
+from app.services.cascade import FACE_REGION_RATIO, detect_in_person_boxes, person_boxes
+from app.services.smoking_verdicts import SmokingVerdictCache
+from app.services.track_history import TrackHistoryStore
+from app.services.event_sink import event_sink
 
 def get_pose_model():
-    """获取姿态估计模型实例"""
-    global pose_model
-    if pose_model is None:
-        pose_model = YOLO(POSE_MODEL_PATH)
-    return pose_model
+    """获取共享的姿态估计模型实例"""
+    return model_registry.get('pose')
 
 def get_object_model():
-    """获取通用目标检测模型实例"""
-    global object_model
-    if object_model is None:
-        object_model = YOLO(OBJECT_MODEL_PATH)
-    return object_model
+    """获取共享的通用目标检测模型实例"""
+    return model_registry.get('object')
 
 def get_face_model():
-    """获取人脸检测和追踪模型实例"""
-    global face_model
-    if face_model is None:
-        face_model = YOLO(FACE_MODEL_PATH)
-    return face_model
+    """获取共享的人脸检测和追踪模型实例"""
+    return model_registry.get('face')
 
 def get_smoking_model():
     """获取抽烟检测模型实例"""
-    global smoking_model
-    if smoking_model is None:
-        smoking_model = SmokingDetectionService(model_path=SMOKING_MODEL_PATH)
-    return smoking_model
+    return model_registry.get('smoking')
 
 # (保留get_model函数以兼容旧代码，但现在让它返回目标检测模型)
 def get_model():
     """获取YOLO模型实例（默认为目标检测）"""
     return get_object_model()
 
-# 用于存储每个人姿态历史信息
-pose_history = {}
-FALL_DETECTION_THRESHOLD_SPEED = -15  # 重心Y坐标速度阈值 (像素/帧)
-FALL_DETECTION_THRESHOLD_STATE_FRAMES = 10 # 确认跌倒状态需要的帧数
+# 用于存储每个人姿态历史信息 (重心Y坐标, 垂直速度, 时间)，按视频源隔离，长时间未出现的ID自动清理
+pose_history = TrackHistoryStore(fields=3)
+FALL_VELOCITY_THRESHOLD = 450  # 重心向下的速度阈值 (像素/秒，相当于 30fps 下每帧 15 像素)
+FALL_ANGLE_THRESHOLD = 45  # 身体主干与水平线夹角小于该值视为趋向水平
+# 各类型命名区域的绘制颜色 (BGR)
+ZONE_COLORS = {
+    'danger': (0, 255, 255),
+    'restricted': (0, 0, 255),
+    'queue': (255, 128, 0),
+}
+# COCO 关键点：左肩、右肩、左髋、右髋
+TORSO_KEYPOINTS = [5, 6, 11, 12]
+# COCO 骨架连线
+POSE_SKELETON = [
+    (15, 13), (13, 11), (16, 14), (14, 12), (11, 12), (5, 11), (6, 12), (5, 6), (5, 7),
+    (6, 8), (7, 9), (8, 10), (1, 2), (0, 1), (0, 2), (1, 3), (2, 4), (3, 5), (4, 6)
+]
 
 def process_image(filepath, uploads_dir):
     """
@@ -91,8 +81,8 @@ def process_image(filepath, uploads_dir):
     返回:
         dict: 包含处理结果的字典
     """
-    # 重置警报，以防上次调用的状态残留
-    reset_alerts()
+    # 本次处理独立的告警状态，不影响其他并行任务
+    session = DetectionSession()
     
     # 读取图片
     img = cv2.imread(filepath)
@@ -105,29 +95,33 @@ def process_image(filepath, uploads_dir):
     if system_state.DETECTION_MODE == 'face_only':
         # 在人脸识别模式下，直接调用人脸处理函数
         # 注意：对于静态图片，我们没有追踪状态，所以创建一个临时的state
-        face_model_local = get_face_model()
-        state = {'face_model': face_model_local}
+        face_model_local = model_registry.create_handle('face')
+        state = {'face_model': face_model_local, 'person_model': model_registry.create_handle('object')}
         process_faces_only(res_plotted, 1, state) # frame_count 设为 1
     
     elif system_state.DETECTION_MODE == 'smoking_detection':
-        # --- FIX: Use fresh, local model instances for stateless image processing ---
-        face_model_local = YOLO(FACE_MODEL_PATH)
-        object_model_local = YOLO(OBJECT_MODEL_PATH)
+        # 使用共享权重的独立句柄，避免与其他任务争用同一个 predictor
+        face_model_local = model_registry.create_handle('face')
+        object_model_local = model_registry.create_handle('object')
         smoking_model = get_smoking_model() # This service is a stateless wrapper, it's fine
 
-        face_results = face_model_local.predict(img, verbose=False)
+        # 级联：先检测人，再只在人框上半部分内检测人脸
         person_results = object_model_local.predict(img, classes=[0], verbose=False)
+        face_results = detect_in_person_boxes(
+            face_model_local, img, person_boxes(person_results), region_ratio=FACE_REGION_RATIO
+        )
 
         # Call the processing function with the results, which draws on the frame
-        res_plotted = process_smoking_detection_hybrid(res_plotted, person_results, face_results, smoking_model)
+        res_plotted = process_smoking_detection_hybrid(res_plotted, person_results, face_results, smoking_model,
+                                                       session=session)
 
     elif system_state.DETECTION_MODE == 'violence_detection':
         # 暴力检测仅支持视频
         return {"status": "error", "message": "暴力检测仅支持视频文件"}, 400
 
     else:
-        # Default execution path must also use a fresh, local instance
-        model_local = YOLO(OBJECT_MODEL_PATH)
+        # Default execution path uses a lightweight handle on the shared weights
+        model_local = model_registry.create_handle('object')
         detections = model_local.predict(img)
         res_plotted = detections[0].plot()
         
@@ -153,7 +147,7 @@ def process_image(filepath, uploads_dir):
         "status": "success",
         "media_type": "image",
         "file_url": output_url,
-        "alerts": get_alerts()
+        "alerts": session.get_alerts()
     }
 
 def process_video(filepath, uploads_dir):
@@ -167,8 +161,8 @@ def process_video(filepath, uploads_dir):
     返回:
         dict: 包含处理结果的字典
     """
-    # 重置警报
-    reset_alerts()
+    # 本次任务独立的告警、停留时间和计时状态，多个任务可以并行处理
+    session = DetectionSession(f"video:{uuid.uuid4().hex}")
     
     # 创建输出视频路径
     output_filename = 'processed_' + os.path.basename(filepath)
@@ -206,15 +200,26 @@ def process_video(filepath, uploads_dir):
         out = cv2.VideoWriter(output_path.replace(".mp4", ".avi"), fourcc, fps, (frame_width, frame_height))
         output_filename = output_filename.replace(".mp4", ".avi")
     
-    # 初始化此视频处理任务专用的YOLOv8模型
-    # 避免在多个后台任务中共享模型实例及其追踪器状态
-    object_model_local = YOLO(OBJECT_MODEL_PATH)
-    pose_model_local = YOLO(POSE_MODEL_PATH)
-    face_model_local = YOLO(FACE_MODEL_PATH)
+    # 为此视频处理任务创建专用的模型句柄：权重在进程内共享，
+    # 追踪器状态由句柄独立持有，多个后台任务互不干扰
+    object_model_local = model_registry.create_handle('object')
+    pose_model_local = model_registry.create_handle('pose')
+    face_model_local = model_registry.create_handle('face')
+    # 级联检测的第一级（判断画面中是否有人），独立句柄避免干扰 object_model_local 的追踪状态
+    person_model_local = model_registry.create_handle('object')
     # smoking_model_local = get_smoking_model() # BUG-FIX: 改为按需加载，避免影响其他功能
     
     # 为本次视频处理创建一个新的人脸识别缓存
     face_recognition_cache = {}
+    # 关键帧检测：两个关键帧之间用光流传播目标框（KEYFRAME_INTERVAL=1 时每帧检测）
+    # 每个检测模式各用一个，避免切换模式后从另一个检测器的框开始传播
+    object_tracker = KeyframeTracker()
+    person_tracker = KeyframeTracker()
+    # 按追踪ID缓存抽烟判定，避免每帧对每个人重复运行抽烟模型
+    smoking_verdicts = SmokingVerdictCache()
+    # 依赖危险区域配置的推理ROI，只在配置版本变化时重新推导
+    config_version = None
+    roi = None
     
     # 处理视频帧
     frame_count = 0
@@ -231,11 +236,13 @@ def process_video(filepath, uploads_dir):
             progress = (frame_count / total_frames) * 100
             print(f"处理视频: {progress:.1f}% 完成")
         
-        # 计算时间差
-        time_diff = update_detection_time()
+        # 按帧的媒体时间计算时间差，处理速度快于或慢于实时都不影响停留时间和跌倒速度
+        time_diff = session.update_detection_time(media_timestamp(cap, frame_count - 1, fps))
         
-        # --- V5: 每次处理前都从文件重新加载最新的配置 ---
-        danger_zone_service.load_config()
+        # 危险区域配置由服务在内存中维护，这里只比较版本号
+        if config_version != danger_zone_service.CONFIG_VERSION:
+            config_version = danger_zone_service.CONFIG_VERSION
+            roi = danger_zone_roi_bounds(frame.shape)
         
         # --- 检测模式处理 ---
         processed_frame = frame.copy() # 复制一份用于处理
@@ -243,7 +250,11 @@ def process_video(filepath, uploads_dir):
         # 根据当前模式决定处理方式
         if system_state.DETECTION_MODE == 'object_detection':
             # 执行目标追踪
-            results = object_model_local.track(processed_frame, persist=True)
+            # 只在危险区域（加安全距离）的外接区域内检测，结果映射回整帧坐标
+            results = object_tracker.update(
+                processed_frame,
+                lambda: detect_in_roi(processed_frame, roi, lambda image: object_model_local.track(image, persist=True))
+            )
             
             # --- V3 混合驱动：仅在非编辑模式下由后端绘制 ---
             if not config_state.edit_mode:
@@ -262,28 +273,38 @@ def process_video(filepath, uploads_dir):
                 cv2.putText(processed_frame, "Danger Zone", 
                             (danger_zone_center[0] - 60, danger_zone_center[1]),
                             cv2.FONT_HERSHEY_SIMPLEX, 1.2, (255, 255, 255), 3)
+                # 其他命名区域（禁入区、排队区等）
+                draw_zones(processed_frame, danger_zone_service.get_named_zones())
             
             # 2. 然后，处理检测结果（绘制追踪框、标签等前景）
-            process_object_detection_results(results, processed_frame, time_diff, frame_count)
+            process_object_detection_results(results, processed_frame, time_diff, frame_count, session)
         
         elif system_state.DETECTION_MODE == 'fall_detection':
-            # 执行姿态估计追踪
-            pose_results = pose_model_local.track(processed_frame, persist=True)
-            process_pose_estimation_results(pose_results, processed_frame, time_diff, frame_count)
+            # 姿态模型本身就是人体检测器，单次推理同时得到人框和关键点
+            pose_results = pose_model_local.track(processed_frame, persist=True, verbose=False)
+            process_pose_estimation_results(pose_results, processed_frame, time_diff, frame_count, session)
 
         elif system_state.DETECTION_MODE == 'face_only':
             # 优化：传入人脸识别缓存以保存状态
             # 确保人脸模型被正确地传递给处理函数
             if 'face_model' not in face_recognition_cache:
                 face_recognition_cache['face_model'] = face_model_local
+                face_recognition_cache['person_model'] = person_model_local
             process_faces_only(processed_frame, frame_count, face_recognition_cache)
         
         elif system_state.DETECTION_MODE == 'smoking_detection':
             # --- FIX: Use the local instances created for this specific video task ---
-            face_results = face_model_local.predict(processed_frame, verbose=False)
-            person_results = object_model_local.track(processed_frame, persist=True, classes=[0], verbose=False)
+            person_results = person_tracker.update(
+                processed_frame,
+                lambda: object_model_local.track(processed_frame, persist=True, classes=[0], verbose=False)
+            )
+            # 级联：只在人框上半部分内检测人脸，画面中没有人时不运行人脸和抽烟模型
+            face_results = detect_in_person_boxes(
+                face_model_local, processed_frame, person_boxes(person_results), region_ratio=FACE_REGION_RATIO
+            )
             process_smoking_detection_hybrid(
-                processed_frame, person_results, face_results, get_smoking_model()
+                processed_frame, person_results, face_results, get_smoking_model(),
+                verdict_cache=smoking_verdicts, frame_index=frame_count, session=session
             )
         
         elif system_state.DETECTION_MODE == 'violence_detection':
@@ -298,14 +319,12 @@ def process_video(filepath, uploads_dir):
             elif processed_frame.shape[2] == 4:  # RGBA图像
                 processed_frame = cv2.cvtColor(processed_frame, cv2.COLOR_RGBA2BGR)
             
-            # 打印帧信息，帮助调试
-            print(f"写入帧: 形状={processed_frame.shape}, 类型={processed_frame.dtype}, 最小值={processed_frame.min()}, 最大值={processed_frame.max()}")
-            
             out.write(processed_frame)
     
     # 释放资源
     cap.release()
     out.release()
+    pose_history.drop(session.stream_id)
     
     # 使用相对URL路径
     output_url = f"/api/files/{output_filename}"
@@ -315,21 +334,44 @@ def process_video(filepath, uploads_dir):
         "status": "success",
         "media_type": "video",
         "file_url": output_url,
-        "alerts": get_alerts()
+        "alerts": session.get_alerts()
     }
 
 
-def process_smoking_detection_hybrid(frame, person_results, face_results, smoking_model):
+def process_smoking_detection_hybrid(frame, person_results, face_results, smoking_model,
+                                     verdict_cache=None, frame_index=0, session=None):
     """
     Refactored hybrid detection to avoid tracker state conflicts.
     This function now receives pre-computed detection results.
+
+    All ROI crops of the frame are collected first and classified through
+    smoking_model.predict_crops, so the smoking model runs once per input size
+    instead of once per person.
+
+    With a verdict_cache (SmokingVerdictCache) and tracked person results, each
+    track is only re-checked when the cache says it is due, and alerts fire on
+    the track's majority vote instead of on single detections. Alerts are
+    recorded on the given DetectionSession (the default session if omitted).
     """
+    session = session or default_session
     frame_h, frame_w = frame.shape[:2]
 
-    person_boxes = person_results[0].boxes.xyxy.cpu().numpy().astype(int) if hasattr(person_results[0].boxes, 'xyxy') else []
+    person_xyxy = person_results[0].boxes.xyxy.cpu().numpy().astype(int) if hasattr(person_results[0].boxes, 'xyxy') else []
     face_boxes = face_results[0].boxes.xyxy.cpu().numpy().astype(int) if hasattr(face_results[0].boxes, 'xyxy') else []
 
+    # 有追踪ID时按人缓存判定结果，只对到期或人框变化较大的人重新判定
+    track_ids = None
+    if verdict_cache is not None and getattr(person_results[0].boxes, 'id', None) is not None:
+        track_ids = person_results[0].boxes.id.int().cpu().numpy()
+        verdict_cache.evict(frame_index)
+    due_person_indices = {
+        i for i in range(len(person_xyxy))
+        if track_ids is None or verdict_cache.needs_check(track_ids[i], person_xyxy[i], frame_index)
+    }
+
     processed_person_indices = set()
+    # (crop, offset, max imgsz, high-confidence channel?, person index)
+    rois = []
 
     # High-confidence channel
     for f_box in face_boxes:
@@ -337,7 +379,7 @@ def process_smoking_detection_hybrid(frame, person_results, face_results, smokin
         face_w, face_h = fx2 - fx1, fy2 - fy1
         face_center_x = fx1 + face_w // 2
 
-        for i, p_box in enumerate(person_boxes):
+        for i, p_box in enumerate(person_xyxy):
             if i in processed_person_indices:
                 continue
             px1, _, px2, _ = p_box
@@ -350,21 +392,12 @@ def process_smoking_detection_hybrid(frame, person_results, face_results, smokin
                 roi_crop = frame[roi_y1:roi_y2, roi_x1:roi_x2]
                 if roi_crop.size == 0: continue
 
-                smoking_results = smoking_model.predict(roi_crop, imgsz=640, verbose=False)
-                if len(smoking_results[0].boxes) > 0:
-                    add_alert("Smoking Detected (High-Confidence)")
-                    for s_box in smoking_results[0].boxes:
-                        s_xyxy = s_box.xyxy.cpu().numpy().astype(int)[0]
-                        abs_x1, abs_y1 = s_xyxy[0] + roi_x1, s_xyxy[1] + roi_y1
-                        abs_x2, abs_y2 = s_xyxy[2] + roi_x1, s_xyxy[3] + roi_y1
-                        cv2.rectangle(frame, (abs_x1, abs_y1), (abs_x2, abs_y2), (0, 0, 255), 2)
-                        cv2.putText(frame, "Smoking", (abs_x1, abs_y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-                
+                rois.append((roi_crop, (roi_x1, roi_y1), 640, True, i))
                 processed_person_indices.add(i)
                 break
 
     # Low-confidence channel
-    for i, p_box in enumerate(person_boxes):
+    for i, p_box in enumerate(person_xyxy):
         if i in processed_person_indices:
             continue
 
@@ -373,24 +406,58 @@ def process_smoking_detection_hybrid(frame, person_results, face_results, smokin
         upper_body_crop = frame[py1:upper_body_y2, px1:px2]
         if upper_body_crop.size == 0: continue
 
-        smoking_results = smoking_model.predict(upper_body_crop, imgsz=1024, verbose=False)
-        if len(smoking_results[0].boxes) > 0:
-            add_alert("Smoking Detected (Low-Confidence/Distant)")
-            for s_box in smoking_results[0].boxes:
-                s_xyxy = s_box.xyxy.cpu().numpy().astype(int)[0]
-                abs_x1, abs_y1 = s_xyxy[0] + px1, s_xyxy[1] + py1
-                abs_x2, abs_y2 = s_xyxy[2] + px1, s_xyxy[3] + py1
-                cv2.rectangle(frame, (abs_x1, abs_y1), (abs_x2, abs_y2), (0, 165, 255), 2)
-                cv2.putText(frame, "Smoking?", (abs_x1, abs_y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 165, 255), 2)
+        rois.append((upper_body_crop, (px1, py1), 1024, False, i))
+
+    # 人脸与人框的匹配在全部人上完成，再只保留需要重新判定的人
+    rois = [roi for roi in rois if roi[4] in due_person_indices]
+
+    if track_ids is not None:
+        # 本帧不需要重新判定的人沿用缓存的投票结论
+        for i, p_box in enumerate(person_xyxy):
+            if i not in due_person_indices and verdict_cache.is_smoking(track_ids[i]):
+                px1, py1, px2, py2 = p_box
+                cv2.rectangle(frame, (px1, py1), (px2, py2), (0, 0, 255), 2)
+                cv2.putText(frame, f"Smoking ID:{track_ids[i]}", (px1, py1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+
+    if not rois:
+        return frame
+
+    # 裁剪图先全部收集，再按输入尺寸分组批量推理（画框前推理，避免框线进入其他裁剪图）
+    smoking_results = smoking_model.predict_crops(
+        [roi[0] for roi in rois], [roi[2] for roi in rois], verbose=False
+    )
+
+    for (_, (off_x, off_y), _, high_confidence, person_index), result in zip(rois, smoking_results):
+        detected = len(result.boxes) > 0
+        if track_ids is not None:
+            track_id = track_ids[person_index]
+            # 只有多数投票认为在抽烟时才告警
+            if verdict_cache.record(track_id, person_xyxy[person_index], frame_index, detected):
+                session.add_alert(f"Smoking Detected (ID:{track_id})", rule='smoking', track=track_id)
+        elif detected:
+            session.add_alert("Smoking Detected (High-Confidence)" if high_confidence else "Smoking Detected (Low-Confidence/Distant)",
+                              rule='smoking')
+        if not detected:
+            continue
+        color = (0, 0, 255) if high_confidence else (0, 165, 255)
+        label = "Smoking" if high_confidence else "Smoking?"
+        for s_box in result.boxes:
+            s_xyxy = s_box.xyxy.cpu().numpy().astype(int)[0]
+            abs_x1, abs_y1 = s_xyxy[0] + off_x, s_xyxy[1] + off_y
+            abs_x2, abs_y2 = s_xyxy[2] + off_x, s_xyxy[3] + off_y
+            cv2.rectangle(frame, (abs_x1, abs_y1), (abs_x2, abs_y2), color, 2)
+            cv2.putText(frame, label, (abs_x1, abs_y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
 
     return frame
 
 
-def process_object_detection_results(results, frame, time_diff, frame_count):
+def process_object_detection_results(results, frame, time_diff, frame_count, session=None):
     """
     处理通用目标检测结果（危险区域、徘徊等）
     (这是您之前的 process_detection_results 函数，已重命名并保留)
+    session 为该处理任务的 DetectionSession，告警和停留时间记录在其中
     """
+    session = session or default_session
     # --- V3 混合驱动：在编辑模式下，跳过所有危险区域的闯入/靠近检测逻辑 ---
     if config_state.edit_mode:
         # 仍然需要绘制检测框，所以我们只跳过危险区域的部分
@@ -409,8 +476,13 @@ def process_object_detection_results(results, frame, time_diff, frame_count):
         
         # 获取类别名称
         class_names = results[0].names
+
+        # 所有目标的底部中心点一次性与各区域做判定：空间索引只对候选区域做几何计算，
+        # 全局危险区域使用预计算的距离场
+        foot_points = np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, boxes[:, 3]], axis=1).astype(int)
+        zone_hits = danger_zone_service.get_zone_index().locate(foot_points, frame.shape)
         
-        for box, id, cls in zip(boxes, ids, classes):
+        for box, id, cls, hits in zip(boxes, ids, classes, zone_hits):
             x1, y1, x2, y2 = box
             class_name = class_names[int(cls)]
             
@@ -418,17 +490,14 @@ def process_object_detection_results(results, frame, time_diff, frame_count):
             # if int(cls) in TARGET_CLASSES:
             # 在目标检测模式下，我们不再进行人脸识别，直接使用类别名
             display_name = class_name
-            
-            # 计算目标的底部中心点
-            foot_point = (int((x1 + x2) / 2), int(y2))
-            
-            # 检查是否在危险区域内
-            # --- V4: 使用模块访问最新的 DANGER_ZONE ---
-            in_danger_zone = point_in_polygon(foot_point, danger_zone_service.DANGER_ZONE)
-            
-            # 计算到危险区域的距离
-            # --- V4: 使用模块访问最新的 DANGER_ZONE ---
-            distance = distance_to_polygon(foot_point, danger_zone_service.DANGER_ZONE)
+
+            # 最相关的区域：优先是目标所在的区域，否则是最近的区域
+            hit = hits[0] if hits else None
+            in_danger_zone = hit is not None and hit.inside
+            distance = hit.distance if hit is not None else np.inf
+            zone_name = hit.zone.name if hit is not None else None
+            safety_distance = hit.zone.safety_distance if hit is not None else 0
+            loitering_threshold = hit.zone.loitering_threshold if hit is not None else 0
             
             # 确定标签颜色和告警状态
             label_color = (0, 255, 0)  # 默认绿色
@@ -436,49 +505,54 @@ def process_object_detection_results(results, frame, time_diff, frame_count):
             
             # 如果在危险区域内，更新停留时间
             if in_danger_zone:
-                loitering_time = update_loitering_time(id, time_diff)
+                # 换到另一个区域时重新计时
+                if session.loitering_zones.get(id) != zone_name:
+                    session.reset_loitering_time(id)
+                    session.loitering_zones[id] = zone_name
+                loitering_time = session.update_loitering_time(id, time_diff)
                 
                 # 如果停留时间超过阈值，标记为红色并记录告警
-                if loitering_time >= LOITERING_THRESHOLD:
+                if loitering_time >= loitering_threshold:
                     # 使用纯红色
                     label_color = (0, 0, 255)  # BGR格式：红色
-                    alert_status = f"ID:{id} ({display_name}) staying in danger zone for {loitering_time:.1f}s"
-                    add_alert(alert_status)
+                    alert_status = f"ID:{id} ({display_name}) staying in {zone_name} for {loitering_time:.1f}s"
+                    session.add_alert(alert_status, rule=f"loitering:{zone_name}", track=id, severity='critical')
                 else:
                     # 根据停留时间从橙色到红色渐变
-                    ratio = min(1.0, loitering_time / LOITERING_THRESHOLD)
+                    ratio = min(1.0, loitering_time / loitering_threshold)
                     # 从橙色(0,165,255)到红色(0,0,255)
                     label_color = (0, int(165 * (1 - ratio)), 255)
             else:
                 # 如果不在区域内，重置停留时间
-                reset_loitering_time(id)
+                session.reset_loitering_time(id)
 
                 # 如果距离小于安全距离，根据距离设置颜色从绿色到黄色
-                if distance < SAFETY_DISTANCE:
+                if distance < safety_distance:
                     # 计算距离比例
-                    ratio = distance / SAFETY_DISTANCE
+                    ratio = distance / safety_distance
                     # 从黄色(0,255,255)到绿色(0,255,0)渐变
                     label_color = (0, 255, int(255 * (1 - ratio)))
                     
-                    alert_status = f"ID:{id} ({display_name}) too close to danger zone ({distance:.1f}px)"
-                    add_alert(alert_status)
+                    alert_status = f"ID:{id} ({display_name}) too close to {zone_name} ({distance:.1f}px)"
+                    session.add_alert(alert_status, rule=f"proximity:{zone_name}", track=id)
             
             # 在每个目标上方显示ID和类别
             label = f"ID:{id} {display_name}"
 
             if in_danger_zone:
-                label += f" time:{get_loitering_time(id):.1f}s"
-            elif distance < SAFETY_DISTANCE:
+                label += f" time:{session.get_loitering_time(id):.1f}s"
+            elif distance < safety_distance:
                 label += f" dist:{distance:.1f}px"
             
             # 根据危险程度调整边框粗细
             thickness = 2  # 默认粗细
             if in_danger_zone:
-                # 在危险区域内，根据停留时间增加边框粗细
-                thickness = max(2, int(4 * min(1.0, get_loitering_time(id) / LOITERING_THRESHOLD)))
+                # 在危险区域内，根据停留时间增加边框粗细（禁入区阈值为0，直接取最粗）
+                loiter_ratio = min(1.0, session.get_loitering_time(id) / loitering_threshold) if loitering_threshold > 0 else 1.0
+                thickness = max(2, int(4 * loiter_ratio))
                 
                 # 如果停留时间超过阈值，添加警告标记
-                if get_loitering_time(id) >= LOITERING_THRESHOLD:
+                if session.get_loitering_time(id) >= loitering_threshold:
                     # 在目标上方绘制警告三角形
                     triangle_height = 20
                     triangle_base = 20
@@ -498,9 +572,9 @@ def process_object_detection_results(results, frame, time_diff, frame_count):
                     cv2.putText(frame, "!", 
                                 (triangle_center_x - 3, triangle_top_y + triangle_height - 5), 
                                 cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-            elif distance < SAFETY_DISTANCE:
+            elif distance < safety_distance:
                 # 不在危险区域但接近时，根据距离增加边框粗细
-                thickness = max(1, int(3 * (1 - distance / SAFETY_DISTANCE)))
+                thickness = max(1, int(3 * (1 - distance / safety_distance)))
             
             # 绘制边框
             cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), label_color, thickness)
@@ -517,77 +591,114 @@ def process_object_detection_results(results, frame, time_diff, frame_count):
             foot_point = (int((x1 + x2) / 2), int(y2))
             cv2.circle(frame, foot_point, 5, label_color, -1)
             
-            # 如果不在危险区域内但距离小于安全距离的2倍，绘制到危险区域的连接线
-            if not in_danger_zone and distance < SAFETY_DISTANCE * 2:
-                draw_distance_line(frame, foot_point, distance)
+            # 如果不在区域内但距离小于安全距离的2倍，绘制到区域的连接线
+            if hit is not None and not in_danger_zone and distance < safety_distance * 2:
+                draw_distance_line(frame, foot_point, distance, tuple(map(int, hit.nearest)), safety_distance)
+
+def draw_zones(frame, zones):
+    """绘制命名区域（全局危险区域由各处理流程单独绘制）的边框和名称"""
+    for zone in zones:
+        color = ZONE_COLORS.get(zone.type, (255, 255, 255))
+        pts = zone.polygon.astype(np.int32).reshape((-1, 1, 2))
+        cv2.polylines(frame, [pts], True, color, 2)
+        x, y = zone.polygon.min(axis=0).astype(int)
+        cv2.putText(frame, zone.name, (int(x) + 5, int(y) + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+
+def compute_fall_metrics(keypoints):
+    """
+    一次性计算所有人的跌倒判定指标。
+
+    参数:
+        keypoints: (N, 17, 2) 的关键点坐标数组，不可见的点坐标为 0
 
-def process_pose_estimation_results(results, frame, time_diff, frame_count):
+    返回:
+        centroid_y: (N,) 可见关键点的平均Y坐标（人体重心）
+        valid: (N,) 可见关键点超过4个，重心可信
+        angle: (N,) 身体主干（肩中心->髋中心）与水平线的夹角，主干不可见时为 90
+        torso_visible: (N,) 双肩和双髋是否都可见
+    """
+    visible = keypoints[..., 1] > 0
+    counts = visible.sum(axis=1)
+    centroid_y = (keypoints[..., 1] * visible).sum(axis=1) / np.maximum(counts, 1)
+    valid = counts > 4
+
+    torso = keypoints[:, TORSO_KEYPOINTS]
+    torso_visible = (torso[..., 1] > 0).all(axis=1)
+    body_vector = torso[:, 2:].mean(axis=1) - torso[:, :2].mean(axis=1)
+    # 主干竖直（dx 为 0）时夹角为 90 度
+    angle = np.degrees(np.arctan2(np.abs(body_vector[:, 1]), np.abs(body_vector[:, 0])))
+    angle = np.where(torso_visible, angle, 90.0)
+    return centroid_y, valid, angle, torso_visible
+
+
+def draw_pose_skeletons(frame, boxes, keypoints):
+    """直接在帧上绘制人框、骨架和关键点（替代 results.plot() 的整帧拷贝重绘）"""
+    visible = keypoints[..., 1] > 0
+    points = keypoints.astype(np.int32)
+    limbs = [
+        np.stack([points[n, a], points[n, b]])
+        for n in range(len(points)) for a, b in POSE_SKELETON
+        if visible[n, a] and visible[n, b]
+    ]
+    if limbs:
+        cv2.polylines(frame, limbs, False, (255, 128, 0), 2)
+    for x, y in points[visible]:
+        cv2.circle(frame, (int(x), int(y)), 3, (0, 255, 255), -1)
+    for x1, y1, x2, y2 in boxes.astype(np.int32):
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+
+
+def process_pose_estimation_results(results, frame, time_diff, frame_count, session=None):
     """
     处理姿态估计结果，进行跌倒检测
+
+    姿态模型同时作为人体检测器；所有人的重心、垂直速度和主干角度用数组运算一次算出。
+    姿态历史按 session.stream_id 隔离，告警记录到该会话。
     """
+    session = session or default_session
+    history = pose_history.get(session.stream_id)
+    history.evict(frame_count)
+
     # 如果有追踪结果，则进行跌倒检测
-    if hasattr(results[0], 'boxes') and hasattr(results[0].boxes, 'id') and results[0].boxes.id is not None:
-        boxes = results[0].boxes.xyxy.cpu().numpy()
-        ids = results[0].boxes.id.int().cpu().numpy()
-        keypoints = results[0].keypoints.xy.cpu().numpy()  # 获取关键点
+    if not (hasattr(results[0], 'boxes') and hasattr(results[0].boxes, 'id') and results[0].boxes.id is not None):
+        return
 
-        # 首先，让YOLOv8的plot函数绘制基本的骨架和边界框
-        frame[:] = results[0].plot()
+    boxes = results[0].boxes.xyxy.cpu().numpy()
+    ids = results[0].boxes.id.int().cpu().numpy()
+    keypoints = results[0].keypoints.xy.cpu().numpy()  # 获取关键点
 
-        for person_id, box, kps in zip(ids, boxes, keypoints):
-            # --- 跌倒检测逻辑 ---
-            velocity_y = 0
-            angle = 90 # 默认为垂直
+    draw_pose_skeletons(frame, boxes, keypoints)
 
-            # 1. 计算人体中心点（质心）
-            visible_kps = kps[kps[:, 1] > 0] 
-            if len(visible_kps) > 4:
-                centroid_y = np.mean(visible_kps[:, 1])
+    centroid_y, valid, angle, torso_visible = compute_fall_metrics(keypoints)
 
-                # 2. 更新历史记录并计算垂直速度
-                if person_id in pose_history:
-                    prev_centroid_y, _ = pose_history[person_id][-1]
-                    velocity_y = centroid_y - prev_centroid_y
-                    
-                    pose_history[person_id].append((centroid_y, velocity_y))
-                    if len(pose_history[person_id]) > 30:
-                        pose_history[person_id].pop(0)
-
-                    # 3. 判断是否快速下坠 (速度为正表示向下,因为图像坐标系Y轴向下)
-                    if velocity_y > 15: # 阈值需要调试
-                        
-                        # 4. 确认跌倒状态: 检查身体主干角度
-                        left_shoulder, right_shoulder = kps[5], kps[6]
-                        left_hip, right_hip = kps[11], kps[12]
-
-                        # 确保关键点都可见
-                        if left_shoulder[1] > 0 and right_shoulder[1] > 0 and left_hip[1] > 0 and right_hip[1] > 0:
-                            shoulder_center = (left_shoulder + right_shoulder) / 2
-                            hip_center = (left_hip + right_hip) / 2
-                            body_vector = hip_center - shoulder_center
-                            
-                            # 避免除以零的错误
-                            if body_vector[0] != 0:
-                                # 计算身体与水平线的夹角
-                                angle = np.degrees(np.arctan(abs(body_vector[1] / body_vector[0])))
-                                
-                                # 角度小于45度，意味着身体更趋向于水平
-                                if angle < 45: 
-                                    alert_message = f"警告: 人员 {person_id} 可能已跌倒!"
-                                    add_alert(alert_message) # 修正：只传递一个参数
-                                    # 在人的边界框上方用红色字体标注
-                                    cv2.putText(frame, f"FALL DETECTED: ID {person_id}", 
-                                                (int(box[0]), int(box[1] - 10)),
-                                                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-                else:
-                    # 初始化这个人的姿态历史记录
-                    pose_history[person_id] = [(centroid_y, 0)]
+    # 当前帧的时间（媒体时间，会话未提供时使用墙上时钟）
+    now = session.current_time if session.current_time is not None else time.time()
+    # 上一次记录的重心和时间（没有历史记录的人为 NaN）
+    previous = history.last(ids)
+    prev_centroid_y, prev_time = previous[:, 0], previous[:, 2]
+    elapsed = now - np.nan_to_num(prev_time)
+    has_prev = valid & ~np.isnan(prev_centroid_y) & (elapsed > 0)
+    # 速度（像素/秒）为正表示向下，因为图像坐标系Y轴向下
+    velocity_y = np.where(has_prev, (centroid_y - np.nan_to_num(prev_centroid_y)) / np.where(has_prev, elapsed, 1.0), 0.0)
+
+    # 快速下坠且身体主干趋向水平（角度小于阈值）时判定为跌倒
+    fallen = has_prev & (velocity_y > FALL_VELOCITY_THRESHOLD) & torso_visible & (angle < FALL_ANGLE_THRESHOLD)
+
+    # 更新历史记录
+    history.append(ids[valid], np.stack([centroid_y[valid], velocity_y[valid], np.full(valid.sum(), now)], axis=1), frame_count)
 
-            # --- 在画面上显示调试信息 ---
-            debug_text = f"ID:{person_id} V:{velocity_y:.1f} A:{angle:.1f}"
-            cv2.putText(frame, debug_text,
-                        (int(box[0]), int(box[1] - 35)), # 显示在FALL DETECTED文字的上方
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
+    for person_id, box in zip(ids[fallen], boxes[fallen]):
+        session.add_alert(f"警告: 人员 {person_id} 可能已跌倒!", rule='fall', track=person_id, severity='critical')
+        # 在人的边界框上方用红色字体标注
+        cv2.putText(frame, f"FALL DETECTED: ID {person_id}",
+                    (int(box[0]), int(box[1] - 10)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+
+    # --- 在画面上显示调试信息 ---
+    for person_id, box, vy, a in zip(ids, boxes, velocity_y, angle):
+        cv2.putText(frame, f"ID:{person_id} V:{vy:.1f} A:{a:.1f}",
+                    (int(box[0]), int(box[1] - 35)), # 显示在FALL DETECTED文字的上方
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
 
 
 # 为了保持兼容，我们将旧的函数重命名
@@ -596,22 +707,32 @@ process_detection_results = process_object_detection_results
 
 # --- 新的、带结果黏滞和多线程优化的高频人脸识别逻辑 ---
 
-def process_faces_only(frame, frame_count, state):
+def process_faces_only(frame, frame_count, state, stream=None):
     """
     只进行人脸检测和识别的处理。
     使用 YOLOv8 进行检测，使用 Dlib 进行识别。
     这个函数现在直接在传入的 frame 上绘图，不再返回新的 frame。
+    stream 为实时视频源的会话ID，识别记录写入数据库时关联到该视频源；
+    上传的图片和视频不传 stream，不写入识别记录。
     """
     face_model_local = state.get('face_model')
     if face_model_local is None:
-        face_model_local = YOLO(FACE_MODEL_PATH)
+        face_model_local = model_registry.create_handle('face')
         state['face_model'] = face_model_local
 
     # --- 性能诊断：步骤1 ---
     t0 = time.time()
     # 使用 YOLOv8 进行人脸检测
     # 修复：对于可能为静态图的场景，使用 .predict() 而不是 .track()
-    face_results = face_model_local.predict(frame, verbose=False)
+    person_model_local = state.get('person_model')
+    if person_model_local is not None:
+        # 级联：先判断画面中是否有人，没有人时直接返回；有人时只在人框上半部分内检测人脸
+        persons = person_boxes(person_model_local.predict(frame, classes=[0], verbose=False))
+        if len(persons) == 0:
+            return
+        face_results = detect_in_person_boxes(face_model_local, frame, persons, region_ratio=FACE_REGION_RATIO)
+    else:
+        face_results = face_model_local.predict(frame, verbose=False)
     t1 = time.time()
     
     # 从结果中提取边界框
@@ -632,6 +753,9 @@ def process_faces_only(frame, frame_count, state):
     
     # 3. 在帧上绘制结果
     for name, box in recognized_faces:
+        # 实时视频源的识别记录异步写入数据库（同一个人按时间间隔限流）
+        if stream is not None:
+            event_sink.record_face(name, stream)
         # 双重保险：再次确保坐标是整数
         left, top, right, bottom = [int(p) for p in box]
         color = (0, 255, 0) if name != "Unknown" else (0, 0, 255)
@@ -661,7 +785,7 @@ def process_faces_only(frame, frame_count, state):
     # return frame
 
 
-def draw_distance_line(frame, foot_point, distance):
+def draw_distance_line(frame, foot_point, distance, closest_point=None, safety_distance=None):
     """
     绘制从目标到危险区域的连接线
     
@@ -669,42 +793,30 @@ def draw_distance_line(frame, foot_point, distance):
         frame: 当前视频帧
         foot_point: 目标的底部中心点
         distance: 目标到危险区域的距离
+        closest_point: 危险区域边缘上的最近点（批量判定时已算出，未提供时在此计算）
+        safety_distance: 该区域的安全距离，默认使用全局危险区域的安全距离
     """
+    if safety_distance is None:
+        safety_distance = danger_zone_service.SAFETY_DISTANCE
+    if safety_distance <= 0:
+        return
     # 找到危险区域上最近的点
-    min_dist = float('inf')
-    closest_point = None
-    # --- V4: 使用模块访问最新的 DANGER_ZONE ---
-    for i in range(len(danger_zone_service.DANGER_ZONE)):
-        p1 = danger_zone_service.DANGER_ZONE[i]
-        p2 = danger_zone_service.DANGER_ZONE[(i + 1) % len(danger_zone_service.DANGER_ZONE)]
-        
-        # 计算点到线段的最近点
-        line_vec = p2 - p1
-        line_len = np.linalg.norm(line_vec)
-        line_unitvec = line_vec / line_len
-        
-        pt_vec = np.array(foot_point) - p1
-        proj_len = np.dot(pt_vec, line_unitvec)
-        
-        if proj_len < 0:
-            closest_pt = p1
-        elif proj_len > line_len:
-            closest_pt = p2
+    if closest_point is None and len(danger_zone_service.DANGER_ZONE) > 0:
+        distance_field = danger_zone_service.get_distance_field(frame.shape)
+        if distance_field is not None:
+            _, _, nearest = distance_field.lookup([foot_point])
         else:
-            closest_pt = p1 + line_unitvec * proj_len
-        
-        d = np.linalg.norm(np.array(foot_point) - closest_pt)
-        if d < min_dist:
-            min_dist = d
-            closest_point = tuple(map(int, closest_pt))
+            # --- V4: 使用模块访问最新的 DANGER_ZONE ---
+            _, nearest = distances_to_polygon([foot_point], danger_zone_service.DANGER_ZONE)
+        closest_point = tuple(map(int, nearest[0]))
     
     # 绘制从目标到危险区域的连接线，颜色根据距离变化
     if closest_point:
         # 根据距离调整线条粗细和样式
-        line_thickness = max(1, int(3 * (1 - distance / (SAFETY_DISTANCE * 2))))
+        line_thickness = max(1, int(3 * (1 - distance / (safety_distance * 2))))
         
         # 绘制主线
-        label_color = (0, 255, int(255 * (1 - distance / SAFETY_DISTANCE))) if distance < SAFETY_DISTANCE else (0, 255, 0)
+        label_color = (0, 255, int(255 * (1 - distance / safety_distance))) if distance < safety_distance else (0, 255, 0)
         cv2.line(frame, foot_point, closest_point, label_color, line_thickness)
         
         # 在线上显示距离数字
@@ -715,7 +827,7 @@ def draw_distance_line(frame, foot_point, distance):
                     cv2.FONT_HERSHEY_SIMPLEX, 0.6, label_color, 1)
         
         # 如果距离小于安全距离，添加虚线效果
-        if distance < SAFETY_DISTANCE:
+        if distance < safety_distance:
             # 计算线段长度
             line_length = np.linalg.norm(np.array(foot_point) - np.array(closest_point))
             # 计算单位向量
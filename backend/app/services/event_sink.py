@@ -0,0 +1,438 @@
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from app.config import config
+
+
+# 数据库后端：auto（与登录服务一致，配置了 MySQL 时用 MySQL，否则用 SQLite）、mysql、sqlite、disabled
+EVENT_SINK_BACKEND = os.environ.get('EVENT_SINK_BACKEND', 'auto')
+# SQLite 作为本地替代时的数据库文件
+EVENT_SINK_SQLITE_PATH = os.environ.get(
+    'EVENT_SINK_SQLITE_PATH', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'app.db')
+)
+# 待写入事件队列的容量，队列满时丢弃新事件（推理线程从不等待数据库）
+EVENT_SINK_QUEUE_SIZE = int(os.environ.get('EVENT_SINK_QUEUE_SIZE', 10000))
+# 攒够多少条或距第一条事件多少秒后写入一次
+EVENT_SINK_BATCH_SIZE = int(os.environ.get('EVENT_SINK_BATCH_SIZE', 200))
+EVENT_SINK_FLUSH_INTERVAL = float(os.environ.get('EVENT_SINK_FLUSH_INTERVAL', 1.0))
+# MySQL 连接池大小
+EVENT_SINK_POOL_SIZE = int(os.environ.get('EVENT_SINK_POOL_SIZE', 2))
+# 未单独配置的视频源所对应的摄像头和位置（行为/人脸记录表的外键，未配置时只写报警表）
+EVENT_CAMERA_ID = os.environ.get('EVENT_CAMERA_ID') or None
+EVENT_LOCATION_ID = os.environ.get('EVENT_LOCATION_ID') or None
+# 同一视频源中同一个人的人脸识别记录至少间隔的秒数
+FACE_LOG_INTERVAL = float(os.environ.get('FACE_LOG_INTERVAL', 10.0))
+# 未在乘客表中找到的姓名多久后重新查询（秒），之后注册的乘客也能关联上
+PASSENGER_MISS_TTL = float(os.environ.get('PASSENGER_MISS_TTL', 60.0))
+
+DEFAULT_STREAM = 'default'
+# 写入顺序：被外键引用的表在前
+TABLE_ORDER = ('behavior_detection_logs', 'face_recognition_logs', 'alerts')
+# 告警级别 -> 报警表的严重程度 / 行为记录表的风险等级
+ALERT_SEVERITY = {'info': 'low', 'warning': 'medium', 'critical': 'critical'}
+RISK_LEVEL = {'info': 'low', 'warning': 'medium', 'critical': 'high'}
+# SQLite 单条语句的参数个数上限约为 999
+MAX_STATEMENT_PARAMS = 900
+
+# SQLite 替代库的表结构（字段与 db_initial.py 中的 MySQL 表一致，去掉了外键）
+SQLITE_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS behavior_detection_logs (
+        detection_id VARCHAR(36) NOT NULL PRIMARY KEY,
+        passenger_id VARCHAR(36),
+        camera_id VARCHAR(36) NOT NULL,
+        detection_time DATETIME NOT NULL,
+        behavior_type VARCHAR(50) NOT NULL,
+        confidence_score FLOAT,
+        risk_level VARCHAR(20),
+        location_id VARCHAR(36) NOT NULL,
+        video_clip_path VARCHAR(255),
+        status VARCHAR(20) DEFAULT 'pending',
+        handled_by VARCHAR(36),
+        handled_time DATETIME,
+        notes TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS face_recognition_logs (
+        recognition_id VARCHAR(36) PRIMARY KEY,
+        passenger_id VARCHAR(36),
+        camera_id VARCHAR(36) NOT NULL,
+        recognition_time DATETIME NOT NULL,
+        confidence_score FLOAT,
+        matched_face_feature BLOB,
+        location_id VARCHAR(36) NOT NULL,
+        image_path VARCHAR(255)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS alerts (
+        alert_id VARCHAR(36) NOT NULL PRIMARY KEY,
+        detection_id VARCHAR(36),
+        alert_time DATETIME NOT NULL,
+        alert_type VARCHAR(50) NOT NULL,
+        severity VARCHAR(20) NOT NULL,
+        status VARCHAR(20) DEFAULT 'unprocessed',
+        assigned_to VARCHAR(36),
+        resolution TEXT,
+        resolved_time DATETIME
+    )
+    """,
+)
+
+
+def _format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _resolve_backend(backend):
+    if backend != 'auto':
+        return backend
+    env = os.environ.get('FLASK_CONFIG', 'development')
+    return 'mysql' if hasattr(config[env](), 'MYSQL_HOST') else 'sqlite'
+
+
+class EventSink:
+    """
+    告警、行为检测和人脸识别记录的异步写后（write-behind）数据库写入器。
+
+    检测流程只把事件放入有界队列（满时丢弃并计数，从不阻塞）；后台写入线程攒够
+    batch_size 条或等待 flush_interval 秒后，按表合并成多行 INSERT 一次提交。
+    MySQL 通过连接池获取连接，SQLite 作为本地替代时使用写入线程自己的连接。
+    """
+
+    def __init__(self, backend=EVENT_SINK_BACKEND, queue_size=EVENT_SINK_QUEUE_SIZE,
+                 batch_size=EVENT_SINK_BATCH_SIZE, flush_interval=EVENT_SINK_FLUSH_INTERVAL,
+                 pool_size=EVENT_SINK_POOL_SIZE, sqlite_path=EVENT_SINK_SQLITE_PATH):
+        self.backend = _resolve_backend(backend)
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self.pool_size = pool_size
+        self.sqlite_path = sqlite_path
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,        # 进入队列的事件数
+            'written': 0,          # 成功写入数据库的事件数
+            'dropped': 0,          # 队列已满被丢弃的事件数（背压）
+            'failed': 0,           # 写入失败被丢弃的事件数
+            'skipped': 0,          # 缺少摄像头/位置信息未记录的事件数
+            'batches': 0,
+            'max_queue_depth': 0,
+            'last_flush_seconds': None,
+            'last_error': None,
+        }
+        # 视频流 -> (摄像头ID, 位置ID)
+        self._sources = {}
+        # (视频流, 姓名) -> 上次记录人脸的时间，按记录时间排序，插入时清理超出 FACE_LOG_INTERVAL 的键
+        # （摄像头和上传任务的视频流ID各不相同，不清理会无限增长）
+        self._face_logged = OrderedDict()
+        self._face_lock = threading.Lock()
+        # 姓名 -> 乘客ID（写入线程查询后缓存）；未找到的姓名 -> 查询时间，PASSENGER_MISS_TTL 后重新查询
+        self._passenger_ids = {}
+        self._passenger_misses = {}
+        self._pool = None
+        self._sqlite_conn = None
+
+    @property
+    def enabled(self):
+        return self.backend in ('mysql', 'sqlite')
+
+    def _count(self, key, value=1):
+        with self._stats_lock:
+            self._stats[key] += value
+
+    # ---------- 生产者（检测流程）----------
+
+    def start(self):
+        """启动后台写入线程（首次提交事件时自动调用）"""
+        if not self.enabled or self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='event-sink-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+            print(f"🗄️ 事件写入线程已启动 (后端: {self.backend})")
+
+    def submit(self, table, row):
+        """放入一条待写入的记录，队列已满时丢弃并返回 False"""
+        if not self.enabled:
+            return False
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait((table, row))
+        except queue.Full:
+            self._count('dropped')
+            return False
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._stats['submitted'] += 1
+            if depth > self._stats['max_queue_depth']:
+                self._stats['max_queue_depth'] = depth
+        return True
+
+    def set_stream_source(self, stream, camera_id=None, location_id=None):
+        """为视频流指定对应的摄像头和位置，未指定时使用 EVENT_CAMERA_ID / EVENT_LOCATION_ID"""
+        if camera_id and location_id:
+            self._sources[stream] = (camera_id, location_id)
+        else:
+            self._sources.pop(stream, None)
+
+    def _source(self, stream):
+        return self._sources.get(stream, (EVENT_CAMERA_ID, EVENT_LOCATION_ID))
+
+    def record_alert(self, alert):
+        """记录一条告警（AlertStore 的告警字典）；带规则的告警同时写入行为检测记录并关联"""
+        if not self.enabled:
+            return
+        camera_id, location_id = self._source(alert['stream'])
+        alert_time = _format_time(alert['timestamp'])
+        rule = (alert.get('rule') or '').split(':')[0]
+        detection_id = None
+        if rule:
+            if camera_id and location_id:
+                detection_id = str(uuid.uuid4())
+                self.submit('behavior_detection_logs', {
+                    'detection_id': detection_id,
+                    'camera_id': camera_id,
+                    'detection_time': alert_time,
+                    'behavior_type': rule[:50],
+                    'risk_level': RISK_LEVEL.get(alert['severity'], 'medium'),
+                    'location_id': location_id,
+                    'notes': alert['message'],
+                })
+            else:
+                self._count('skipped')
+        self.submit('alerts', {
+            'alert_id': str(uuid.uuid4()),
+            'detection_id': detection_id,
+            'alert_time': alert_time,
+            'alert_type': (rule or 'general')[:50],
+            'severity': ALERT_SEVERITY.get(alert['severity'], 'medium'),
+        })
+
+    def record_face(self, name, stream=DEFAULT_STREAM, confidence=None):
+        """记录一次人脸识别结果（同一视频源中同一个人每 FACE_LOG_INTERVAL 秒最多一条）"""
+        if not self.enabled:
+            return
+        camera_id, location_id = self._source(stream)
+        if not (camera_id and location_id):
+            self._count('skipped')
+            return
+        now = time.time()
+        key = (stream, name)
+        with self._face_lock:
+            while self._face_logged:
+                if now - next(iter(self._face_logged.values())) < FACE_LOG_INTERVAL:
+                    break
+                self._face_logged.popitem(last=False)
+            if key in self._face_logged:
+                return
+            self._face_logged[key] = now
+        self.submit('face_recognition_logs', {
+            'recognition_id': str(uuid.uuid4()),
+            'passenger_id': None,
+            'camera_id': camera_id,
+            'recognition_time': _format_time(now),
+            'confidence_score': None if confidence is None else float(confidence),
+            'location_id': location_id,
+            # 已注册的姓名由写入线程解析为乘客ID
+            '_passenger_name': None if name == 'Unknown' else name,
+        })
+
+    def stats(self):
+        """写入统计和背压指标"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update({
+            'backend': self.backend,
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self._queue.maxsize,
+            'running': self._thread is not None and self._thread.is_alive(),
+        })
+        return stats
+
+    def stop(self, timeout=5.0):
+        """停止写入线程，退出前写完队列中剩余的事件"""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join(timeout=timeout)
+        self._thread = None
+
+    # ---------- 写入线程 ----------
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            timeout = self.flush_interval if not batch else max(0.0, deadline - time.monotonic())
+            try:
+                batch.append(self._queue.get(timeout=min(timeout, self.flush_interval)))
+                if len(batch) == 1:
+                    deadline = time.monotonic() + self.flush_interval
+            except queue.Empty:
+                pass
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline
+                          or self._stop_event.is_set()):
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+        self._close()
+
+    def _write(self, batch):
+        started = time.monotonic()
+        grouped = {}
+        for table, row in batch:
+            grouped.setdefault(table, []).append(row)
+
+        # 失败时重新获取连接再试一次
+        for attempt in range(2):
+            conn = None
+            try:
+                conn = self._connect()
+                cursor = conn.cursor()
+                for table in TABLE_ORDER:
+                    rows = grouped.get(table)
+                    if not rows:
+                        continue
+                    if table == 'face_recognition_logs':
+                        self._resolve_passengers(cursor, rows)
+                    self._insert_rows(cursor, table, rows)
+                conn.commit()
+                cursor.close()
+                with self._stats_lock:
+                    self._stats['written'] += len(batch)
+                    self._stats['batches'] += 1
+                    self._stats['last_flush_seconds'] = round(time.monotonic() - started, 4)
+                return
+            except Exception as e:
+                self._discard(conn)
+                conn = None
+                if attempt == 1:
+                    with self._stats_lock:
+                        self._stats['failed'] += len(batch)
+                        self._stats['last_error'] = str(e)
+                    print(f"❌ 事件写入数据库失败，{len(batch)} 条已丢弃: {e}")
+            finally:
+                self._release(conn)
+
+    def _insert_rows(self, cursor, table, rows):
+        """按列合并为多行 INSERT，单条语句的参数个数受限时分批执行"""
+        placeholder = '%s' if self.backend == 'mysql' else '?'
+        by_columns = {}
+        for row in rows:
+            by_columns.setdefault(tuple(sorted(row)), []).append(row)
+        for columns, group in by_columns.items():
+            chunk = max(1, MAX_STATEMENT_PARAMS // len(columns))
+            row_sql = '(' + ', '.join([placeholder] * len(columns)) + ')'
+            for start in range(0, len(group), chunk):
+                part = group[start:start + chunk]
+                sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES " + ', '.join([row_sql] * len(part))
+                cursor.execute(sql, [row[column] for row in part for column in columns])
+
+    def _resolve_passengers(self, cursor, rows):
+        """
+        把人脸记录中的已注册姓名解析为乘客ID（查询失败时保持为空）。
+
+        找到的乘客ID一直缓存；未找到的姓名只在 PASSENGER_MISS_TTL 秒内不再查询，
+        之后注册的乘客在过期后即可关联。
+        """
+        now = time.monotonic()
+        names = {row['_passenger_name'] for row in rows if row.get('_passenger_name')}
+        missing = [
+            name for name in names
+            if name not in self._passenger_ids
+            and (name not in self._passenger_misses or now - self._passenger_misses[name] >= PASSENGER_MISS_TTL)
+        ]
+        if missing:
+            placeholder = '%s' if self.backend == 'mysql' else '?'
+            try:
+                cursor.execute(
+                    f"SELECT name, passenger_id FROM passengers WHERE name IN ({', '.join([placeholder] * len(missing))})",
+                    missing
+                )
+                found = dict(cursor.fetchall())
+            except Exception:
+                # 查询失败不缓存，下一批再查
+                missing, found = [], {}
+            for name in missing:
+                if found.get(name) is not None:
+                    self._passenger_ids[name] = found[name]
+                    self._passenger_misses.pop(name, None)
+                else:
+                    self._passenger_misses[name] = now
+        for row in rows:
+            name = row.pop('_passenger_name', None)
+            if name:
+                row['passenger_id'] = self._passenger_ids.get(name)
+
+    def _connect(self):
+        if self.backend == 'mysql':
+            if self._pool is None:
+                from mysql.connector import pooling
+                current_config = config[os.environ.get('FLASK_CONFIG', 'development')]()
+                self._pool = pooling.MySQLConnectionPool(
+                    pool_name='event_sink',
+                    pool_size=self.pool_size,
+                    host=current_config.MYSQL_HOST,
+                    port=current_config.MYSQL_PORT,
+                    user=current_config.MYSQL_USER,
+                    password=current_config.MYSQL_PASSWORD,
+                    database=current_config.MYSQL_DB,
+                    charset=current_config.MYSQL_CHARSET
+                )
+            return self._pool.get_connection()
+        if self._sqlite_conn is None:
+            self._sqlite_conn = sqlite3.connect(self.sqlite_path)
+            for statement in SQLITE_SCHEMA:
+                self._sqlite_conn.execute(statement)
+            self._sqlite_conn.commit()
+        return self._sqlite_conn
+
+    def _release(self, conn):
+        # 连接池中的连接 close() 即归还连接池；SQLite 连接由写入线程一直持有
+        if conn is not None and self.backend == 'mysql':
+            conn.close()
+
+    def _discard(self, conn):
+        try:
+            if conn is not None:
+                conn.rollback()
+        except Exception:
+            pass
+        if self.backend == 'sqlite' and self._sqlite_conn is not None:
+            try:
+                self._sqlite_conn.close()
+            except Exception:
+                pass
+            self._sqlite_conn = None
+        elif conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _close(self):
+        if self._sqlite_conn is not None:
+            self._sqlite_conn.close()
+            self._sqlite_conn = None
+
+
+# 全局事件写入器
+event_sink = EventSink()
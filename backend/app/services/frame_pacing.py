@@ -0,0 +1,152 @@
+import os
+import time
+
+
+# 推流的默认目标输出帧率（源帧率更低时按源帧率输出）
+RTMP_OUTPUT_FPS = float(os.environ.get('RTMP_OUTPUT_FPS', 25))
+# AI分析的默认目标帧率
+RTMP_ANALYSIS_FPS = float(os.environ.get('RTMP_ANALYSIS_FPS', 5))
+# 帧从解码到被处理的最长等待时间（秒），超过后直接丢弃
+RTMP_MAX_FRAME_AGE = float(os.environ.get('RTMP_MAX_FRAME_AGE', 0.5))
+# 源时间戳与墙上时钟的偏差超过该值（秒）时重新对齐（断流重连、时间戳跳变）
+SOURCE_CLOCK_RESYNC = 1.0
+# 处理耗时的滑动平均系数
+PROCESSING_TIME_SMOOTHING = 0.2
+
+# 流配置中 pacing 字段允许的键
+PACING_OPTIONS = ('output_fps', 'analysis_fps', 'max_frame_age')
+
+
+class SourceClock:
+    """
+    按源时间戳控制读取节奏。
+
+    第一帧把源时间戳对齐到墙上时钟，之后每一帧在其时间戳对应的时刻交给下游：
+    直播流的 read() 本身按源速率阻塞，通常无需等待；点播文件等读取快于实时的源
+    按时间戳放慢，而不是固定休眠。偏差过大时重新对齐。
+    """
+
+    def __init__(self, resync=SOURCE_CLOCK_RESYNC):
+        self.resync = resync
+        self._anchor = None
+
+    def wait_time(self, media_time, now=None):
+        """返回该帧还需要等待的时间（秒），0 表示立即处理"""
+        if media_time is None:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        if self._anchor is None:
+            self._anchor = (media_time, now)
+            return 0.0
+        anchor_media, anchor_wall = self._anchor
+        delay = anchor_wall + (media_time - anchor_media) - now
+        if abs(delay) > self.resync:
+            self._anchor = (media_time, now)
+            return 0.0
+        return max(0.0, delay)
+
+
+class StagePacer:
+    """
+    一个处理阶段（推流编码、AI分析）的调度。
+
+    - 帧从解码起超过 max_age 秒仍未处理时按过期丢弃（按帧龄，而不是按队列位置）；
+    - 按帧的源时间戳以 target_fps 抽帧，处理间隔取 1/target_fps 与实测平均处理耗时
+      中的较大者，处理跟不上时自动降低处理帧率，而不是让帧在队列中积压。
+    """
+
+    def __init__(self, target_fps, max_age=RTMP_MAX_FRAME_AGE):
+        self.target_fps = max(0.0, float(target_fps))
+        self.max_age = max(0.0, float(max_age))
+        self.processing_time = 0.0
+        self.latency = 0.0
+        self.processed_frames = 0
+        self.skipped_frames = 0
+        self.stale_frames = 0
+        self._next_due = None
+
+    @property
+    def interval(self):
+        target_interval = 1.0 / self.target_fps if self.target_fps > 0 else 0.0
+        return max(target_interval, self.processing_time)
+
+    def accept(self, media_time, captured_at, now=None):
+        """该帧是否需要处理；返回 False 时调用方应直接释放该帧"""
+        now = time.monotonic() if now is None else now
+        if self.max_age > 0 and now - captured_at > self.max_age:
+            self.stale_frames += 1
+            return False
+        if media_time is None:
+            media_time = captured_at
+
+        interval = self.interval
+        if self._next_due is not None and media_time < self._next_due - 1e-3:
+            if self._next_due - media_time <= SOURCE_CLOCK_RESYNC + interval:
+                self.skipped_frames += 1
+                return False
+            # 时间戳回退（重连等），重新开始调度
+            self._next_due = None
+
+        if self._next_due is None or media_time - self._next_due > interval:
+            self._next_due = media_time + interval
+        else:
+            # 按固定间隔累加，目标帧率不是源帧率的约数时也能保持平均帧率
+            self._next_due += interval
+        return True
+
+    def record(self, elapsed, captured_at, now=None):
+        """记录一次处理的耗时和该帧从解码到处理完成的延迟"""
+        now = time.monotonic() if now is None else now
+        if self.processed_frames == 0:
+            self.processing_time = elapsed
+        else:
+            self.processing_time += PROCESSING_TIME_SMOOTHING * (elapsed - self.processing_time)
+        self.latency = now - captured_at
+        self.processed_frames += 1
+
+    def stats(self):
+        return {
+            'target_fps': self.target_fps,
+            'effective_fps': 1.0 / self.interval if self.interval > 0 else None,
+            'processing_ms': self.processing_time * 1000,
+            'latency_ms': self.latency * 1000,
+            'processed_frames': self.processed_frames,
+            'skipped_frames': self.skipped_frames,
+            'stale_frames': self.stale_frames,
+        }
+
+
+class StreamPacing:
+    """一个流的读取时钟，以及推流和分析两个阶段各自的调度"""
+
+    def __init__(self, output_fps=RTMP_OUTPUT_FPS, analysis_fps=RTMP_ANALYSIS_FPS, max_frame_age=RTMP_MAX_FRAME_AGE):
+        self.output_fps = float(output_fps)
+        self.analysis_fps = float(analysis_fps)
+        self.max_frame_age = float(max_frame_age)
+        self.source = SourceClock()
+        self.streaming = StagePacer(self.output_fps, self.max_frame_age)
+        self.analysis = StagePacer(self.analysis_fps, self.max_frame_age)
+
+    @classmethod
+    def from_config(cls, config=None):
+        """根据流配置中的 pacing 字段创建，未指定的参数使用默认值"""
+        config = config or {}
+        return cls(**{key: config[key] for key in PACING_OPTIONS if key in config})
+
+    def update(self, config):
+        """更新目标帧率和最长帧龄（运行中生效，保留已测得的处理耗时）"""
+        for key in PACING_OPTIONS:
+            if key in config:
+                setattr(self, key, float(config[key]))
+        self.streaming.target_fps = max(0.0, self.output_fps)
+        self.analysis.target_fps = max(0.0, self.analysis_fps)
+        self.streaming.max_age = self.analysis.max_age = max(0.0, self.max_frame_age)
+
+    def stats(self):
+        return {
+            'output_fps': self.output_fps,
+            'analysis_fps': self.analysis_fps,
+            'max_frame_age': self.max_frame_age,
+            'streaming': self.streaming.stats(),
+            'analysis': self.analysis.stats(),
+        }
@@ -0,0 +1,95 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class FrameSlot:
+    """
+    帧池中的一个预分配缓冲区。
+
+    读取线程把帧直接解码到 array 中，再把同一个槽位交给推流和分析线程；每个持有者
+    各占一个引用，用完调用 release()，引用归零后槽位回到空闲列表等待复用。消费者
+    只能通过只读视图 frame 访问像素，缓冲区在所有引用释放前不会被覆盖。
+    """
+
+    __slots__ = ('pool', 'index', 'array', 'frame', 'refs', 'sequence', 'timestamp', 'media_time')
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.array = None
+        self.frame = None
+        self.refs = 0
+        self.sequence = 0
+        # 解码完成的时刻（time.monotonic）和帧的源时间戳（秒）
+        self.timestamp = None
+        self.media_time = None
+
+    def _allocate(self, shape, dtype):
+        self.array = np.empty(shape, dtype=dtype)
+        self.frame = self.array.view()
+        self.frame.flags.writeable = False
+
+    def retain(self):
+        """增加一个持有者（放入消费队列前调用）"""
+        with self.pool._lock:
+            self.refs += 1
+        return self
+
+    def release(self):
+        """释放一个引用，最后一个引用释放时槽位回到空闲列表"""
+        self.pool._release(self)
+
+
+class FramePool:
+    """
+    每个视频流一个的定长帧缓冲池（引用计数）。
+
+    所有缓冲区按帧尺寸预先分配并循环使用，读取线程解码、分发帧时不再为每一帧分配
+    新数组或复制像素；画面尺寸变化时空闲槽位在下次取用时按新尺寸重新分配。
+    """
+
+    def __init__(self, size, dtype=np.uint8):
+        self.dtype = dtype
+        self._slots = [FrameSlot(self, index) for index in range(max(1, int(size)))]
+        self._free = deque(self._slots)
+        self._lock = threading.Lock()
+        self._sequence = 0
+        # 没有空闲槽位而丢弃的帧数（说明消费者长时间占用了帧）
+        self.exhausted = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def acquire(self, shape):
+        """
+        取一个空闲槽位并由调用者持有一个引用，没有空闲槽位时返回 None。
+
+        槽位的数组与 shape 不一致时（首次使用或画面尺寸变化）重新分配。
+        """
+        with self._lock:
+            if not self._free:
+                self.exhausted += 1
+                return None
+            slot = self._free.popleft()
+            slot.refs = 1
+            self._sequence += 1
+            slot.sequence = self._sequence
+        if slot.array is None or slot.array.shape != tuple(shape):
+            slot._allocate(shape, self.dtype)
+        slot.timestamp = None
+        slot.media_time = None
+        return slot
+
+    def _release(self, slot):
+        with self._lock:
+            if slot.refs <= 0:
+                return
+            slot.refs -= 1
+            if slot.refs == 0:
+                self._free.append(slot)
+
+    def in_use(self):
+        with self._lock:
+            return len(self._slots) - len(self._free)
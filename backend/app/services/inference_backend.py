@@ -0,0 +1,272 @@
+import glob
+import json
+import os
+import threading
+
+import numpy as np
+from ultralytics import YOLO
+from ultralytics.utils import ASSETS
+
+
+# 支持的推理后端
+# pytorch:   直接加载 .pt 权重
+# onnx:      ONNX Runtime CPU 推理 (<权重名>.onnx)
+# openvino:  OpenVINO CPU 推理 (<权重名>_openvino_model/)
+# onnx_int8: ONNX Runtime INT8 量化模型 (<权重名>_int8.onnx，由 app.services.quantization 生成)
+SUPPORTED_BACKENDS = ('pytorch', 'onnx', 'openvino', 'onnx_int8')
+# 可以在加载时自动导出的后端（INT8 需要校准数据，只能离线生成）
+EXPORTABLE_BACKENDS = ('onnx', 'openvino')
+# 使用 ONNX Runtime 会话的后端，会话可在多个句柄间共享
+SHARED_SESSION_BACKENDS = ('onnx', 'onnx_int8')
+
+# 全局默认后端，可按模型单独覆盖，例如 INFERENCE_BACKEND_POSE=openvino
+DEFAULT_BACKEND = os.environ.get('INFERENCE_BACKEND', 'pytorch')
+
+# 导出产物与 PyTorch 输出对比时使用的样例图片：可按模型用 EXPORT_VALIDATION_IMAGES_<NAME>
+# 指定（图片目录或逗号分隔的图片路径）。ultralytics 自带的 COCO 样例图只对 COCO 类别的
+# 模型有意义，人脸、抽烟等模型必须提供自己的样例图，否则校验结果为"无法判定"。
+COCO_VALIDATION_IMAGES = [os.path.join(ASSETS, 'bus.jpg'), os.path.join(ASSETS, 'zidane.jpg')]
+DEFAULT_VALIDATION_IMAGES = {'pose': COCO_VALIDATION_IMAGES, 'object': COCO_VALIDATION_IMAGES}
+# 各模型实际推理使用的输入尺寸，校验时保持一致
+MODEL_IMGSZ = {'pose': 640, 'object': 640, 'face': 640, 'smoking': 1024}
+VALIDATION_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+VALIDATION_CONF = 0.1
+VALIDATION_IOU = 0.5
+# INT8 量化本身会带来少量偏差，一致率阈值相应放宽
+VALIDATION_MIN_AGREEMENT = {'onnx': 0.9, 'openvino': 0.9, 'onnx_int8': 0.8}
+
+
+def get_backend(model_name):
+    """读取模型的推理后端配置：INFERENCE_BACKEND_<NAME> 优先于 INFERENCE_BACKEND"""
+    backend = os.environ.get(f'INFERENCE_BACKEND_{model_name.upper()}', DEFAULT_BACKEND).strip().lower()
+    if backend not in SUPPORTED_BACKENDS:
+        print(f"⚠️ 未知的推理后端 '{backend}' ({model_name})，回退到 pytorch")
+        return 'pytorch'
+    return backend
+
+
+def exported_artifact_path(model_path, backend):
+    """返回 .pt 权重在指定后端下的导出产物路径（与 ultralytics 导出命名一致）"""
+    stem, _ = os.path.splitext(model_path)
+    if backend == 'onnx':
+        return stem + '.onnx'
+    if backend == 'openvino':
+        return stem + '_openvino_model'
+    if backend == 'onnx_int8':
+        return stem + '_int8.onnx'
+    return model_path
+
+
+def validation_report_path(artifact_path):
+    return artifact_path.rstrip('/\\') + '.validation.json'
+
+
+def validation_settings(model_name):
+    """返回模型的校验样例图片列表和输入尺寸 (images, imgsz)"""
+    imgsz = MODEL_IMGSZ.get(model_name, 640)
+    configured = os.environ.get(f'EXPORT_VALIDATION_IMAGES_{(model_name or "").upper()}', '').strip()
+    if not configured:
+        return list(DEFAULT_VALIDATION_IMAGES.get(model_name, [])), imgsz
+    if os.path.isdir(configured):
+        images = [path for path in sorted(glob.glob(os.path.join(configured, '*')))
+                  if path.lower().endswith(VALIDATION_IMAGE_EXTENSIONS)]
+    else:
+        images = [path.strip() for path in configured.split(',') if path.strip()]
+    return images, imgsz
+
+
+def export_model(model_path, backend):
+    """
+    将 .pt 权重导出为指定后端的产物。
+
+    使用动态输入导出，这样批量推理和不同的 imgsz（如抽烟检测的 640/1024）
+    都可以复用同一个导出产物。
+    """
+    model = YOLO(model_path)
+    fmt = 'onnx' if backend == 'onnx' else 'openvino'
+    print(f"正在导出 {os.path.basename(model_path)} -> {fmt} ...")
+    exported = model.export(format=fmt, dynamic=True, simplify=True)
+    return str(exported).rstrip('/\\')
+
+
+def _predict_boxes(model, image, imgsz):
+    """返回 (N, 6) 数组：x1, y1, x2, y2, conf, cls"""
+    result = model.predict(image, imgsz=imgsz, conf=VALIDATION_CONF, verbose=False)[0]
+    if result.boxes is None or len(result.boxes) == 0:
+        return np.zeros((0, 6), dtype=np.float32)
+    return result.boxes.data.cpu().numpy()[:, [0, 1, 2, 3, -2, -1]]
+
+
+def box_iou(a, b):
+    """计算两组 xyxy 框之间的 IoU 矩阵"""
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:4], b[None, :, 2:4])
+    inter = np.clip(br - tl, 0, None).prod(axis=2)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def box_agreement(reference, candidate, iou_threshold=VALIDATION_IOU):
+    """
+    以参考输出为基准计算检测结果的一致率。
+
+    同类别且 IoU 不低于阈值的框按置信度贪心一对一匹配，
+    一致率 = 匹配数 / max(参考框数, 候选框数)；两边都为空时无法判定，返回 None。
+    """
+    if len(reference) == 0 and len(candidate) == 0:
+        return None
+    if len(reference) == 0 or len(candidate) == 0:
+        return 0.0
+    iou = box_iou(reference, candidate)
+    iou[reference[:, 5][:, None] != candidate[:, 5][None, :]] = 0
+    matched = 0
+    used = np.zeros(len(candidate), dtype=bool)
+    for i in np.argsort(-reference[:, 4]):
+        candidates = np.where(~used & (iou[i] >= iou_threshold))[0]
+        if len(candidates) > 0:
+            used[candidates[np.argmax(iou[i, candidates])]] = True
+            matched += 1
+    return matched / max(len(reference), len(candidate))
+
+
+def mean_agreement(agreements):
+    """可判定图片（至少一边有检测框）的平均一致率，全部无法判定时返回 None"""
+    conclusive = [agreement for agreement in agreements if agreement is not None]
+    return float(np.mean(conclusive)) if conclusive else None
+
+
+def validate_export(model_path, artifact_path, backend, imgsz=640, images=None):
+    """
+    在样例图片上对比导出产物与 PyTorch 原始权重的检测结果，
+    并把对比报告写到产物旁边的 .validation.json 中。
+
+    两边都没有检测框的图片不计入一致率；没有任何可判定的图片时校验不通过
+    （inconclusive），需要为该模型提供包含目标的样例图片。
+    """
+    reference_model = YOLO(model_path)
+    candidate_model = YOLO(artifact_path, task=reference_model.task)
+    agreements = []
+    for image in images or []:
+        reference = _predict_boxes(reference_model, image, imgsz)
+        candidate = _predict_boxes(candidate_model, image, imgsz)
+        agreements.append(box_agreement(reference, candidate))
+
+    agreement = mean_agreement(agreements)
+    report = {
+        'model': os.path.basename(model_path),
+        'artifact': os.path.basename(artifact_path),
+        'imgsz': imgsz,
+        'agreement': agreement,
+        'per_image': agreements,
+        'inconclusive': agreement is None,
+        'passed': agreement is not None and agreement >= VALIDATION_MIN_AGREEMENT[backend],
+    }
+    with open(validation_report_path(artifact_path), 'w') as f:
+        json.dump(report, f, indent=4)
+    return report
+
+
+def _load_validation_report(artifact_path):
+    report_path = validation_report_path(artifact_path)
+    if not os.path.exists(report_path):
+        return None
+    try:
+        with open(report_path, 'r') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, IOError):
+        return None
+
+
+def _artifact_is_current(model_path, artifact_path):
+    return os.path.exists(artifact_path) and os.path.getmtime(artifact_path) >= os.path.getmtime(model_path)
+
+
+def prepare_backend(model_path, backend, model_name=None):
+    """
+    导出（产物缺失或早于 .pt 权重时）并校验指定后端的产物，返回校验报告。
+
+    导出和校验耗时较长，由 `python -m app.services.model_registry` 提前执行，
+    或在服务中由后台线程执行，不在请求路径上进行。
+    """
+    artifact_path = exported_artifact_path(model_path, backend)
+    exported = False
+    if not _artifact_is_current(model_path, artifact_path):
+        if backend not in EXPORTABLE_BACKENDS:
+            raise FileNotFoundError(
+                f"{os.path.basename(artifact_path)} 不存在或已过期，请先运行 python -m app.services.quantization"
+            )
+        artifact_path = export_model(model_path, backend)
+        exported = True
+    report = None if exported else _load_validation_report(artifact_path)
+    if report is None:
+        images, imgsz = validation_settings(model_name)
+        report = validate_export(model_path, artifact_path, backend, imgsz=imgsz, images=images)
+        if report['inconclusive']:
+            print(f"⚠️ 导出校验 {report['artifact']}: 样例图片上两边都没有检测结果，无法判定，"
+                  f"请设置 EXPORT_VALIDATION_IMAGES_{(model_name or '').upper()}")
+        else:
+            print(f"导出校验 {report['artifact']}: 一致率 {report['agreement']:.3f}")
+    return report
+
+
+# 正在后台导出/校验的产物，避免重复启动
+_pending_exports = set()
+_pending_exports_lock = threading.Lock()
+
+
+def _prepare_in_background(model_path, backend, model_name):
+    artifact_path = exported_artifact_path(model_path, backend)
+    with _pending_exports_lock:
+        if artifact_path in _pending_exports:
+            return
+        _pending_exports.add(artifact_path)
+
+    def run():
+        try:
+            report = prepare_backend(model_path, backend, model_name)
+            if report['passed']:
+                print(f"✅ {report['artifact']} 已导出并通过校验，下次启动时使用 {backend} 后端")
+        except Exception as e:
+            print(f"⚠️ 后台导出 {backend} 后端失败 ({os.path.basename(model_path)}): {e}")
+        finally:
+            with _pending_exports_lock:
+                _pending_exports.discard(artifact_path)
+
+    threading.Thread(target=run, name=f'export-{os.path.basename(artifact_path)}', daemon=True).start()
+
+
+def load_inference_model(model_path, backend='pytorch', model_name=None):
+    """
+    按指定后端加载模型。
+
+    非 PyTorch 后端只在产物存在、未过期且已通过校验时使用；产物缺失或尚未校验时先用
+    PyTorch 提供服务，同时在后台线程中导出并校验（不占用模型注册表的锁，不阻塞首个请求），
+    下次启动时生效。校验不通过时回退到 PyTorch，保证服务始终可用。
+    """
+    if backend != 'pytorch':
+        artifact_path = exported_artifact_path(model_path, backend)
+        try:
+            report = _load_validation_report(artifact_path) if _artifact_is_current(model_path, artifact_path) else None
+            if report is None:
+                if backend not in EXPORTABLE_BACKENDS:
+                    raise FileNotFoundError(
+                        f"{os.path.basename(artifact_path)} 不存在、已过期或未校验，请先运行 python -m app.services.quantization"
+                    )
+                print(f"⏳ {os.path.basename(artifact_path)} 尚未导出或校验，暂用 pytorch，后台导出中")
+                _prepare_in_background(model_path, backend, model_name)
+            elif report['passed']:
+                model = YOLO(artifact_path)
+                model.inference_backend = backend
+                return model
+            else:
+                reason = '无法判定' if report.get('inconclusive') else f"一致率 {report['agreement']:.3f}"
+                print(f"⚠️ {report['artifact']} 未通过与 PyTorch 输出的对比校验 ({reason})，回退到 pytorch")
+        except Exception as e:
+            print(f"⚠️ 加载 {backend} 后端失败 ({os.path.basename(model_path)}): {e}，回退到 pytorch")
+
+    model = YOLO(model_path)
+    # 提前融合Conv+BN，避免多个句柄首次推理时并发融合
+    model.fuse()
+    model.inference_backend = 'pytorch'
+    return model
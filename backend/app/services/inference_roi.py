@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+from ultralytics.engine.results import Results
+
+from app.services import danger_zone as danger_zone_service
+
+
+# 由危险区域推导ROI时向上额外扩展的高度（占帧高的比例）：
+# 判定用的是目标的脚底点，站在区域边缘的人身体会延伸到区域上方
+ROI_HEAD_ROOM = float(os.environ.get('ROI_HEAD_ROOM', 0.5))
+# 裁剪区域超过整帧面积的该比例时不再裁剪，直接整帧检测
+ROI_MAX_AREA_RATIO = 0.8
+
+
+def roi_bounds(polygon, frame_shape, padding=0, head_room=0.0):
+    """
+    计算多边形的外接裁剪区域 (x1, y1, x2, y2)。
+
+    参数:
+        polygon: 多边形顶点坐标列表
+        frame_shape: 帧的 shape
+        padding: 四周向外扩展的像素数
+        head_room: 向上额外扩展的高度（占帧高的比例）
+
+    返回:
+        裁剪区域；多边形无效或裁剪区域接近整帧时返回 None
+    """
+    if polygon is None or len(polygon) < 3:
+        return None
+    height, width = frame_shape[:2]
+    points = np.asarray(polygon, dtype=np.float32).reshape(-1, 2)
+    x1, y1 = points.min(axis=0) - padding
+    x2, y2 = points.max(axis=0) + padding
+    y1 -= head_room * height
+
+    x1, y1 = int(max(0, x1)), int(max(0, y1))
+    x2, y2 = int(min(width, x2)), int(min(height, y2))
+    if x2 - x1 < 32 or y2 - y1 < 32:
+        return None
+    if (x2 - x1) * (y2 - y1) >= ROI_MAX_AREA_RATIO * width * height:
+        return None
+    return x1, y1, x2, y2
+
+
+def danger_zone_roi_bounds(frame_shape):
+    """
+    根据当前配置计算本机摄像头/上传视频的推理裁剪区域。
+
+    优先使用显式配置的 INFERENCE_ROI，否则取全局危险区域和所有命名区域关注范围
+    （外接矩形加各自两倍安全距离，见 Zone.bounds）的并集；ROI 被关闭时返回 None（整帧检测）。
+    """
+    if not danger_zone_service.ROI_ENABLED:
+        return None
+    if len(danger_zone_service.INFERENCE_ROI) >= 3:
+        return roi_bounds(danger_zone_service.INFERENCE_ROI, frame_shape)
+    return roi_bounds(zones_roi_polygon(danger_zone_service.get_zone_index().zones), frame_shape, head_room=ROI_HEAD_ROOM)
+
+
+def zones_roi_polygon(zones):
+    """各区域关注范围（外接矩形加两倍安全距离，见 Zone.bounds）的角点，其外接区域即为推理ROI"""
+    return [
+        (x, y)
+        for x_min, y_min, x_max, y_max in (zone.bounds for zone in zones)
+        for x, y in ((x_min, y_min), (x_max, y_min), (x_max, y_max), (x_min, y_max))
+    ]
+
+
+def offset_results(result, frame, dx, dy):
+    """把在裁剪图上得到的检测结果平移回整帧坐标，并挂到整帧图像上"""
+    boxes = None
+    if result.boxes is not None:
+        boxes = result.boxes.data.clone()
+        boxes[:, [0, 2]] += dx
+        boxes[:, [1, 3]] += dy
+    keypoints = None
+    if result.keypoints is not None:
+        keypoints = result.keypoints.data.clone()
+        keypoints[..., 0] += dx
+        keypoints[..., 1] += dy
+    return Results(frame, path=result.path, names=result.names, boxes=boxes, keypoints=keypoints)
+
+
+def detect_in_roi(frame, bounds, detect):
+    """
+    只在裁剪区域内运行检测，结果映射回整帧坐标。
+
+    参数:
+        frame: 整帧图像
+        bounds: 裁剪区域 (x1, y1, x2, y2)，为 None 时整帧检测
+        detect: detect(image) -> Results 列表
+    """
+    if bounds is None:
+        return detect(frame)
+    x1, y1, x2, y2 = bounds
+    return [offset_results(result, frame, x1, y1) for result in detect(frame[y1:y2, x1:x2])]
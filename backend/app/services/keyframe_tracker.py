@@ -0,0 +1,141 @@
+import os
+
+import cv2
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+
+
+# 关键帧间隔：每 N 帧运行一次完整的检测+追踪，中间帧用光流传播检测框；1 表示每帧都检测
+KEYFRAME_INTERVAL = int(os.environ.get('KEYFRAME_INTERVAL', 1))
+# 每个检测框内用于光流跟踪的最多特征点数
+KEYFRAME_MAX_POINTS = 20
+# 检测框内成功跟踪的特征点少于该值时视为跟丢，立即重新检测
+KEYFRAME_MIN_POINTS = 3
+
+LK_PARAMS = dict(
+    winSize=(15, 15),
+    maxLevel=2,
+    criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03)
+)
+
+
+class KeyframeTracker:
+    """
+    关键帧检测 + 稀疏光流传播。
+
+    只在关键帧（每 keyframe_interval 帧、调用方触发或有目标跟丢时）运行检测器；
+    中间帧用 Lucas-Kanade 光流估计每个检测框内特征点的中位位移，平移检测框，
+    并构造与检测器输出格式相同的 Results（保留追踪ID、置信度和类别），
+    因此下游的徘徊计时、危险区域判断和绘制逻辑无需改动。
+
+    默认 KEYFRAME_INTERVAL=1，此时每帧都直接调用检测器，本类不做任何传播（功能关闭），
+    需要把 KEYFRAME_INTERVAL 设为大于 1 才会启用。每个检测模式（检测器）应使用各自的实例；
+    调用方跳过某些帧（如运动门控复用结果）时应调用 reset()，否则下一帧会从过期的灰度图传播。
+    """
+
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL, max_points=KEYFRAME_MAX_POINTS,
+                 min_points=KEYFRAME_MIN_POINTS):
+        self.keyframe_interval = max(1, int(keyframe_interval))
+        self.max_points = max_points
+        self.min_points = min_points
+        self.reset()
+
+    def reset(self):
+        """丢弃传播状态，下一帧必定作为关键帧检测"""
+        self._result = None
+        self._boxes = None
+        self._gray = None
+        self._points = None
+        self._owners = None
+        self._trackable = None
+        self._frames_since_keyframe = 0
+
+    def update(self, frame, detect, force=False):
+        """
+        处理一帧。
+
+        参数:
+            frame: 当前帧 (BGR)
+            detect: 无参调用，运行检测器并返回 Results 列表（如 lambda: model.track(frame, persist=True)）
+            force: 为 True 时强制把当前帧作为关键帧
+        """
+        if self.keyframe_interval == 1:
+            return detect()
+        if (force or self._result is None
+                or self._frames_since_keyframe + 1 >= self.keyframe_interval):
+            return self._keyframe(frame, detect)
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if len(self._boxes) > 0:
+            boxes = self._propagate(gray)
+            if boxes is None:
+                # 有目标跟丢，立即重新检测
+                return self._keyframe(frame, detect, gray)
+            self._boxes = boxes
+
+        self._gray = gray
+        self._frames_since_keyframe += 1
+        return [Results(
+            frame, path=self._result.path, names=self._result.names,
+            boxes=torch.from_numpy(self._boxes)
+        )]
+
+    def _keyframe(self, frame, detect, gray=None):
+        results = detect()
+        self._result = results[0]
+        boxes = self._result.boxes
+        self._boxes = boxes.data.cpu().numpy().astype(np.float32) if boxes is not None \
+            else np.zeros((0, 6), dtype=np.float32)
+        self._gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if gray is None else gray
+        self._seed_points()
+        self._frames_since_keyframe = 0
+        return results
+
+    def _seed_points(self):
+        """在每个检测框内重新选取特征点"""
+        points, owners = [], []
+        height, width = self._gray.shape
+        for i, (x1, y1, x2, y2) in enumerate(self._boxes[:, :4]):
+            x1, y1 = max(0, int(x1)), max(0, int(y1))
+            x2, y2 = min(width, int(x2)), min(height, int(y2))
+            if x2 - x1 < 4 or y2 - y1 < 4:
+                continue
+            corners = cv2.goodFeaturesToTrack(
+                self._gray[y1:y2, x1:x2], maxCorners=self.max_points, qualityLevel=0.01, minDistance=3
+            )
+            if corners is None:
+                continue
+            corners = corners.reshape(-1, 2) + (x1, y1)
+            points.append(corners)
+            owners.append(np.full(len(corners), i))
+        if points:
+            self._points = np.concatenate(points).astype(np.float32).reshape(-1, 1, 2)
+            self._owners = np.concatenate(owners)
+        else:
+            self._points = np.zeros((0, 1, 2), dtype=np.float32)
+            self._owners = np.zeros(0, dtype=int)
+        # 特征点太少的框（过小或无纹理）不参与光流，保持在关键帧的位置
+        self._trackable = np.bincount(self._owners, minlength=len(self._boxes)) >= self.min_points
+
+    def _propagate(self, gray):
+        """用光流平移所有检测框；有框跟丢时返回 None"""
+        if len(self._points) == 0:
+            return self._boxes
+        new_points, status, _ = cv2.calcOpticalFlowPyrLK(self._gray, gray, self._points, None, **LK_PARAMS)
+        good = status.reshape(-1) == 1
+        displacement = (new_points - self._points).reshape(-1, 2)
+
+        boxes = self._boxes.copy()
+        height, width = gray.shape
+        for i in np.flatnonzero(self._trackable):
+            mask = good & (self._owners == i)
+            if np.count_nonzero(mask) < self.min_points:
+                return None
+            dx, dy = np.median(displacement[mask], axis=0)
+            boxes[i, [0, 2]] = np.clip(boxes[i, [0, 2]] + dx, 0, width - 1)
+            boxes[i, [1, 3]] = np.clip(boxes[i, [1, 3]] + dy, 0, height - 1)
+
+        self._points = new_points[good]
+        self._owners = self._owners[good]
+        return boxes
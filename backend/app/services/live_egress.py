@@ -0,0 +1,409 @@
+import os
+import queue
+import struct
+import subprocess
+import threading
+
+import numpy as np
+from flask import Response
+
+
+# ffmpeg 可执行文件路径
+FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+# 编码模式的关键帧间隔（秒）：每个分片从关键帧开始，也是新观看者的最长等待时间
+LIVE_EGRESS_GOP_SECONDS = float(os.environ.get('LIVE_EGRESS_GOP_SECONDS', 0.5))
+# 编码模式的画质（x264 CRF，越大码率越低）
+LIVE_EGRESS_CRF = int(os.environ.get('LIVE_EGRESS_CRF', 28))
+# 每个观看者最多缓存的分片数，超过后丢弃最旧的分片（每个分片都能独立解码）
+LIVE_EGRESS_CLIENT_BUFFER = int(os.environ.get('LIVE_EGRESS_CLIENT_BUFFER', 8))
+# 编码模式等待写入 ffmpeg 的最大帧数，写入线程跟不上时丢弃最旧的帧（推流线程不会被阻塞）
+LIVE_EGRESS_FRAME_QUEUE = int(os.environ.get('LIVE_EGRESS_FRAME_QUEUE', 2))
+# 等待初始化分片 (ftyp + moov) 的超时时间（秒）
+LIVE_EGRESS_INIT_TIMEOUT = 10.0
+
+FMP4_MIMETYPE = 'video/mp4'
+# 编码模式按 Constrained Baseline / Level 4.0 编码；实际的编码字符串从初始化分片的 avcC 中读取
+# （x264 可能按分辨率调整 level），这里只是收到初始化分片之前的默认值
+ENCODE_CODEC = 'avc1.42E028'
+# 每个关键帧开始一个分片，moov 中不含样本，moof 使用默认基准偏移（MSE 要求的格式）
+FMP4_MUXER_ARGS = ['-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov+default_base_moof', 'pipe:1']
+# 源码流可以直接转封装的编码
+REMUX_CODECS = ('h264', 'avc1', 'x264')
+
+EGRESS_MODES = ('encode', 'remux')
+
+
+def _read_exact(stream, size):
+    """从管道读取恰好 size 个字节（无缓冲的管道一次 read 可能只返回一部分），流结束时返回 None"""
+    chunks = []
+    while size > 0:
+        chunk = stream.read(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def read_box(stream):
+    """从字节流读取一个 MP4 box，返回 (类型, 完整的box字节)，流结束时返回 (None, None)"""
+    header = _read_exact(stream, 8)
+    if header is None:
+        return None, None
+    size, box_type = struct.unpack('>I4s', header)
+    if size == 1:
+        large = _read_exact(stream, 8)
+        if large is None:
+            return None, None
+        header += large
+        size = struct.unpack('>Q', large)[0]
+    if size < len(header):
+        raise ValueError(f"无效的MP4 box大小: {size}")
+    payload = _read_exact(stream, size - len(header))
+    if payload is None:
+        return None, None
+    return box_type.decode('latin-1'), header + payload
+
+
+def avc_codec_string(init_segment):
+    """从初始化分片的 avcC 中取出 MSE 使用的编码字符串（如 avc1.640028），找不到时返回 None"""
+    index = init_segment.find(b'avcC')
+    if index < 0 or len(init_segment) < index + 8:
+        return None
+    profile, compatibility, level = init_segment[index + 5:index + 8]
+    return f"avc1.{profile:02X}{compatibility:02X}{level:02X}"
+
+
+class EgressSubscription:
+    """一个观看者：先收到初始化分片，之后按顺序收到媒体分片（moof + mdat）"""
+
+    def __init__(self, egress, buffer_size=LIVE_EGRESS_CLIENT_BUFFER):
+        self.egress = egress
+        self.dropped = 0
+        # 是否已经收到初始化分片；编码进程重启（画面尺寸变化）后新的初始化分片随媒体分片一起送达
+        self.received_init = False
+        self._queue = queue.Queue(maxsize=max(1, buffer_size))
+        self._closed = threading.Event()
+
+    def offer(self, fragment):
+        """放入一个分片，缓存已满时丢弃最旧的分片（不阻塞编码线程）"""
+        try:
+            self._queue.put_nowait(fragment)
+            return
+        except queue.Full:
+            pass
+        try:
+            self._queue.get_nowait()
+            self.dropped += 1
+        except queue.Empty:
+            pass
+        try:
+            self._queue.put_nowait(fragment)
+        except queue.Full:
+            self.dropped += 1
+
+    def segments(self, timeout=1.0):
+        """HTTP 响应用的生成器：初始化分片，之后是持续到达的媒体分片，直到输出结束或取消订阅"""
+        init_segment = self.egress.wait_init(LIVE_EGRESS_INIT_TIMEOUT)
+        if init_segment is None:
+            return
+        self.received_init = True
+        yield init_segment
+        while not self._closed.is_set():
+            try:
+                fragment = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                continue
+            if fragment is None:
+                break
+            yield fragment
+
+    @property
+    def closed(self):
+        return self._closed.is_set()
+
+    def close(self):
+        """取消订阅；最后一个观看者离开时编码进程随之停止"""
+        if not self._closed.is_set():
+            self._closed.set()
+            self.egress.unsubscribe(self)
+
+
+class FragmentedMP4Egress:
+    """
+    一路视频的 H.264 分片 MP4 (fMP4) 直播输出，浏览器通过 Media Source Extensions 播放。
+
+    每路视频只运行一个 ffmpeg 进程，输出按 MP4 box 切分为初始化分片和媒体分片，再分发给
+    所有观看者，画面只编码一次：
+    - encode 模式：由 write_frame() 送入 BGR 帧（可带叠加的检测结果），x264 以
+      ultrafast / zerolatency 编码；
+    - remux 模式：ffmpeg 直接读取源地址，把源 H.264 码流转封装为 fMP4，不解码也不重新编码。
+
+    每个媒体分片从关键帧开始，新观看者收到初始化分片后从下一个分片开始即可解码；观看者
+    跟不上时丢弃整个分片，不会破坏解码。没有观看者时 ffmpeg 进程停止。
+    """
+
+    def __init__(self, mode, source_url=None, fps=25.0, name=''):
+        if mode not in EGRESS_MODES:
+            raise ValueError(f"未知的输出模式: {mode}")
+        if mode == 'remux' and not source_url:
+            raise ValueError("remux 模式需要源地址")
+        self.mode = mode
+        self.source_url = source_url
+        self.fps = float(fps) if fps and fps > 0 else 25.0
+        self.name = name
+        self.codec = ENCODE_CODEC if mode == 'encode' else None
+        self.init_segment = None
+        self.fragments = 0
+        # 写入线程跟不上而丢弃的帧数
+        self.dropped_frames = 0
+        self._frame_size = None
+        self._process = None
+        # 当前编码进程的待写入帧队列，元素为 (帧, 持有者)，None 表示写入线程退出
+        self._frames = None
+        self._subscriptions = []
+        self._init_ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    @property
+    def running(self):
+        return self._process is not None and self._process.poll() is None
+
+    def _command(self, frame_size=None):
+        command = [FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error']
+        if self.mode == 'remux':
+            command += ['-nostdin', '-fflags', 'nobuffer', '-flags', 'low_delay', '-i', self.source_url,
+                        '-map', '0:v:0', '-c:v', 'copy', '-an']
+        else:
+            width, height = frame_size
+            gop = max(1, int(round(self.fps * LIVE_EGRESS_GOP_SECONDS)))
+            # 帧率随帧调度变化，时间戳取帧到达的墙上时间（可变帧率），关键帧按时间间隔强制插入
+            command += ['-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}',
+                        '-use_wallclock_as_timestamps', '1', '-i', 'pipe:0', '-vsync', '0',
+                        # yuv420p 要求宽高为偶数
+                        '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+                        '-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency',
+                        '-profile:v', 'baseline', '-level:v', '4.0', '-pix_fmt', 'yuv420p',
+                        '-crf', str(LIVE_EGRESS_CRF), '-g', str(gop), '-sc_threshold', '0',
+                        '-force_key_frames', f'expr:gte(t,n_forced*{LIVE_EGRESS_GOP_SECONDS:g})', '-an']
+        return command + FMP4_MUXER_ARGS
+
+    def _start(self, frame_size=None):
+        """启动 ffmpeg 进程（调用方持有锁）"""
+        self.init_segment = None
+        self._init_ready.clear()
+        self._frame_size = frame_size
+        self._process = subprocess.Popen(
+            self._command(frame_size),
+            stdin=subprocess.PIPE if self.mode == 'encode' else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            bufsize=0
+        )
+        threading.Thread(target=self._read_loop, args=(self._process,), daemon=True).start()
+        if self.mode == 'encode':
+            self._frames = queue.Queue(maxsize=max(1, LIVE_EGRESS_FRAME_QUEUE))
+            threading.Thread(target=self._write_loop, args=(self._process, self._frames), daemon=True).start()
+        print(f"🎞️ fMP4 直播输出已启动 ({self.mode}): {self.name}")
+
+    def _stop(self):
+        """停止 ffmpeg 进程（调用方持有锁）"""
+        self._close_frames()
+        process, self._process = self._process, None
+        if process is None:
+            return
+        try:
+            if process.stdin:
+                process.stdin.close()
+        except OSError:
+            pass
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        print(f"🎞️ fMP4 直播输出已停止: {self.name}")
+
+    def subscribe(self):
+        """新增一个观看者；remux 模式下第一个观看者到来时启动 ffmpeg"""
+        subscription = EgressSubscription(self)
+        with self._lock:
+            self._subscriptions.append(subscription)
+            if self.mode == 'remux' and not self.running:
+                self._start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+            if not self._subscriptions:
+                self._stop()
+
+    def close(self):
+        """停止输出并结束所有观看者的响应"""
+        with self._lock:
+            subscriptions, self._subscriptions = self._subscriptions, []
+            self._stop()
+        for subscription in subscriptions:
+            subscription.offer(None)
+
+    def write_frame(self, frame, owner=None):
+        """
+        encode 模式下送入一帧（BGR）。没有观看者时直接返回 False，不做任何编码工作。
+
+        帧只放入有界队列，由写入线程写入 ffmpeg 的管道；编码跟不上时丢弃最旧的帧，
+        调用方（推流线程）不会被阻塞。owner 为帧内存的持有者（如帧池槽位）时不复制帧，
+        入队时 retain()，写入或丢弃后 release()；未提供时复制一份。
+        """
+        if self.mode != 'encode' or not self._subscriptions:
+            return False
+        frame_size = (frame.shape[1], frame.shape[0])
+        if owner is None:
+            frame = frame.copy()
+        with self._lock:
+            if not self._subscriptions:
+                return False
+            if not self.running or self._frame_size != frame_size:
+                # 首次写入或画面尺寸变化时（重新）启动编码进程
+                self._stop()
+                self._start(frame_size)
+            # 在锁内入队：进程停止后不会再有帧进入已关闭的队列
+            if owner is not None:
+                owner.retain()
+            self._offer_frame(self._frames, (frame, owner))
+        return True
+
+    def _offer_frame(self, frames, item):
+        """放入一帧（或退出标记 None），队列已满时丢弃并释放最旧的帧（调用方持有锁）"""
+        while True:
+            try:
+                frames.put_nowait(item)
+                return
+            except queue.Full:
+                pass
+            try:
+                _, dropped_owner = frames.get_nowait()
+                self.dropped_frames += 1
+                if dropped_owner is not None:
+                    dropped_owner.release()
+            except queue.Empty:
+                pass
+
+    def _close_frames(self):
+        """通知当前的写入线程退出（调用方持有锁），剩余的帧由写入线程释放"""
+        frames, self._frames = self._frames, None
+        if frames is not None:
+            self._offer_frame(frames, None)
+
+    def _write_loop(self, process, frames):
+        """写入线程：把队列中的帧写入 ffmpeg（直接使用帧的内存，不额外复制），直到收到退出标记"""
+        failed = False
+        while True:
+            item = frames.get()
+            if item is None:
+                break
+            frame, owner = item
+            try:
+                if not failed:
+                    process.stdin.write(memoryview(np.ascontiguousarray(frame)).cast('B'))
+            except (BrokenPipeError, OSError, ValueError) as e:
+                # 进程已退出：不再写入，但继续释放队列中的帧直到退出标记
+                failed = True
+                print(f"❌ fMP4 编码写入失败 {self.name}: {e}")
+            finally:
+                if owner is not None:
+                    owner.release()
+
+    def wait_init(self, timeout=None):
+        """等待并返回初始化分片 (ftyp + moov)，超时返回 None"""
+        self._init_ready.wait(timeout)
+        return self.init_segment
+
+    def _read_loop(self, process):
+        """把 ffmpeg 的输出按 box 切分：ftyp + moov 为初始化分片，moof + mdat 为一个媒体分片"""
+        init_parts = []
+        fragment_parts = []
+        try:
+            while True:
+                box_type, box = read_box(process.stdout)
+                if box is None:
+                    break
+                if box_type in ('ftyp', 'moov'):
+                    init_parts.append(box)
+                    if box_type == 'moov':
+                        self.init_segment = b''.join(init_parts)
+                        # 两种模式都以实际输出的 avcC 为准
+                        self.codec = avc_codec_string(self.init_segment) or (
+                            ENCODE_CODEC if self.mode == 'encode' else None
+                        )
+                        self._init_ready.set()
+                        for subscription in list(self._subscriptions):
+                            if subscription.received_init:
+                                subscription.offer(self.init_segment)
+                elif box_type == 'mdat':
+                    fragment_parts.append(box)
+                    fragment = b''.join(fragment_parts)
+                    fragment_parts = []
+                    self.fragments += 1
+                    for subscription in list(self._subscriptions):
+                        subscription.offer(fragment)
+                else:
+                    # moof（以及可能出现的 styp / sidx 等）属于下一个媒体分片
+                    fragment_parts.append(box)
+        except Exception as e:
+            print(f"❌ fMP4 输出解析错误 {self.name}: {e}")
+        finally:
+            process.stdout.close()
+            # 进程意外退出（如源断开）时结束所有观看者的响应
+            with self._lock:
+                if self._process is process:
+                    self._process = None
+                    self._close_frames()
+                    subscriptions, self._subscriptions = self._subscriptions, []
+                else:
+                    subscriptions = []
+            for subscription in subscriptions:
+                subscription.offer(None)
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'codec': self.codec,
+            'running': self.running,
+            'viewers': len(self._subscriptions),
+            'fragments': self.fragments,
+            'dropped_frames': self.dropped_frames,
+            'dropped': sum(subscription.dropped for subscription in self._subscriptions),
+        }
+
+
+def can_remux(codec):
+    """源编码是否可以直接转封装为 fMP4"""
+    return bool(codec) and codec.lower() in REMUX_CODECS
+
+
+def fmp4_response(subscription):
+    """
+    把订阅包装为持续输出的 fMP4 HTTP 响应（前端用 fetch 读取后追加到 MSE 的 SourceBuffer）。
+
+    先等待初始化分片，以便在响应头 X-MSE-Codec 中给出准确的编码字符串；客户端断开时取消订阅。
+    """
+    if subscription.egress.wait_init(LIVE_EGRESS_INIT_TIMEOUT) is None:
+        subscription.close()
+        return Response("直播输出未就绪。", status=504, mimetype='text/plain')
+
+    def generate():
+        try:
+            yield from subscription.segments()
+        finally:
+            subscription.close()
+
+    codec = subscription.egress.codec or ENCODE_CODEC
+    return Response(generate(), mimetype=FMP4_MIMETYPE, headers={
+        'Cache-Control': 'no-cache',
+        'X-MSE-Codec': codec,
+        'Access-Control-Expose-Headers': 'X-MSE-Codec',
+    })
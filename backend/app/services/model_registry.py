@@ -0,0 +1,142 @@
+import argparse
+import copy
+import os
+import threading
+
+import numpy as np
+from ultralytics.utils import callbacks
+
+from app.services.inference_backend import SHARED_SESSION_BACKENDS, get_backend, load_inference_model, prepare_backend
+from app.services.smoking_detection_service import SmokingDetectionService
+
+
+# --- 模型路径 (使用相对路径) ---
+# 路径是相对于 backend/app/services/ 目录的
+# '../../..' 回退到项目根目录
+BASE_PATH = os.path.join(os.path.dirname(__file__), '..', '..', '..')
+MODEL_DIR = os.path.join(BASE_PATH, 'yolo-Weights') # 统一存放在 yolo-Weights 文件夹
+
+# 默认使用 nano 姿态模型，CPU 上也能按摄像头帧率运行跌倒检测；可用 POSE_MODEL 切换为 yolov8s-pose.pt 等
+POSE_MODEL_PATH = os.path.join(MODEL_DIR, os.environ.get('POSE_MODEL', "yolov8n-pose.pt"))
+OBJECT_MODEL_PATH = os.path.join(MODEL_DIR, "yolov8n.pt")
+FACE_MODEL_PATH = os.path.join(MODEL_DIR, "yolov8n-face-lindevs.pt")
+SMOKING_MODEL_PATH = os.path.join(MODEL_DIR, "smoking_detection.pt")
+MODEL_PATHS = {
+    'pose': POSE_MODEL_PATH,
+    'object': OBJECT_MODEL_PATH,
+    'face': FACE_MODEL_PATH,
+    'smoking': SMOKING_MODEL_PATH,
+}
+
+
+class ModelRegistry:
+    """
+    进程级模型注册表。
+
+    每个权重文件在进程内只从磁盘加载一次；各个实时流、上传任务通过
+    create_handle() 获取一个轻量级句柄：句柄与共享实例使用同一份网络权重，
+    但拥有自己的 predictor 与追踪器 (ByteTrack) 状态，互不干扰。
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, loader):
+        """注册一个模型加载函数，模型在首次使用时才加载"""
+        self._loaders[name] = loader
+
+    def get(self, name):
+        """获取共享的模型实例（首次调用时加载，线程安全）"""
+        model = self._models.get(name)
+        if model is None:
+            with self._lock:
+                model = self._models.get(name)
+                if model is None:
+                    if name not in self._loaders:
+                        raise KeyError(f"未注册的模型: {name}")
+                    print(f"正在加载模型权重: {name}")
+                    model = self._loaders[name]()
+                    if getattr(model, 'inference_backend', None) in SHARED_SESSION_BACKENDS:
+                        # 预先创建 predictor 和 ONNX Runtime 会话，供句柄共享
+                        model.predict(np.zeros((64, 64, 3), dtype=np.uint8), verbose=False)
+                    self._models[name] = model
+        return model
+
+    def create_handle(self, name):
+        """
+        为单个流或任务创建模型句柄。
+
+        句柄是共享YOLO实例的浅拷贝：网络权重 (model.model) 共享，
+        predictor、回调和参数覆盖各自独立，因此 track(persist=True) 的
+        追踪器状态只属于这个句柄。
+        """
+        base = self.get(name)
+        handle = copy.copy(base)
+        # nn.Module 的子模块字典需要单独拷贝，避免句柄上的赋值影响共享实例
+        handle.__dict__['_modules'] = base._modules.copy()
+        handle.callbacks = callbacks.get_default_callbacks()
+        handle.overrides = dict(base.overrides)
+        handle.predictor = None
+        if getattr(base, 'inference_backend', None) in SHARED_SESSION_BACKENDS:
+            self._share_onnx_session(base, handle)
+        return handle
+
+    @staticmethod
+    def _share_onnx_session(base, handle):
+        """
+        ONNX 后端的权重由 InferenceSession 持有，且会话支持多线程并发 run，
+        因此为句柄新建 predictor 时直接复用共享实例的会话，不再重复加载。
+        （OpenVINO 编译模型的默认推理请求不是线程安全的，仍由每个句柄各自加载。）
+        """
+        predictor = type(base.predictor)(
+            overrides={**handle.overrides, 'mode': 'predict', 'save': False},
+            _callbacks=handle.callbacks
+        )
+        predictor.model = base.predictor.model
+        predictor.device = base.predictor.device
+        handle.predictor = predictor
+
+    def create_handles(self, *names):
+        """一次创建多个模型句柄，返回 {名称: 句柄} 字典"""
+        return {name: self.create_handle(name) for name in names}
+
+
+# 创建全局实例
+model_registry = ModelRegistry()
+# 每个模型的推理后端由 INFERENCE_BACKEND / INFERENCE_BACKEND_<NAME> 环境变量选择
+model_registry.register('pose', lambda: load_inference_model(POSE_MODEL_PATH, get_backend('pose'), 'pose'))
+model_registry.register('object', lambda: load_inference_model(OBJECT_MODEL_PATH, get_backend('object'), 'object'))
+model_registry.register('face', lambda: load_inference_model(FACE_MODEL_PATH, get_backend('face'), 'face'))
+# 抽烟检测服务只做无状态的 predict，直接共享同一个实例即可
+model_registry.register(
+    'smoking',
+    lambda: SmokingDetectionService(model_path=SMOKING_MODEL_PATH, backend=get_backend('smoking'))
+)
+
+
+def export_backends(names=None):
+    """
+    部署前按 INFERENCE_BACKEND 配置提前导出并校验各模型的推理产物，
+    服务启动时即可直接加载，不在首个请求中导出。
+    """
+    results = {}
+    for name in names or MODEL_PATHS:
+        backend = get_backend(name)
+        if backend == 'pytorch':
+            continue
+        try:
+            report = prepare_backend(MODEL_PATHS[name], backend, name)
+            results[name] = report
+            status = '通过' if report['passed'] else ('无法判定' if report['inconclusive'] else '未通过')
+            print(f"{name:<10}{backend:<12}{status}")
+        except Exception as e:
+            print(f"❌ {name} 导出 {backend} 失败: {e}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='提前导出并校验各模型的推理后端产物')
+    parser.add_argument('models', nargs='*', choices=sorted(MODEL_PATHS), help='要导出的模型，默认全部')
+    export_backends(parser.parse_args().models)
@@ -0,0 +1,120 @@
+import copy
+import os
+import time
+
+import cv2
+import numpy as np
+
+
+# 运动门控的默认参数，可被每个流的配置覆盖
+# 像素灰度差超过该值才算"变化"
+MOTION_DIFF_THRESHOLD = int(os.environ.get('MOTION_DIFF_THRESHOLD', 25))
+# 变化像素占比超过该值才认为画面有运动
+MOTION_MIN_AREA_RATIO = float(os.environ.get('MOTION_MIN_AREA_RATIO', 0.002))
+# 静止画面下强制重新检测的间隔（秒）
+MOTION_REFRESH_INTERVAL = float(os.environ.get('MOTION_REFRESH_INTERVAL', 5.0))
+# 运动判断使用的缩小后图像宽度
+MOTION_FRAME_WIDTH = int(os.environ.get('MOTION_FRAME_WIDTH', 160))
+MOTION_GATE_ENABLED = os.environ.get('MOTION_GATE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# 流配置中 motion_gate 字段允许的键
+GATE_OPTIONS = ('enabled', 'diff_threshold', 'min_motion_ratio', 'refresh_interval', 'frame_width')
+
+
+class MotionGate:
+    """
+    运动门控：在缩小的灰度帧上做帧差，画面静止时跳过检测器，复用上一次的检测结果。
+
+    参考帧为上一次执行检测时的画面，因此缓慢的变化（如光线渐变、目标缓慢移动）
+    累积到阈值后同样会触发检测；另外每隔 refresh_interval 秒强制检测一次，
+    避免长时间复用过期结果。
+    """
+
+    def __init__(self, enabled=MOTION_GATE_ENABLED, diff_threshold=MOTION_DIFF_THRESHOLD,
+                 min_motion_ratio=MOTION_MIN_AREA_RATIO, refresh_interval=MOTION_REFRESH_INTERVAL,
+                 frame_width=MOTION_FRAME_WIDTH):
+        self.enabled = bool(enabled)
+        self.diff_threshold = int(diff_threshold)
+        self.min_motion_ratio = float(min_motion_ratio)
+        self.refresh_interval = float(refresh_interval)
+        self.frame_width = max(16, int(frame_width))
+        self.last_motion_ratio = 0.0
+        self.detected_frames = 0
+        self.skipped_frames = 0
+        self._reference = None
+        self._last_detect_time = None
+
+    @classmethod
+    def from_config(cls, config=None):
+        """根据流配置中的 motion_gate 字段创建门控，未指定的参数使用默认值"""
+        config = config or {}
+        return cls(**{key: config[key] for key in GATE_OPTIONS if key in config})
+
+    def update(self, config):
+        """更新门控参数（运行中生效）"""
+        options = {key: getattr(self, key) for key in GATE_OPTIONS}
+        options.update({key: config[key] for key in GATE_OPTIONS if key in config})
+        self.__init__(**options)
+
+    def reset(self):
+        """清空参考帧，下一帧必定执行检测"""
+        self._reference = None
+        self._last_detect_time = None
+
+    def _preprocess(self, frame):
+        height, width = frame.shape[:2]
+        small_height = max(1, int(height * self.frame_width / width))
+        small = cv2.resize(frame, (self.frame_width, small_height), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def should_detect(self, frame, timestamp=None):
+        """判断当前帧是否需要运行检测器；返回 False 时调用方应复用上一次的结果"""
+        if not self.enabled:
+            return True
+
+        now = time.time() if timestamp is None else timestamp
+        gray = self._preprocess(frame)
+
+        if (self._reference is None or self._reference.shape != gray.shape
+                or now - self._last_detect_time >= self.refresh_interval):
+            return self._accept(gray, now)
+
+        diff = cv2.absdiff(gray, self._reference)
+        self.last_motion_ratio = np.count_nonzero(diff > self.diff_threshold) / diff.size
+        if self.last_motion_ratio >= self.min_motion_ratio:
+            return self._accept(gray, now)
+
+        self.skipped_frames += 1
+        return False
+
+    def _accept(self, gray, now):
+        self._reference = gray
+        self._last_detect_time = now
+        self.detected_frames += 1
+        return True
+
+    def stats(self):
+        total = self.detected_frames + self.skipped_frames
+        return {
+            'enabled': self.enabled,
+            'detected_frames': self.detected_frames,
+            'skipped_frames': self.skipped_frames,
+            'skip_ratio': self.skipped_frames / total if total else 0.0,
+            'last_motion_ratio': self.last_motion_ratio,
+        }
+
+
+def reuse_results(results, frame):
+    """
+    把上一次的 YOLO 检测结果挂到新的帧上复用。
+
+    Results 只做浅拷贝并替换原图，这样 plot() 等绘制操作作用在当前帧上，
+    检测框、类别和追踪ID保持不变。
+    """
+    reused = []
+    for result in results:
+        result = copy.copy(result)
+        result.orig_img = frame
+        reused.append(result)
+    return reused
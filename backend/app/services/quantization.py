@@ -0,0 +1,419 @@
+"""
+INT8 量化流水线
+
+使用本地样例帧目录作为校准数据，为 yolo-Weights/ 下的 YOLO 权重生成
+ONNX Runtime INT8 模型 (<权重名>_int8.onnx)，为暴力检测模型 (vd.hdf5)
+及其 VGG16 特征提取器生成 TFLite INT8 模型，并输出与 FP32 原模型对比的
+精度 (mAP50 / 一致率) 与单帧延迟报告。
+
+使用方法 (在 backend 目录下):
+    python -m app.services.quantization --frames ../data/calib_frames
+    python -m app.services.quantization --frames ../data/calib_frames --eval-frames ../data/eval_frames
+    python -m app.services.quantization --frames ../data/calib_frames --models yolov8n.pt --skip-violence
+
+生成的 *_int8.onnx 可以通过 INFERENCE_BACKEND=onnx_int8（或 INFERENCE_BACKEND_<NAME>=onnx_int8）启用。
+"""
+import glob
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+import onnx
+from onnxruntime.quantization import (
+    CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, quantize_static
+)
+from ultralytics import YOLO
+from ultralytics.data.augment import LetterBox
+
+from app.services.inference_backend import (
+    VALIDATION_MIN_AGREEMENT, box_agreement, box_iou, export_model, exported_artifact_path, mean_agreement,
+    validation_report_path
+)
+from app.services.model_registry import MODEL_DIR
+
+
+VIOLENCE_MODEL_PATH = os.path.join(os.path.dirname(__file__), 'vd.hdf5')
+IMAGE_EXTENSIONS = ('*.jpg', '*.jpeg', '*.png', '*.bmp')
+# 评估时 FP32 输出作为伪标注使用的置信度阈值
+REFERENCE_CONF = 0.25
+# 未提供独立评估帧时，从校准帧末尾留出的评估比例（按文件名顺序切分，避免相邻帧同时出现在两边）
+EVAL_HOLDOUT_RATIO = 0.2
+# 计算 mAP 时 INT8 输出保留的最低置信度
+MAP_CONF = 0.001
+# 暴力检测的窗口长度（与 video.py 中的缓冲区一致）和滑动步长
+VIOLENCE_WINDOW = 20
+VIOLENCE_STRIDE = 10
+
+
+def load_frames(folder, limit=None):
+    """按文件名顺序读取目录中的样例帧"""
+    paths = sorted(p for ext in IMAGE_EXTENSIONS for p in glob.glob(os.path.join(folder, ext)))
+    frames = []
+    for path in paths[:limit]:
+        frame = cv2.imread(path)
+        if frame is not None:
+            frames.append(frame)
+    if not frames:
+        raise FileNotFoundError(f"目录中没有可用的样例帧: {folder}")
+    return frames
+
+
+class FrameCalibrationReader(CalibrationDataReader):
+    """按 ultralytics 的预处理方式（letterbox、BGR->RGB、/255）逐帧提供校准输入"""
+
+    def __init__(self, onnx_path, frames, imgsz=640):
+        self.input_name = onnx.load(onnx_path, load_external_data=False).graph.input[0].name
+        self.frames = frames
+        self.letterbox = LetterBox((imgsz, imgsz), auto=False)
+        self._index = 0
+
+    def get_next(self):
+        if self._index >= len(self.frames):
+            return None
+        image = self.letterbox(image=self.frames[self._index])
+        self._index += 1
+        tensor = image[..., ::-1].transpose(2, 0, 1)[None].astype(np.float32) / 255.0
+        return {self.input_name: np.ascontiguousarray(tensor)}
+
+    def rewind(self):
+        self._index = 0
+
+
+def quantize_yolo(model_path, calib_frames, imgsz=640):
+    """
+    将 YOLO 权重量化为 ONNX Runtime INT8 模型 (QDQ 格式，权重按通道量化)。
+    FP32 ONNX 复用推理后端的动态输入导出产物。
+    """
+    fp32_path = exported_artifact_path(model_path, 'onnx')
+    if not os.path.exists(fp32_path) or os.path.getmtime(fp32_path) < os.path.getmtime(model_path):
+        fp32_path = export_model(model_path, 'onnx')
+    int8_path = exported_artifact_path(model_path, 'onnx_int8')
+
+    print(f"正在量化 {os.path.basename(fp32_path)} -> {os.path.basename(int8_path)} (校准帧: {len(calib_frames)})")
+    quantize_static(
+        fp32_path,
+        int8_path,
+        FrameCalibrationReader(fp32_path, calib_frames, imgsz),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        calibrate_method=CalibrationMethod.MinMax,
+    )
+
+    # ultralytics 依赖 ONNX 元数据 (stride / names / task / imgsz) 加载模型，量化后需要补回
+    fp32_model = onnx.load(fp32_path)
+    int8_model = onnx.load(int8_path)
+    del int8_model.metadata_props[:]
+    int8_model.metadata_props.extend(fp32_model.metadata_props)
+    onnx.save(int8_model, int8_path)
+    return int8_path
+
+
+def _predict(model, frame, conf, imgsz):
+    """返回 ((N, 6) 检测数组, 耗时毫秒)"""
+    start = time.perf_counter()
+    result = model.predict(frame, imgsz=imgsz, conf=conf, verbose=False)[0]
+    elapsed = (time.perf_counter() - start) * 1000
+    if result.boxes is None or len(result.boxes) == 0:
+        return np.zeros((0, 6), dtype=np.float32), elapsed
+    return result.boxes.data.cpu().numpy()[:, [0, 1, 2, 3, -2, -1]], elapsed
+
+
+def mean_average_precision_50(references, candidates):
+    """以 FP32 输出为伪标注，计算候选输出在 IoU=0.5 下的 mAP"""
+    classes = set()
+    for reference in references:
+        classes.update(reference[:, 5].astype(int).tolist())
+
+    aps = []
+    for cls in classes:
+        scores, hits, num_targets = [], [], 0
+        for reference, candidate in zip(references, candidates):
+            targets = reference[reference[:, 5] == cls]
+            detections = candidate[candidate[:, 5] == cls]
+            detections = detections[np.argsort(-detections[:, 4])]
+            num_targets += len(targets)
+            matched = np.zeros(len(targets), dtype=bool)
+            iou = box_iou(detections, targets) if len(detections) and len(targets) else None
+            for i, detection in enumerate(detections):
+                hit = False
+                if iou is not None:
+                    j = int(np.argmax(iou[i]))
+                    if iou[i, j] >= 0.5 and not matched[j]:
+                        matched[j] = hit = True
+                scores.append(detection[4])
+                hits.append(hit)
+        if num_targets == 0:
+            continue
+        if not hits:
+            aps.append(0.0)
+            continue
+        order = np.argsort(-np.array(scores))
+        tp = np.array(hits)[order]
+        tp_cum, fp_cum = np.cumsum(tp), np.cumsum(~tp)
+        recall = tp_cum / num_targets
+        precision = tp_cum / np.maximum(tp_cum + fp_cum, 1e-9)
+        # 全点插值
+        mrec = np.concatenate(([0.0], recall, [1.0]))
+        mpre = np.flip(np.maximum.accumulate(np.flip(np.concatenate(([1.0], precision, [0.0])))))
+        idx = np.where(mrec[1:] != mrec[:-1])[0]
+        aps.append(float(np.sum((mrec[idx + 1] - mrec[idx]) * mpre[idx + 1])))
+    return float(np.mean(aps)) if aps else 1.0
+
+
+def _latency_summary(latencies):
+    latencies = np.array(latencies)
+    return {
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p90_ms': float(np.percentile(latencies, 90)),
+    }
+
+
+def evaluate_yolo(model_path, int8_path, eval_frames, imgsz=640, warmup=3):
+    """在评估帧上对比 FP32 与 INT8 模型的 mAP50、一致率和单帧延迟"""
+    fp32_model = YOLO(model_path)
+    fp32_model.fuse()
+    int8_model = YOLO(int8_path, task=fp32_model.task)
+    for frame in eval_frames[:warmup]:
+        _predict(fp32_model, frame, REFERENCE_CONF, imgsz)
+        _predict(int8_model, frame, REFERENCE_CONF, imgsz)
+
+    references, candidates, agreements = [], [], []
+    fp32_latency, int8_latency = [], []
+    for frame in eval_frames:
+        reference, elapsed = _predict(fp32_model, frame, REFERENCE_CONF, imgsz)
+        fp32_latency.append(elapsed)
+        candidate, elapsed = _predict(int8_model, frame, MAP_CONF, imgsz)
+        int8_latency.append(elapsed)
+        references.append(reference)
+        candidates.append(candidate)
+        agreements.append(box_agreement(reference, candidate[candidate[:, 4] >= REFERENCE_CONF]))
+
+    fp32 = _latency_summary(fp32_latency)
+    int8 = _latency_summary(int8_latency)
+    return {
+        'model': os.path.basename(model_path),
+        'artifact': os.path.basename(int8_path),
+        'frames': len(eval_frames),
+        'map50_vs_fp32': mean_average_precision_50(references, candidates),
+        'agreement': mean_agreement(agreements),
+        'latency_fp32': fp32,
+        'latency_int8': int8,
+        'speedup': fp32['mean_ms'] / max(int8['mean_ms'], 1e-9),
+    }
+
+
+def _violence_status(prob):
+    """与实时视频流中的暴力检测判定保持一致"""
+    if prob <= 0.5:
+        return 'safe'
+    if prob <= 0.7:
+        return 'caution'
+    return 'warning'
+
+
+def _tflite_runner(tf, model_content):
+    """创建一个 TFLite 解释器，返回单样本推理函数"""
+    interpreter = tf.lite.Interpreter(model_content=model_content)
+    interpreter.allocate_tensors()
+    input_index = interpreter.get_input_details()[0]['index']
+    output_index = interpreter.get_output_details()[0]['index']
+
+    def run(x):
+        interpreter.set_tensor(input_index, x.astype(np.float32))
+        interpreter.invoke()
+        return interpreter.get_tensor(output_index)
+    return run
+
+
+def _convert_int8(tf, keras_model, samples):
+    """以给定样本作为代表性数据集，把 Keras 模型转换为 INT8 TFLite（不支持的算子保留浮点）"""
+    def representative_dataset():
+        for sample in samples:
+            yield [sample[None].astype(np.float32)]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8, tf.lite.OpsSet.TFLITE_BUILTINS]
+    return converter.convert()
+
+
+def _feature_windows(features):
+    """把逐帧特征切成暴力检测模型需要的 20 帧窗口，不足时用最后一帧补齐"""
+    if len(features) < VIOLENCE_WINDOW:
+        padding = np.repeat(features[-1:], VIOLENCE_WINDOW - len(features), axis=0)
+        return [np.concatenate([features, padding])]
+    return [features[i:i + VIOLENCE_WINDOW] for i in range(0, len(features) - VIOLENCE_WINDOW + 1, VIOLENCE_STRIDE)]
+
+
+def quantize_violence(calib_frames, eval_frames, model_path=VIOLENCE_MODEL_PATH):
+    """
+    量化暴力检测流水线：VGG16 fc2 特征提取器（逐帧，主要开销）和 vd.hdf5 时序分类器（逐窗口）。
+    生成的 .tflite 文件与 vd.hdf5 放在同一目录。
+    """
+    import tensorflow as tf
+    from app.services.violenceDetect import load_model_safely, process_frame
+
+    classifier = load_model_safely(model_path)
+    try:
+        vgg_model = tf.keras.applications.VGG16(include_top=True, weights='imagenet')
+    except Exception:
+        vgg_model = tf.keras.applications.VGG16(include_top=True, weights=None)
+    extractor = tf.keras.models.Model(inputs=vgg_model.input, outputs=vgg_model.get_layer('fc2').output)
+
+    calib_images = np.array([process_frame(frame) for frame in calib_frames])
+    eval_images = np.array([process_frame(frame) for frame in eval_frames])
+    calib_windows = _feature_windows(extractor.predict(calib_images, verbose=0))
+
+    print("正在量化 VGG16 特征提取器...")
+    extractor_int8 = _convert_int8(tf, extractor, calib_images)
+    print("正在量化暴力检测分类器...")
+    classifier_int8 = _convert_int8(tf, classifier, calib_windows)
+
+    output_dir = os.path.dirname(model_path)
+    extractor_path = os.path.join(output_dir, 'vgg16_fc2_int8.tflite')
+    classifier_path = os.path.join(output_dir, 'vd_int8.tflite')
+    with open(extractor_path, 'wb') as f:
+        f.write(extractor_int8)
+    with open(classifier_path, 'wb') as f:
+        f.write(classifier_int8)
+
+    run_extractor = _tflite_runner(tf, extractor_int8)
+    run_classifier = _tflite_runner(tf, classifier_int8)
+
+    fp32_frame_latency, int8_frame_latency = [], []
+    fp32_features, int8_features = [], []
+    for image in eval_images:
+        start = time.perf_counter()
+        fp32_features.append(extractor.predict(image[None], verbose=0)[0])
+        fp32_frame_latency.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        int8_features.append(run_extractor(image[None])[0])
+        int8_frame_latency.append((time.perf_counter() - start) * 1000)
+
+    fp32_probs, int8_probs = [], []
+    for fp32_window, int8_window in zip(_feature_windows(np.array(fp32_features)),
+                                        _feature_windows(np.array(int8_features))):
+        fp32_probs.append(float(classifier.predict(fp32_window[None], verbose=0)[0][0]))
+        int8_probs.append(float(run_classifier(int8_window[None])[0][0]))
+
+    fp32 = _latency_summary(fp32_frame_latency)
+    int8 = _latency_summary(int8_frame_latency)
+    return {
+        'model': os.path.basename(model_path),
+        'artifacts': [os.path.basename(extractor_path), os.path.basename(classifier_path)],
+        'frames': len(eval_frames),
+        'windows': len(fp32_probs),
+        'status_agreement': float(np.mean([_violence_status(a) == _violence_status(b)
+                                           for a, b in zip(fp32_probs, int8_probs)])),
+        'mean_abs_prob_diff': float(np.mean(np.abs(np.array(fp32_probs) - np.array(int8_probs)))),
+        'latency_fp32': fp32,
+        'latency_int8': int8,
+        'speedup': fp32['mean_ms'] / max(int8['mean_ms'], 1e-9),
+    }
+
+
+def split_holdout(frames, ratio=EVAL_HOLDOUT_RATIO):
+    """把按时间顺序排列的样例帧切成 (校准帧, 留出的评估帧)，评估帧取末尾一段"""
+    if len(frames) < 2:
+        raise ValueError("样例帧少于 2 帧，无法留出评估集，请用 --eval-frames 指定独立的评估帧")
+    holdout = min(len(frames) - 1, max(1, int(round(len(frames) * ratio))))
+    return frames[:-holdout], frames[-holdout:]
+
+
+def run_pipeline(frames_dir, eval_dir=None, models=None, max_frames=300, imgsz=640,
+                 skip_violence=False, report_path=None):
+    """
+    执行完整的量化流水线并写出对比报告。
+
+    评估帧不能与校准帧重合，否则一致率会偏高：未指定 eval_dir 时从样例帧末尾留出
+    EVAL_HOLDOUT_RATIO 的帧用于评估，并在报告中记录 eval_source='holdout'。
+    """
+    if eval_dir:
+        calib_frames = load_frames(frames_dir, max_frames)
+        eval_frames = load_frames(eval_dir, max_frames)
+        eval_source = 'eval_dir'
+    else:
+        calib_frames, eval_frames = split_holdout(load_frames(frames_dir, max_frames))
+        eval_source = 'holdout'
+        print(f"⚠️ 未指定 --eval-frames，从样例帧末尾留出 {len(eval_frames)} 帧用于评估")
+    model_paths = [os.path.join(MODEL_DIR, name) for name in models] if models \
+        else sorted(glob.glob(os.path.join(MODEL_DIR, '*.pt')))
+
+    report = {
+        'calibration_frames': len(calib_frames),
+        'evaluation_frames': len(eval_frames),
+        'eval_source': eval_source,
+        'yolo': [],
+    }
+    for model_path in model_paths:
+        int8_path = quantize_yolo(model_path, calib_frames, imgsz)
+        result = evaluate_yolo(model_path, int8_path, eval_frames, imgsz)
+        report['yolo'].append(result)
+        # 写出与推理后端相同格式的校验报告，供 onnx_int8 后端加载时判断是否可用
+        with open(validation_report_path(int8_path), 'w') as f:
+            json.dump({
+                'model': result['model'],
+                'artifact': result['artifact'],
+                'agreement': result['agreement'],
+                'map50_vs_fp32': result['map50_vs_fp32'],
+                'eval_source': eval_source,
+                'inconclusive': result['agreement'] is None,
+                'passed': result['agreement'] is not None and result['agreement'] >= VALIDATION_MIN_AGREEMENT['onnx_int8'],
+            }, f, indent=4)
+
+    if not skip_violence:
+        report['violence'] = quantize_violence(calib_frames, eval_frames)
+
+    report_path = report_path or os.path.join(MODEL_DIR, 'quantization_report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=4, ensure_ascii=False)
+    print_report(report)
+    print(f"\n报告已保存到: {report_path}")
+    return report
+
+
+def print_report(report):
+    """在终端打印量化对比结果"""
+    print("\n" + "=" * 78)
+    print(f"{'模型':<28}{'mAP50':>8}{'一致率':>8}{'FP32 ms':>10}{'INT8 ms':>10}{'加速比':>8}")
+    print("-" * 78)
+    for item in report['yolo']:
+        agreement = '-' if item['agreement'] is None else f"{item['agreement']:.3f}"
+        print(f"{item['model']:<28}{item['map50_vs_fp32']:>8.3f}{agreement:>8}"
+              f"{item['latency_fp32']['mean_ms']:>10.1f}{item['latency_int8']['mean_ms']:>10.1f}"
+              f"{item['speedup']:>8.2f}")
+    violence = report.get('violence')
+    if violence:
+        print(f"{violence['model']:<28}{'-':>8}{violence['status_agreement']:>8.3f}"
+              f"{violence['latency_fp32']['mean_ms']:>10.1f}{violence['latency_int8']['mean_ms']:>10.1f}"
+              f"{violence['speedup']:>8.2f}")
+    print("=" * 78)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='生成 INT8 量化模型并与 FP32 原模型对比')
+    parser.add_argument('--frames', type=str, required=True, help='校准用样例帧目录')
+    parser.add_argument('--eval-frames', type=str, default=None, help='评估用样例帧目录（不指定时从校准帧末尾留出一部分）')
+    parser.add_argument('--models', type=str, nargs='*', default=None, help='要量化的权重文件名（默认 yolo-Weights 下全部 .pt）')
+    parser.add_argument('--max-frames', type=int, default=300, help='最多读取的帧数')
+    parser.add_argument('--imgsz', type=int, default=640, help='YOLO 校准与评估的输入尺寸')
+    parser.add_argument('--skip-violence', action='store_true', help='跳过暴力检测模型的量化')
+    parser.add_argument('--report', type=str, default=None, help='报告输出路径（默认 yolo-Weights/quantization_report.json）')
+    args = parser.parse_args()
+
+    run_pipeline(
+        args.frames,
+        eval_dir=args.eval_frames,
+        models=args.models,
+        max_frames=args.max_frames,
+        imgsz=args.imgsz,
+        skip_violence=args.skip_violence,
+        report_path=args.report
+    )
@@ -3,15 +3,41 @@ import uuid
 import threading
 import time
 import queue
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import os
 from datetime import datetime
 from typing import Dict, List, Optional
 from app import socketio
-from app.services.danger_zone import DANGER_ZONE
-from ultralytics import YOLO
+from app.services import danger_zone as danger_zone_service
+from app.services.zones import ZoneIndex, parse_zones
+from app.services.alerts import DetectionSession, DEFAULT_STREAM
+from app.services.event_sink import event_sink
+from app.services.model_registry import model_registry
+from app.services.batch_scheduler import BatchInferenceScheduler
+from app.services.motion_gate import MotionGate
+from app.services.inference_roi import ROI_HEAD_ROOM, roi_bounds, offset_results, zones_roi_polygon
+from app.services.cascade import FACE_REGION_RATIO, detect_in_person_boxes, person_boxes
+from app.services.frame_pool import FramePool
+from app.services.frame_pacing import StreamPacing
+from app.services.live_egress import EGRESS_MODES, LIVE_EGRESS_FRAME_QUEUE, FragmentedMP4Egress, can_remux
+from app.utils.media_clock import media_timestamp
 import numpy as np
 import base64
 
+# 跨流批量推理参数：单批最多帧数，以及收集一批帧的最长等待时间（秒）
+BATCH_MAX_SIZE = int(os.environ.get('RTMP_BATCH_MAX_SIZE', 16))
+BATCH_MAX_WAIT = float(os.environ.get('RTMP_BATCH_MAX_WAIT', 0.02))
+# 等待批量推理结果的超时时间（秒）
+BATCH_RESULT_TIMEOUT = 10.0
+# 推流队列和分析队列的长度
+STREAMING_QUEUE_SIZE = 10
+ANALYSIS_QUEUE_SIZE = 5
+# 每个流预分配的帧缓冲数：两个队列和 fMP4 编码输出的写入队列（另加一帧正在写入）装满时，
+# 仍有空闲槽位供读取线程和两个消费线程使用
+FRAME_POOL_SIZE = int(os.environ.get(
+    'RTMP_FRAME_POOL_SIZE', STREAMING_QUEUE_SIZE + ANALYSIS_QUEUE_SIZE + LIVE_EGRESS_FRAME_QUEUE + 1 + 3
+))
+
 class RTMPStreamManager:
     def __init__(self):
         self.streams: Dict[str, dict] = {}
@@ -21,8 +47,27 @@ class RTMPStreamManager:
         # 为推流和分析创建独立的队列
         self.streaming_queues: Dict[str, queue.Queue] = {}
         self.analysis_queues: Dict[str, queue.Queue] = {}
+        # 每个流的帧缓冲池，两个队列中传递的是共享的帧槽位而不是帧的副本
+        self.frame_pools: Dict[str, FramePool] = {}
         self.stop_events: Dict[str, threading.Event] = {}
         self.reader_threads = {}
+        # 每个流独立的模型句柄（共享权重，独立的predictor状态）
+        self.stream_models: Dict[str, dict] = {}
+        # 每个流独立的运动门控（画面静止时跳过检测）
+        self.motion_gates: Dict[str, MotionGate] = {}
+        # 每个流的帧调度（按源时间戳读取，推流/分析按目标帧率抽帧并丢弃过期帧）
+        self.pacings: Dict[str, StreamPacing] = {}
+        # 每个流自己的命名区域空间索引（未配置时使用全局区域）
+        self.zone_indexes: Dict[str, ZoneIndex] = {}
+        # 每个流的推理ROI (多边形, 向上扩展比例)，配置 roi 或区域变化时重新计算；不存在时整帧检测
+        self.inference_rois: Dict[str, tuple] = {}
+        # 每个流独立的告警会话（告警按流ID记录到共享的告警存储中）
+        self.sessions: Dict[str, DetectionSession] = {}
+        # 每个流当前的观看者（/rtmp 命名空间中加入该流房间的客户端 sid），没有观看者的流不编码画面
+        self.viewers: Dict[str, set] = {}
+        self._viewers_lock = threading.Lock()
+        # 每个流的 H.264 fMP4 直播输出（有观看者时才运行 ffmpeg）
+        self.egresses: Dict[str, FragmentedMP4Egress] = {}
         
         # 初始化AI模型
 
@@ -32,11 +77,16 @@ class RTMPStreamManager:
             from app.services.detection import get_object_model, get_face_model
             from app.services.dlib_service import dlib_face_service
             
+            # 预先加载共享权重，各个流启动时再创建自己的句柄
             self.models = {
                 'object': get_object_model(),
                 'face': get_face_model()
             }
             self.dlib_service = dlib_face_service
+            # 所有流的目标检测共用一个批量推理调度器
+            self.batch_scheduler = BatchInferenceScheduler(
+                'object', max_batch_size=BATCH_MAX_SIZE, max_wait=BATCH_MAX_WAIT
+            )
             print("✅ AI模型初始化成功")
         except Exception as e:
             print(f"❌ AI模型初始化失败: {e}")
@@ -48,10 +98,12 @@ class RTMPStreamManager:
 
 
             self.dlib_service = None
+            self.batch_scheduler = None
     
     def add_stream(self, config: dict) -> str:
         """添加新的RTMP流"""
         stream_id = str(uuid.uuid4())
+        zones = parse_zones(config.get('zones', []))
         
         # 保存流配置
         self.streams[stream_id] = {
@@ -60,10 +112,25 @@ class RTMPStreamManager:
             'rtmp_url': config['rtmp_url'],
             'description': config.get('description', ''),
             'detection_modes': config.get('detection_modes', ['object_detection']),
+            'motion_gate': config.get('motion_gate', {}),
+            # 推流/分析的目标帧率和最长帧龄 (output_fps, analysis_fps, max_frame_age)
+            'pacing': config.get('pacing', {}),
+            # 推理ROI多边形（原始分辨率坐标），为空时整帧检测
+            'roi': config.get('roi', []),
+            # 该流的命名区域（危险区、禁入区、排队区等），为空时使用全局区域配置
+            'zones': [zone.to_dict() for zone in zones],
+            # fMP4 直播输出模式：auto（源为 H.264 时转封装，否则编码）、remux、encode
+            'egress_mode': config.get('egress_mode', 'auto'),
+            # 该流对应的摄像头和位置，用于数据库中的行为/人脸记录
+            'camera_id': config.get('camera_id'),
+            'location_id': config.get('location_id'),
             'status': 'inactive',
             'created_at': datetime.now().isoformat(),
             'last_activity': None
         }
+        if zones:
+            self.zone_indexes[stream_id] = ZoneIndex(zones)
+        self._refresh_inference_roi(stream_id)
         
         return stream_id
 
@@ -97,16 +164,28 @@ class RTMPStreamManager:
         original_height, original_width = frame.shape[:2]
         print(f"✅ RTMP流连接成功，原始尺寸: {original_width}x{original_height}")
         
-        # 保存原始尺寸到流配置中
+        # 保存原始尺寸和源编码到流配置中
         self.streams[stream_id]['original_width'] = original_width
         self.streams[stream_id]['original_height'] = original_height
+        fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+        self.streams[stream_id]['codec'] = ''.join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4)).strip('\x00 ')
         
         # 存储capture和相关资源
         self.active_captures[stream_id] = cap
         self.stop_events[stream_id] = threading.Event()
         # 创建独立的队列
-        self.streaming_queues[stream_id] = queue.Queue(maxsize=10)
-        self.analysis_queues[stream_id] = queue.Queue(maxsize=5)
+        self.streaming_queues[stream_id] = queue.Queue(maxsize=STREAMING_QUEUE_SIZE)
+        self.analysis_queues[stream_id] = queue.Queue(maxsize=ANALYSIS_QUEUE_SIZE)
+        self.frame_pools[stream_id] = FramePool(FRAME_POOL_SIZE)
+        # 为该流创建人脸模型句柄，避免多个分析线程共用同一个predictor
+        # （目标检测由批量推理调度器统一处理）
+        self.stream_models[stream_id] = {
+            'face': model_registry.create_handle('face') if self.models.get('face') is not None else None
+        }
+        self.motion_gates[stream_id] = MotionGate.from_config(stream_config.get('motion_gate'))
+        self.pacings[stream_id] = StreamPacing.from_config(stream_config.get('pacing'))
+        self.sessions[stream_id] = DetectionSession(stream_id)
+        event_sink.set_stream_source(stream_id, stream_config.get('camera_id'), stream_config.get('location_id'))
         
         # 启动单一读取线程（负责从RTMP流读取帧）
         reader_thread = threading.Thread(
@@ -144,21 +223,37 @@ class RTMPStreamManager:
 
 
     def _frame_reader_loop(self, stream_id: str):
-        """帧读取线程：从RTMP流读取帧并分发到两个队列"""
+        """帧读取线程：把帧解码到帧池的槽位中，同一个槽位分发到推流和分析两个队列"""
         cap = self.active_captures[stream_id]
         stop_event = self.stop_events[stream_id]
         streaming_queue = self.streaming_queues[stream_id]
         analysis_queue = self.analysis_queues[stream_id]
+        frame_pool = self.frame_pools[stream_id]
+        source_clock = self.pacings[stream_id].source
+        stream_config = self.streams[stream_id]
+        frame_shape = (stream_config['original_height'], stream_config['original_width'], 3)
+        fps = cap.get(cv2.CAP_PROP_FPS)
         
         print(f"📖 帧读取线程启动: {stream_id}")
         
         consecutive_failures = 0
         max_failures = 10
+        # start_stream 中已经读取了一帧
+        frame_index = 1
         
         try:
             while not stop_event.is_set():
-                ret, frame = cap.read()
+                slot = frame_pool.acquire(frame_shape)
+                if slot is None:
+                    # 所有缓冲区都被占用：跳过这一帧（只取包不解码），保持读取进度
+                    if cap.grab():
+                        stop_event.wait(source_clock.wait_time(media_timestamp(cap, frame_index, fps)))
+                        frame_index += 1
+                    continue
+                
+                ret, frame = cap.read(slot.array)
                 if not ret:
+                    slot.release()
                     consecutive_failures += 1
                     print(f"帧读取失败 {stream_id}, 连续失败次数: {consecutive_failures}")
                     
@@ -166,47 +261,61 @@ class RTMPStreamManager:
                         print(f"连续读取失败超过{max_failures}次，停止读取线程")
                         break
                     
-                    time.sleep(0.1)
+                    stop_event.wait(0.1)
                     continue
                 
                 consecutive_failures = 0
+                media_time = media_timestamp(cap, frame_index, fps)
+                frame_index += 1
                 
-                # 将帧分发到两个队列
-                frame_copy = frame.copy()
-                
-                # 推流队列（高频率）
-                try:
-                    streaming_queue.put(frame_copy, block=False)
-                except queue.Full:
-                    try:
-                        streaming_queue.get_nowait()
-                        streaming_queue.put(frame_copy, block=False)
-                    except queue.Empty:
-                        pass
+                if frame is not slot.array:
+                    # 画面尺寸变化，OpenCV 另外分配了数组：之后按新尺寸取槽位，丢弃这一帧
+                    slot.release()
+                    frame_shape = frame.shape
+                    print(f"📐 流 {stream_id} 画面尺寸变为 {frame_shape[1]}x{frame_shape[0]}")
+                    continue
                 
-                # 分析队列（低频率，每5帧一次）
-                if consecutive_failures == 0:  # 只有成功读取时才考虑分析
-                    try:
-                        analysis_queue.put(frame.copy(), block=False)
-                    except queue.Full:
-                        try:
-                            analysis_queue.get_nowait()
-                            analysis_queue.put(frame.copy(), block=False)
-                        except queue.Empty:
-                            pass
+                # 读取快于实时的源（如点播文件）按源时间戳放慢；直播流的 read() 本身按源速率阻塞
+                stop_event.wait(source_clock.wait_time(media_time))
+                slot.media_time = media_time
+                slot.timestamp = time.monotonic()
                 
-                time.sleep(0.033)
+                # 同一个槽位分发到两个队列，每个队列持有一个引用（不复制像素）；没有观看者时不推流
+                if self._needs_frames(stream_id):
+                    self._offer_frame(streaming_queue, slot)   # 推流队列
+                self._offer_frame(analysis_queue, slot)        # 分析队列
+                # 释放读取线程自己的引用
+                slot.release()
                 
         except Exception as e:
             print(f"帧读取线程错误 {stream_id}: {e}")
         finally:
             print(f"📖 帧读取线程结束: {stream_id}")
 
+    @staticmethod
+    def _offer_frame(frame_queue: queue.Queue, slot):
+        """把帧槽位放入队列（增加一个引用），队列满时丢弃并释放最旧的一帧"""
+        slot.retain()
+        try:
+            frame_queue.put(slot, block=False)
+            return
+        except queue.Full:
+            pass
+        try:
+            frame_queue.get_nowait().release()
+        except queue.Empty:
+            pass
+        try:
+            frame_queue.put(slot, block=False)
+        except queue.Full:
+            slot.release()
+
     def _streaming_loop(self, stream_id: str):
-        """推流线程：从推流队列获取帧并发送"""
+        """推流线程：从推流队列获取帧，编码一次后发送到该流的房间（所有观看者共享同一份编码结果）"""
         stop_event = self.stop_events[stream_id]
         streaming_queue = self.streaming_queues[stream_id]
         stream_config = self.streams[stream_id]
+        pacer = self.pacings[stream_id].streaming
         
         print(f"📺 推流线程启动: {stream_id}")
         
@@ -215,17 +324,35 @@ class RTMPStreamManager:
         try:
             while not stop_event.is_set():
                 try:
-                    frame = streaming_queue.get(timeout=1.0)
+                    slot = streaming_queue.get(timeout=1.0)
                 except queue.Empty:
                     continue
                 
+                # 观看者已全部离开、过期的帧和未到输出时间的帧直接丢弃，不做编码
+                if not self._needs_frames(stream_id) or not pacer.accept(slot.media_time, slot.timestamp):
+                    slot.release()
+                    continue
+                
+                started = time.monotonic()
                 frame_count += 1
                 
                 # 保持原始分辨率，不进行resize
                 # frame_resized = cv2.resize(frame, (640, 480))  # 删除这行
                 
-                # 压缩为JPEG（调整质量以平衡文件大小和画质）
-                _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+                # fMP4 编码输出与 JPEG 推流共用同一帧（编码输出的写入线程另外持有该帧缓冲，写入后归还）；
+                # JPEG 只在有 Socket.IO 观看者时编码，编码后立即归还帧缓冲
+                buffer = None
+                try:
+                    egress = self.egresses.get(stream_id)
+                    if egress is not None and egress.mode == 'encode':
+                        egress.write_frame(slot.frame, slot)
+                    if self.viewer_count(stream_id) > 0:
+                        _, buffer = cv2.imencode('.jpg', slot.frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+                finally:
+                    slot.release()
+                if buffer is None:
+                    pacer.record(time.monotonic() - started, slot.timestamp)
+                    continue
                 frame_bytes = buffer.tobytes()
                 
                 # 添加调试信息
@@ -241,20 +368,20 @@ class RTMPStreamManager:
                         'timestamp': datetime.now().isoformat(),
                         'original_width': stream_config.get('original_width', 1280),
                         'original_height': stream_config.get('original_height', 720)
-                    }, namespace='/rtmp')
+                    }, namespace='/rtmp', to=stream_id)
                     
                     # 添加发送确认日志
                     if frame_count % 30 == 0:
-                        print(f"✅ 已发送video_frame事件到/rtmp命名空间，流ID: {stream_id}, 帧数: {frame_count}")
+                        print(f"✅ 已发送video_frame事件到流房间，流ID: {stream_id}, 帧数: {frame_count}")
                         
                 except Exception as emit_error:
                     print(f"❌ Socket.IO发送错误: {emit_error}")
                 
+                pacer.record(time.monotonic() - started, slot.timestamp)
+                
                 # 更新活动时间
                 self.streams[stream_id]['last_activity'] = datetime.now().isoformat()
                 
-                time.sleep(0.033)  # 约30fps
-                
         except Exception as e:
             print(f"推流线程错误 {stream_id}: {e}")
         finally:
@@ -268,85 +395,155 @@ class RTMPStreamManager:
         
         print(f"🔍 分析线程启动: {stream_id}")
         
-        frame_count = 0
+        motion_gate = self.motion_gates[stream_id]
+        pacer = self.pacings[stream_id].analysis
+        session = self.sessions[stream_id]
+        # 画面静止时复用的上一次检测结果
+        last_results = None
         
         try:
             while not stop_event.is_set():
                 try:
-                    frame = analysis_queue.get(timeout=1.0)
+                    slot = analysis_queue.get(timeout=1.0)
                 except queue.Empty:
                     continue
                 
-                frame_count += 1
-                
-                # 每3帧进行一次AI检测
-                if frame_count % 3 == 0:
+                # 按分析帧率抽帧，过期的帧直接丢弃（只读访问共享的帧缓冲，检测结束后释放）
+                if not pacer.accept(slot.media_time, slot.timestamp):
+                    slot.release()
+                else:
+                    frame = slot.frame
+                    started = time.monotonic()
                     try:
-                        detection_results = self._perform_detection(
-                            frame, stream_config['detection_modes']
-                        )
+                        reused = last_results is not None and not motion_gate.should_detect(frame)
+                        if reused:
+                            detection_results = last_results
+                        else:
+                            detection_results = self._perform_detection(
+                                frame, stream_config['detection_modes'], self.stream_models.get(stream_id),
+                                self.inference_rois.get(stream_id), self.zone_indexes.get(stream_id), session, slot
+                            )
+                            last_results = detection_results
                         
                         socketio.emit('ai_result', {
                             'stream_id': stream_id,
                             'timestamp': datetime.now().isoformat(),
                             'detections': detection_results['detections'],
-                            'alerts': detection_results['alerts']
+                            'alerts': detection_results['alerts'],
+                            'reused': reused
                         }, namespace='/rtmp', room=stream_id)
                         
                     except Exception as e:
                         print(f"AI检测错误: {e}")
-                
-                time.sleep(0.1)
+                    finally:
+                        pacer.record(time.monotonic() - started, slot.timestamp)
+                        slot.release()
                 
         except Exception as e:
             print(f"分析线程错误 {stream_id}: {e}")
         finally:
             print(f"🔍 分析线程结束: {stream_id}")
 
-    def _perform_detection(self, frame, detection_modes):
-        """执行AI检测"""
+    def _detect_batched(self, frame, frame_slot=None):
+        """
+        把帧提交给批量调度器并等待结果。
+
+        等待超时时取消请求；调度线程已经开始推理（无法取消）时，为帧缓冲多持有一个引用，
+        推理结束后再释放，避免读取线程在推理仍在读取的内存上解码下一帧。
+        """
+        future = self.batch_scheduler.submit(frame)
+        try:
+            return future.result(timeout=BATCH_RESULT_TIMEOUT)
+        except FutureTimeoutError:
+            if not future.cancel() and frame_slot is not None:
+                frame_slot.retain()
+                future.add_done_callback(lambda _: frame_slot.release())
+            raise
+
+    def _perform_detection(self, frame, detection_modes, models, roi=None, zones=None, session=None, frame_slot=None):
+        """执行AI检测（models 为该流自己的模型句柄，目标检测走批量调度器，roi 为该流的推理ROI (多边形, 向上扩展比例)，
+        zones 为该流的区域空间索引，为 None 时使用全局区域；告警同时记录到该流的 session；
+        frame_slot 为帧所在的帧池槽位）"""
         results = {
             'detections': [],
             'alerts': []
         }
+
+        def add_alert(message, rule, track=None):
+            # rule/track 作为去重键记录到该流的 session，同一目标在抑制窗口内只告警一次
+            results['alerts'].append(message)
+            if session is not None:
+                session.add_alert(message, rule=rule, track=track)
         
-        if not hasattr(self, 'models') or self.models is None:
+        if models is None:
             print("警告: AI模型未初始化，跳过检测")
             return results
         
+        # 目标检测结果同时作为级联检测的第一级（判断画面中是否有人）
+        object_results = None
         try:
-            # 目标检测
-            if 'object_detection' in detection_modes and self.models.get('object') is not None:
-                object_results = self.models['object'](frame)
+            # 目标检测：提交给跨流批量调度器，与其他流的帧合并成一次推理
+            needs_person_stage = 'object_detection' in detection_modes or 'face_only' in detection_modes
+            if needs_person_stage and self.batch_scheduler is not None:
+                # 配置了ROI时只提交ROI的外接区域，结果再映射回整帧坐标；
+                # 开启人脸识别时人框需覆盖整帧（ROI外的人脸同样要识别），改为整帧检测后按ROI过滤目标
+                bounds = roi_bounds(roi[0], frame.shape, head_room=roi[1]) if roi else None
+                if bounds is None or 'face_only' in detection_modes:
+                    object_results = [self._detect_batched(frame, frame_slot)]
+                else:
+                    x1, y1, x2, y2 = bounds
+                    result = self._detect_batched(frame[y1:y2, x1:x2], frame_slot)
+                    object_results = [offset_results(result, frame, x1, y1)]
+                    bounds = None
+            if 'object_detection' in detection_modes and object_results is not None:
                 for result in object_results:
                     boxes = result.boxes
-                    if boxes is not None:
-                        for box in boxes:
-                            x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                            conf = box.conf[0].cpu().numpy()
-                            cls = int(box.cls[0].cpu().numpy())
-                            class_name = self.models['object'].names[cls]
+                    if boxes is not None and len(boxes) > 0:
+                        data = boxes.data.cpu().numpy()
+                        if bounds is not None:
+                            # 整帧检测时只保留脚底点落在ROI外接区域内的目标
+                            bx1, by1, bx2, by2 = bounds
+                            foot_x = (data[:, 0] + data[:, 2]) / 2
+                            data = data[(foot_x >= bx1) & (foot_x < bx2) & (data[:, 3] >= by1) & (data[:, 3] <= by2)]
+                        # 所有检测框一次性做区域判定
+                        zone_hits = self._locate_in_zones(data[:, :4], zones, frame.shape)
+                        # 有追踪ID时 data 为 7 列 (x1, y1, x2, y2, id, conf, cls)
+                        has_ids = data.shape[1] == 7
+                        for row, hits in zip(data, zone_hits):
+                            x1, y1, x2, y2 = row[:4]
+                            conf = row[-2]
+                            cls = int(row[-1])
+                            class_name = result.names[cls]
+                            track_id = int(row[4]) if has_ids else None
                             
-                            in_danger = self._is_in_danger_zone(x1, y1, x2, y2)
+                            inside_zones = [hit.zone.name for hit in hits if hit.inside]
                             
                             results['detections'].append({
                                 'type': 'object',
                                 'class': class_name,
                                 'confidence': float(conf),
                                 'bbox': [int(x1), int(y1), int(x2), int(y2)],
-                                'in_danger_zone': in_danger
+                                'in_danger_zone': bool(inside_zones),
+                                'zones': inside_zones
                             })
                             
-                            if in_danger:
-                                results['alerts'].append(f"检测到{class_name}进入危险区域")
+                            for zone_name in inside_zones:
+                                zone_label = '危险区域' if zone_name == danger_zone_service.LEGACY_ZONE_NAME else zone_name
+                                add_alert(f"检测到{class_name}进入{zone_label}", f"zone:{zone_name}:{class_name}", track_id)
         
         except Exception as e:
             print(f"目标检测错误: {e}")
         
         try:
             # 人脸检测和识别
-            if 'face_only' in detection_modes and self.models.get('face') is not None:
-                face_results = self.models['face'](frame)
+            if 'face_only' in detection_modes and models.get('face') is not None:
+                if object_results is not None:
+                    # 级联：只在人框上半部分内检测人脸，画面中没有人时不运行人脸模型
+                    face_results = detect_in_person_boxes(
+                        models['face'], frame, person_boxes(object_results), region_ratio=FACE_REGION_RATIO
+                    )
+                else:
+                    face_results = models['face'](frame, verbose=False)
                 
                 face_boxes = []
                 face_confidences = []
@@ -375,8 +572,10 @@ class RTMPStreamManager:
                                 'bbox': [int(x1), int(y1), int(x2), int(y2)]
                             })
                             
+                            event_sink.record_face(name, session.stream_id if session else DEFAULT_STREAM, conf)
+                            
                             if name == "Unknown":
-                                results['alerts'].append("检测到未知人脸")
+                                add_alert("检测到未知人脸", 'face:unknown')
                                 
                     except Exception as e:
                         print(f"人脸识别错误: {e}")
@@ -391,7 +590,7 @@ class RTMPStreamManager:
                                 'bbox': [int(x1), int(y1), int(x2), int(y2)]
                             })
                             
-                            results['alerts'].append("人脸识别服务异常")
+                            add_alert("人脸识别服务异常", 'face:error')
                             
         except Exception as e:
             print(f"人脸检测错误: {e}")
@@ -431,6 +630,23 @@ class RTMPStreamManager:
         if stream_id in self.analysis_queues:
             del self.analysis_queues[stream_id]
         
+        self.frame_pools.pop(stream_id, None)
+        
+        if stream_id in self.stream_models:
+            del self.stream_models[stream_id]
+        
+        if stream_id in self.motion_gates:
+            del self.motion_gates[stream_id]
+        
+        self.pacings.pop(stream_id, None)
+        
+        egress = self.egresses.pop(stream_id, None)
+        if egress is not None:
+            egress.close()
+        
+        self.sessions.pop(stream_id, None)
+        event_sink.set_stream_source(stream_id)
+        
         if stream_id in self.stop_events:
             del self.stop_events[stream_id]
         
@@ -447,10 +663,149 @@ class RTMPStreamManager:
         
         # 删除流配置
         del self.streams[stream_id]
+        self.zone_indexes.pop(stream_id, None)
+        self.inference_rois.pop(stream_id, None)
+        with self._viewers_lock:
+            self.viewers.pop(stream_id, None)
+
+    def add_viewer(self, stream_id: str, sid: str) -> int:
+        """客户端加入流房间，返回该流当前的观看者数"""
+        with self._viewers_lock:
+            viewers = self.viewers.setdefault(stream_id, set())
+            viewers.add(sid)
+            return len(viewers)
+
+    def remove_viewer(self, stream_id: str, sid: str) -> int:
+        """客户端离开流房间，返回该流剩余的观看者数"""
+        with self._viewers_lock:
+            viewers = self.viewers.get(stream_id)
+            if viewers is None:
+                return 0
+            viewers.discard(sid)
+            if not viewers:
+                del self.viewers[stream_id]
+            return len(viewers)
+
+    def remove_viewer_everywhere(self, sid: str):
+        """客户端断开连接时从所有流中移除"""
+        with self._viewers_lock:
+            for stream_id in [stream_id for stream_id, viewers in self.viewers.items() if sid in viewers]:
+                self.viewers[stream_id].discard(sid)
+                if not self.viewers[stream_id]:
+                    del self.viewers[stream_id]
+
+    def _needs_frames(self, stream_id: str) -> bool:
+        """推流线程是否需要该流的画面：有 Socket.IO 观看者，或 fMP4 编码输出有观看者"""
+        if self.viewer_count(stream_id) > 0:
+            return True
+        egress = self.egresses.get(stream_id)
+        return egress is not None and egress.mode == 'encode' and len(egress) > 0
+
+    def open_live_egress(self, stream_id: str):
+        """
+        订阅流的 H.264 fMP4 直播输出，返回 EgressSubscription。
+
+        RTMP 推流的画面不带叠加（检测结果由前端绘制），源为 H.264 时默认直接转封装，不重新编码；
+        其他编码或指定 egress_mode=encode 时用推流线程的帧编码一次，所有观看者共享。
+        """
+        if stream_id not in self.streams:
+            raise Exception("流不存在")
+        stream_config = self.streams[stream_id]
+        if stream_config['status'] != 'active':
+            raise Exception("流未激活")
+        
+        egress = self.egresses.get(stream_id)
+        if egress is None:
+            mode = stream_config.get('egress_mode', 'auto')
+            if mode == 'auto':
+                mode = 'remux' if can_remux(stream_config.get('codec')) else 'encode'
+            if mode not in EGRESS_MODES:
+                raise Exception(f"未知的输出模式: {mode}")
+            fps = self.pacings[stream_id].output_fps if stream_id in self.pacings else None
+            egress = self.egresses.setdefault(stream_id, FragmentedMP4Egress(
+                mode, source_url=stream_config['rtmp_url'], fps=fps, name=stream_config['name']
+            ))
+        return egress.subscribe()
+
+    def viewer_count(self, stream_id: str) -> int:
+        """流当前的观看者数"""
+        viewers = self.viewers.get(stream_id)
+        return len(viewers) if viewers else 0
+
+    def update_motion_gate(self, stream_id: str, config: dict) -> dict:
+        """更新流的运动门控参数，流运行中时立即生效"""
+        if stream_id not in self.streams:
+            raise Exception("流不存在")
+        
+        gate_config = {**self.streams[stream_id].get('motion_gate', {}), **config}
+        self.streams[stream_id]['motion_gate'] = gate_config
+        if stream_id in self.motion_gates:
+            self.motion_gates[stream_id].update(gate_config)
+        return gate_config
+
+    def update_pacing(self, stream_id: str, config: dict) -> dict:
+        """更新流的目标输出帧率、分析帧率和最长帧龄，流运行中时立即生效"""
+        if stream_id not in self.streams:
+            raise Exception("流不存在")
+        
+        pacing_config = {**self.streams[stream_id].get('pacing', {}), **config}
+        self.streams[stream_id]['pacing'] = pacing_config
+        if stream_id in self.pacings:
+            self.pacings[stream_id].update(pacing_config)
+        return pacing_config
+
+    def get_pacing_stats(self, stream_id: str) -> dict:
+        """获取流的调度统计（各阶段的实际帧率、处理耗时、延迟和丢弃的帧数）"""
+        if stream_id not in self.pacings:
+            raise Exception("流未激活")
+        return self.pacings[stream_id].stats()
+
+    def update_roi(self, stream_id: str, roi: list) -> list:
+        """更新流的推理ROI多边形（传入空列表恢复整帧检测）"""
+        if stream_id not in self.streams:
+            raise Exception("流不存在")
+        if roi and len(roi) < 3:
+            raise Exception("ROI至少需要3个点")
+        self.streams[stream_id]['roi'] = roi or []
+        self._refresh_inference_roi(stream_id)
+        return self.streams[stream_id]['roi']
+
+    def update_zones(self, stream_id: str, zones: list) -> list:
+        """更新流的命名区域（传入空列表恢复使用全局区域），立即生效"""
+        if stream_id not in self.streams:
+            raise Exception("流不存在")
+        parsed = parse_zones(zones)
+        self.streams[stream_id]['zones'] = [zone.to_dict() for zone in parsed]
+        if parsed:
+            self.zone_indexes[stream_id] = ZoneIndex(parsed)
+        else:
+            self.zone_indexes.pop(stream_id, None)
+        self._refresh_inference_roi(stream_id)
+        return self.streams[stream_id]['zones']
+
+    def _refresh_inference_roi(self, stream_id: str):
+        """
+        重新计算流的推理ROI：优先使用显式配置的 roi，否则与本机摄像头一致，
+        取该流各区域关注范围的并集并向上留出人体高度；两者都没有时整帧检测
+        """
+        roi = self.streams[stream_id].get('roi')
+        zone_index = self.zone_indexes.get(stream_id)
+        if roi and len(roi) >= 3:
+            self.inference_rois[stream_id] = (roi, 0.0)
+        elif zone_index is not None:
+            self.inference_rois[stream_id] = (zones_roi_polygon(zone_index.zones), ROI_HEAD_ROOM)
+        else:
+            self.inference_rois.pop(stream_id, None)
+
+    def get_motion_stats(self, stream_id: str) -> dict:
+        """获取流的运动门控统计（检测/跳过的帧数）"""
+        if stream_id not in self.motion_gates:
+            raise Exception("流未激活")
+        return self.motion_gates[stream_id].stats()
 
     def get_all_streams(self) -> List[dict]:
-        """获取所有流的信息"""
-        return list(self.streams.values())
+        """获取所有流的信息（附带当前观看者数）"""
+        return [{**stream, 'viewers': self.viewer_count(stream_id)} for stream_id, stream in self.streams.items()]
 
     def get_stream_frames(self, stream_id: str):
         """获取流的帧数据（生成器）- 保留兼容性"""
@@ -480,17 +835,12 @@ class RTMPStreamManager:
         except Exception:
             return False
 
-    def _is_in_danger_zone(self, x1: float, y1: float, x2: float, y2: float) -> bool:
-        """检查边界框是否与危险区域重叠"""
-        try:
-            # 计算边界框中心点
-            center_x = (x1 + x2) / 2
-            center_y = (y1 + y2) / 2
-            
-            # 简化实现：总是返回False，避免复杂的几何计算
-            return False
-        except Exception:
-            return False
+    def _locate_in_zones(self, boxes, zone_index: Optional[ZoneIndex], frame_shape) -> list:
+        """批量判定边界框 (N, 4) 的底部中心点落在哪些区域，返回每个框的 ZoneHit 列表"""
+        if zone_index is None:
+            zone_index = danger_zone_service.get_zone_index()
+        foot_points = np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, boxes[:, 3]], axis=1)
+        return zone_index.locate(foot_points, frame_shape)
 
 # 创建全局实例
 rtmp_manager = RTMPStreamManager()
\ No newline at end of file
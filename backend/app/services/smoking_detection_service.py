@@ -1,11 +1,14 @@
 import torch
-from ultralytics import YOLO
+from app.services.inference_backend import load_inference_model
 from supervision.draw.color import ColorPalette
 from supervision import Detections, BoxAnnotator
 import os
 
+# Input sizes available to predict_crops; one batched forward pass per size used
+IMGSZ_BUCKETS = (320, 640, 1024)
+
 class SmokingDetectionService:
-    def __init__(self, model_path='yolov8n.pt'):
+    def __init__(self, model_path='yolov8n.pt', backend='pytorch'):
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
         print(f"--- Smoking Detection Service ---", flush=True)
         print(f"Initializing on device: {self.device.upper()}", flush=True)
@@ -15,26 +18,50 @@ class SmokingDetectionService:
             print(f"Current CUDA device: {torch.cuda.current_device()}", flush=True)
             print(f"Device name: {torch.cuda.get_device_name(torch.cuda.current_device())}", flush=True)
         print(f"---------------------------------", flush=True)
-        self.model = self.load_model(model_path)
-        self.class_names = self.model.model.names
+        self.model = self.load_model(model_path, backend)
+        self.class_names = self.model.names
         self.box_annotator = BoxAnnotator(
             color=ColorPalette.from_hex(['#FF0000']), 
             thickness=2
         )
 
-    def load_model(self, model_path):
+    def load_model(self, model_path, backend='pytorch'):
         # 确保模型路径是绝对的
         if not os.path.isabs(model_path):
             # 修正路径，使其指向项目根目录下的 yolo-Weights
             model_path = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'yolo-Weights', 'smoking_detection.pt')
         
-        model = YOLO(model_path)
-        model.fuse()
-        return model
+        # 按配置的推理后端加载（PyTorch 权重会在其中完成 fuse）
+        return load_inference_model(model_path, backend, 'smoking')
 
     def predict(self, frame, imgsz=1024, **kwargs):
         return self.model(frame, imgsz=imgsz, **kwargs)
 
+    def predict_crops(self, crops, max_imgsz, **kwargs):
+        """
+        Classify many ROI crops with as few forward passes as possible.
+
+        Each crop gets the smallest input size from IMGSZ_BUCKETS that covers its
+        longest side, capped at its own max_imgsz (so small crops are no longer
+        upscaled to 1024). Crops that share an input size are letterboxed into a
+        single batched call. Returns one Results per crop, in input order.
+        """
+        if isinstance(max_imgsz, int):
+            max_imgsz = [max_imgsz] * len(crops)
+        groups = {}
+        for i, (crop, cap) in enumerate(zip(crops, max_imgsz)):
+            longest = max(crop.shape[:2])
+            fitting = [size for size in IMGSZ_BUCKETS if size >= longest and size <= cap]
+            imgsz = fitting[0] if fitting else min(cap, IMGSZ_BUCKETS[-1])
+            groups.setdefault(imgsz, []).append(i)
+
+        results = [None] * len(crops)
+        for imgsz, indices in groups.items():
+            batch = self.model([crops[i] for i in indices], imgsz=imgsz, **kwargs)
+            for i, result in zip(indices, batch):
+                results[i] = result
+        return results
+
     def plot_bboxes(self, results, frame):
         detections = Detections(
             xyxy=results[0].boxes.xyxy.cpu().numpy(),
@@ -0,0 +1,70 @@
+import os
+from collections import deque
+
+import numpy as np
+
+from app.services.inference_backend import box_iou
+
+
+# 同一个人两次抽烟判定之间至少间隔的帧数
+SMOKING_REVISIT_INTERVAL = int(os.environ.get('SMOKING_REVISIT_INTERVAL', 10))
+# 投票窗口：最近几次判定中超过半数为抽烟才告警
+SMOKING_VOTE_WINDOW = int(os.environ.get('SMOKING_VOTE_WINDOW', 3))
+# 人框与上次判定时的 IoU 低于该值（姿态/位置变化较大）时提前重新判定
+SMOKING_REVISIT_IOU = 0.5
+# 超过该帧数未出现的追踪ID会被清理
+SMOKING_TRACK_TTL = 150
+
+
+class SmokingVerdictCache:
+    """
+    按追踪ID缓存抽烟判定结果。
+
+    每个人只在距上次判定 revisit_interval 帧后、或人框变化较大时才重新送入
+    抽烟模型；最近 vote_window 次判定中超过半数为抽烟时才认为该人在抽烟，
+    避免单帧误检触发告警。
+    """
+
+    def __init__(self, revisit_interval=SMOKING_REVISIT_INTERVAL, vote_window=SMOKING_VOTE_WINDOW,
+                 revisit_iou=SMOKING_REVISIT_IOU, track_ttl=SMOKING_TRACK_TTL):
+        self.revisit_interval = max(1, int(revisit_interval))
+        self.vote_window = max(1, int(vote_window))
+        self.revisit_iou = revisit_iou
+        self.track_ttl = track_ttl
+        self._tracks = {}
+
+    def needs_check(self, track_id, box, frame_index):
+        """该追踪ID在当前帧是否需要重新判定"""
+        track = self._tracks.get(track_id)
+        if track is None:
+            return True
+        track['last_seen'] = frame_index
+        if frame_index - track['last_check'] >= self.revisit_interval:
+            return True
+        iou = box_iou(np.asarray([box], dtype=np.float32), np.asarray([track['box']], dtype=np.float32))[0, 0]
+        return iou < self.revisit_iou
+
+    def record(self, track_id, box, frame_index, smoking):
+        """记录一次判定结果，返回记录后的多数投票结论"""
+        track = self._tracks.get(track_id)
+        if track is None:
+            track = self._tracks[track_id] = {'votes': deque(maxlen=self.vote_window)}
+        track['votes'].append(bool(smoking))
+        track['box'] = box
+        track['last_check'] = frame_index
+        track['last_seen'] = frame_index
+        return self.is_smoking(track_id)
+
+    def is_smoking(self, track_id):
+        """最近的判定中抽烟票数是否超过投票窗口的一半"""
+        track = self._tracks.get(track_id)
+        if track is None:
+            return False
+        return sum(track['votes']) * 2 > self.vote_window
+
+    def evict(self, frame_index):
+        """清理长时间未出现的追踪ID"""
+        stale = [track_id for track_id, track in self._tracks.items()
+                 if frame_index - track['last_seen'] > self.track_ttl]
+        for track_id in stale:
+            del self._tracks[track_id]
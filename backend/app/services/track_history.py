@@ -0,0 +1,117 @@
+import threading
+
+import numpy as np
+
+
+# 每个追踪ID保留的历史记录条数
+TRACK_HISTORY_CAPACITY = 30
+# 超过该帧数未更新的追踪ID会被清理
+TRACK_HISTORY_TTL = 150
+
+
+class TrackHistory:
+    """
+    按追踪ID保存固定长度的历史记录（环形缓冲区）。
+
+    所有ID的记录存放在同一个 (槽位, 容量, 字段) 的 NumPy 数组中，写入和读取最近一条
+    记录都是数组索引操作，不再有 list.pop(0) 的 O(n) 开销；长时间未出现的ID由
+    evict() 回收槽位，内存占用只与同时在画面中的人数有关。
+    """
+
+    def __init__(self, capacity=TRACK_HISTORY_CAPACITY, fields=2, ttl=TRACK_HISTORY_TTL, initial_tracks=32):
+        self.capacity = capacity
+        self.fields = fields
+        self.ttl = ttl
+        self._values = np.zeros((initial_tracks, capacity, fields), dtype=np.float64)
+        self._length = np.zeros(initial_tracks, dtype=np.int64)
+        self._head = np.zeros(initial_tracks, dtype=np.int64)
+        self._last_seen = np.zeros(initial_tracks, dtype=np.int64)
+        self._slots = {}
+        self._free = list(range(initial_tracks - 1, -1, -1))
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, track_id):
+        return int(track_id) in self._slots
+
+    def _grow(self):
+        """槽位用完时容量翻倍"""
+        size = len(self._values)
+        self._values = np.concatenate([self._values, np.zeros_like(self._values)])
+        self._length = np.concatenate([self._length, np.zeros(size, dtype=np.int64)])
+        self._head = np.concatenate([self._head, np.zeros(size, dtype=np.int64)])
+        self._last_seen = np.concatenate([self._last_seen, np.zeros(size, dtype=np.int64)])
+        self._free.extend(range(2 * size - 1, size - 1, -1))
+
+    def _slot(self, track_id):
+        slot = self._slots.get(track_id)
+        if slot is None:
+            if not self._free:
+                self._grow()
+            slot = self._slots[track_id] = self._free.pop()
+        return slot
+
+    def last(self, track_ids):
+        """返回每个ID最近一条记录 (N, fields)，没有历史的ID为 NaN"""
+        result = np.full((len(track_ids), self.fields), np.nan)
+        slots = np.array([self._slots.get(int(track_id), -1) for track_id in track_ids], dtype=np.int64)
+        known = slots >= 0
+        if known.any():
+            slots = slots[known]
+            result[known] = self._values[slots, (self._head[slots] - 1) % self.capacity]
+        return result
+
+    def append(self, track_ids, values, frame_index):
+        """为每个ID追加一条记录 (values 为 (N, fields))，并记录最后出现的帧号"""
+        if len(track_ids) == 0:
+            return
+        slots = np.array([self._slot(int(track_id)) for track_id in track_ids], dtype=np.int64)
+        self._values[slots, self._head[slots]] = values
+        self._head[slots] = (self._head[slots] + 1) % self.capacity
+        self._length[slots] = np.minimum(self._length[slots] + 1, self.capacity)
+        self._last_seen[slots] = frame_index
+
+    def get(self, track_id):
+        """按时间顺序（旧 -> 新）返回某个ID的全部历史记录"""
+        slot = self._slots.get(int(track_id))
+        if slot is None:
+            return np.zeros((0, self.fields))
+        length = self._length[slot]
+        order = (self._head[slot] - length + np.arange(length)) % self.capacity
+        return self._values[slot, order].copy()
+
+    def evict(self, frame_index):
+        """清理超过 ttl 帧未更新的ID，返回清理的数量"""
+        if not self._slots:
+            return 0
+        track_ids = np.fromiter(self._slots.keys(), dtype=np.int64, count=len(self._slots))
+        slots = np.fromiter(self._slots.values(), dtype=np.int64, count=len(self._slots))
+        stale = frame_index - self._last_seen[slots] > self.ttl
+        for track_id, slot in zip(track_ids[stale], slots[stale]):
+            del self._slots[int(track_id)]
+            self._length[slot] = 0
+            self._head[slot] = 0
+            self._free.append(int(slot))
+        return int(stale.sum())
+
+
+class TrackHistoryStore:
+    """按流（命名空间）隔离的追踪历史，避免不同视频源的追踪ID互相覆盖"""
+
+    def __init__(self, **history_kwargs):
+        self._history_kwargs = history_kwargs
+        self._histories = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace):
+        history = self._histories.get(namespace)
+        if history is None:
+            with self._lock:
+                history = self._histories.setdefault(namespace, TrackHistory(**self._history_kwargs))
+        return history
+
+    def drop(self, namespace):
+        """流或任务结束时释放其全部历史"""
+        with self._lock:
+            self._histories.pop(namespace, None)
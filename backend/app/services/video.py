@@ -1,12 +1,20 @@
 import cv2
 import numpy as np
 import os
+import threading
 import time
+import uuid
 from flask import Response
-from ultralytics import YOLO
 
 from app.services import detection as detection_service
-from app.services.alerts import update_detection_time, reset_alerts, add_alert
+from app.services.model_registry import model_registry
+from app.services.motion_gate import MotionGate, reuse_results
+from app.services.keyframe_tracker import KeyframeTracker
+from app.services.inference_roi import danger_zone_roi_bounds, detect_in_roi
+from app.services.cascade import FACE_REGION_RATIO, detect_in_person_boxes, person_boxes
+from app.services.smoking_verdicts import SmokingVerdictCache
+from app.services.alerts import DetectionSession
+from app.services.live_egress import FragmentedMP4Egress, fmp4_response
 from app.services import system_state
 from app.services.violenceDetect import load_model_safely, process_frame as violence_process_frame, CUSTOM_OBJECTS
 import tensorflow as tf
@@ -18,26 +26,44 @@ from app.services import danger_zone as danger_zone_service
 
 # 全局变量，用于控制摄像头视频流的循环
 CAMERA_ACTIVE = False
+# 实时暴力检测两次推理之间的最短间隔（秒，约等于 30fps 下每10帧一次）
+VIOLENCE_INFER_INTERVAL = 10 / 30
 # -- REMOVED --: Global model instances are removed to prevent state conflicts.
 # model = None
 # face_recognition_cache = {}
 
-def video_feed():
-    """实时视频流处理，为每个会话创建独立的模型实例。"""
+def video_feed(output='mjpeg'):
+    """
+    实时视频流处理，为每个会话创建独立的模型句柄（权重在进程内共享）。
+
+    output 为 'mjpeg' 时逐帧输出 JPEG；为 'fmp4' 时把带叠加的画面用 x264 编码为分片MP4
+    （浏览器通过 Media Source Extensions 播放），带宽和编码开销都远低于逐帧 JPEG。
+    """
     global CAMERA_ACTIVE
     CAMERA_ACTIVE = True
 
-    # 重置警报，以便为新的实时会话提供干净的状态
-    reset_alerts()
-
-    # --- FIX: Create session-local model instances ---
-    # These instances live only for the duration of this camera session.
-    print("Initializing new model instances for real-time stream...")
-    object_model_stream = YOLO(detection_service.OBJECT_MODEL_PATH)
-    face_model_stream = YOLO(detection_service.FACE_MODEL_PATH)
-    pose_model_stream = YOLO(detection_service.POSE_MODEL_PATH)
+    # --- Session-local model handles ---
+    # Weights are loaded once per process by the model registry; each handle
+    # owns its own predictor/tracker state for the duration of this session.
+    print("Creating model handles for real-time stream...")
+    object_model_stream = model_registry.create_handle('object')
+    face_model_stream = model_registry.create_handle('face')
+    pose_model_stream = model_registry.create_handle('pose')
+    # 级联检测的第一级（判断画面中是否有人），独立句柄避免干扰 object_model_stream 的追踪状态
+    person_model_stream = model_registry.create_handle('object')
     smoking_model_service = detection_service.get_smoking_model() # This is a stateless service wrapper
     face_recognition_cache = {} # Create a fresh cache for this session
+    # 运动门控：画面静止时跳过YOLO，复用上一次的检测结果（按检测模式分别缓存）
+    motion_gate = MotionGate()
+    last_outputs = {}
+    last_mode = None
+    # 关键帧检测：两个关键帧之间用光流传播目标框（KEYFRAME_INTERVAL=1 时每帧检测）
+    object_tracker = KeyframeTracker()
+    person_tracker = KeyframeTracker()
+    # 按追踪ID缓存抽烟判定，避免每帧对每个人重复运行抽烟模型
+    smoking_verdicts = SmokingVerdictCache()
+    # 本次会话独立的告警、停留时间和计时状态（也是姿态历史的命名空间，会话结束时释放）
+    session = DetectionSession(f"camera:{uuid.uuid4().hex}")
 
     # 暴力检测模型和特征提取器（仅在首次用到时加载）
     violence_model = None
@@ -46,8 +72,7 @@ def video_feed():
     violence_buffer = deque(maxlen=20)
     violence_status = "unknown"
     violence_prob = 0.0
-    violence_last_infer_frame = -100
-    violence_infer_interval = 10  # 每10帧推理一次
+    violence_last_infer_time = None
 
     # 打开默认摄像头
     cap = cv2.VideoCapture(0)
@@ -55,14 +80,25 @@ def video_feed():
         print("错误：无法打开摄像头。")
         return Response("无法打开摄像头。", mimetype='text/plain')
 
+    # fMP4 输出：编码进程在第一帧写入时按画面尺寸启动
+    egress = None
+    subscription = None
+    if output == 'fmp4':
+        egress = FragmentedMP4Egress('encode', fps=cap.get(cv2.CAP_PROP_FPS), name='camera')
+        subscription = egress.subscribe()
+
     frame_count = 0
     # --- 新增：FPS计算相关的变量 ---
     prev_frame_time = 0
     new_frame_time = 0
 
     def generate():
-        nonlocal object_model_stream, face_model_stream, pose_model_stream
-        nonlocal frame_count, prev_frame_time, new_frame_time, violence_model, vgg_model, image_model_transfer, violence_buffer, violence_status, violence_prob, violence_last_infer_frame
+        nonlocal object_model_stream, face_model_stream, pose_model_stream, person_model_stream, last_mode
+        nonlocal frame_count, prev_frame_time, new_frame_time, violence_model, vgg_model, image_model_transfer, violence_buffer, violence_status, violence_prob, violence_last_infer_time
+
+        # 依赖危险区域配置的推理ROI，只在配置版本变化时重新推导
+        config_version = None
+        roi = None
 
         try:
             while CAMERA_ACTIVE:
@@ -72,8 +108,29 @@ def video_feed():
                     
                 frame_count += 1
 
-                # --- V5: 每次处理前都从文件重新加载最新的配置 ---
-                danger_zone_service.load_config()
+                # 运动判断需要在叠加FPS等文字之前进行，否则文字变化会被当作运动
+                motion = motion_gate.should_detect(frame)
+                # 切换检测模式后丢弃缓存的结果，避免复用过期的检测框
+                if system_state.DETECTION_MODE != last_mode:
+                    last_mode = system_state.DETECTION_MODE
+                    last_outputs.clear()
+                    object_tracker.reset()
+                    person_tracker.reset()
+
+                def detect(key, run, tracker=None):
+                    """有运动或当前模式还没有缓存结果时执行检测，否则复用上一次的结果"""
+                    if motion or key not in last_outputs:
+                        last_outputs[key] = run()
+                        return last_outputs[key]
+                    if tracker is not None:
+                        # 跳过的帧没有经过光流，丢弃传播状态，恢复运动后的第一帧重新作为关键帧检测
+                        tracker.reset()
+                    return reuse_results(last_outputs[key], processed_frame)
+
+                # 危险区域配置由服务在内存中维护，这里只比较版本号
+                if config_version != danger_zone_service.CONFIG_VERSION:
+                    config_version = danger_zone_service.CONFIG_VERSION
+                    roi = danger_zone_roi_bounds(frame.shape)
                 
                 # --- 新增：FPS 计算 ---
                 new_frame_time = time.time()
@@ -94,7 +151,8 @@ def video_feed():
                 if frame_count % 30 == 0:
                     print(f"[Diagnostics] Current detection mode: {system_state.DETECTION_MODE}")
                 
-                time_diff = update_detection_time()
+                # 实时摄像头没有可靠的媒体时间戳，使用墙上时钟
+                time_diff = session.update_detection_time()
                 processed_frame = frame # 将带有FPS文本的帧作为处理的基础
 
                 # 根据当前模式决定处理方式 (All modes now use session-local models)
@@ -112,9 +170,11 @@ def video_feed():
                         image_model_transfer = tf.keras.models.Model(inputs=vgg_model.input, outputs=transfer_layer.output)
                     # 处理帧并加入缓冲区
                     violence_buffer.append(violence_process_frame(frame))
-                    # 每N帧推理一次
-                    if len(violence_buffer) == 20 and (frame_count - violence_last_infer_frame >= violence_infer_interval):
-                        violence_last_infer_frame = frame_count
+                    # 按帧时间（而不是帧数）控制推理间隔，与摄像头帧率无关
+                    if len(violence_buffer) == 20 and (
+                            violence_last_infer_time is None
+                            or session.current_time - violence_last_infer_time >= VIOLENCE_INFER_INTERVAL):
+                        violence_last_infer_time = session.current_time
                         try:
                             transfer_values = image_model_transfer.predict(np.array(violence_buffer), verbose=0)
                             prediction = violence_model.predict(np.array([transfer_values]), verbose=0)
@@ -124,10 +184,10 @@ def video_feed():
                                 violence_status = "safe"
                             elif violence_prob <= 0.7:
                                 violence_status = "caution"
-                                add_alert("caution: 检测到可能的暴力行为")
+                                session.add_alert("caution: 检测到可能的暴力行为", rule='violence')
                             else:
                                 violence_status = "warning"
-                                add_alert("warning: 检测到高概率暴力行为!")
+                                session.add_alert("warning: 检测到高概率暴力行为!", rule='violence', severity='critical')
                         except Exception as e:
                             violence_status = "error"
                             violence_prob = 0.0
@@ -150,27 +210,53 @@ def video_feed():
                             cv2.fillPoly(overlay, [danger_zone_pts], (0, 255, 255))
                             cv2.addWeighted(overlay, 0.4, processed_frame, 0.6, 0, processed_frame)
                             cv2.polylines(processed_frame, [danger_zone_pts], True, (0, 255, 255), 3)
+                        # 其他命名区域（禁入区、排队区等）
+                        detection_service.draw_zones(processed_frame, danger_zone_service.get_named_zones())
 
-                    outputs = object_model_stream.track(processed_frame, persist=True)
-                    detection_service.process_object_detection_results(outputs, processed_frame, time_diff, frame_count)
+                    # 只在危险区域（加安全距离）的外接区域内检测，结果映射回整帧坐标
+                    outputs = detect('object', lambda: object_tracker.update(
+                        processed_frame,
+                        lambda: detect_in_roi(processed_frame, roi, lambda image: object_model_stream.track(image, persist=True))
+                    ), object_tracker)
+                    detection_service.process_object_detection_results(outputs, processed_frame, time_diff, frame_count, session)
                 
                 elif system_state.DETECTION_MODE == 'fall_detection':
-                    pose_results = pose_model_stream.track(processed_frame, persist=True)
-                    detection_service.process_pose_estimation_results(pose_results, processed_frame, time_diff, frame_count)
+                    # 姿态模型本身就是人体检测器，单次推理同时得到人框和关键点
+                    pose_results = detect('pose', lambda: pose_model_stream.track(processed_frame, persist=True, verbose=False))
+                    detection_service.process_pose_estimation_results(
+                        pose_results, processed_frame, time_diff, frame_count, session
+                    )
 
                 elif system_state.DETECTION_MODE == 'face_only':
                     # 修复：恢复 state 参数的传递，这是必须的
                     if 'face_model' not in face_recognition_cache:
                         face_recognition_cache['face_model'] = face_model_stream
-                    detection_service.process_faces_only(processed_frame, frame_count, face_recognition_cache)
+                        face_recognition_cache['person_model'] = person_model_stream
+                    detection_service.process_faces_only(
+                        processed_frame, frame_count, face_recognition_cache, stream=session.stream_id
+                    )
                 
                 elif system_state.DETECTION_MODE == 'smoking_detection':
-                    face_results = face_model_stream.predict(processed_frame, verbose=False)
-                    person_results = object_model_stream.track(processed_frame, persist=True, classes=[0], verbose=False)
+                    person_results = detect('smoking_person', lambda: person_tracker.update(
+                        processed_frame,
+                        lambda: object_model_stream.track(processed_frame, persist=True, classes=[0], verbose=False)
+                    ), person_tracker)
+                    # 级联：只在人框上半部分内检测人脸，画面中没有人时不运行人脸和抽烟模型
+                    face_results = detect('smoking_face', lambda: detect_in_person_boxes(
+                        face_model_stream, processed_frame, person_boxes(person_results), region_ratio=FACE_REGION_RATIO
+                    ))
                     detection_service.process_smoking_detection_hybrid(
-                        processed_frame, person_results, face_results, smoking_model_service
+                        processed_frame, person_results, face_results, smoking_model_service,
+                        verdict_cache=smoking_verdicts, frame_index=frame_count, session=session
                     )
 
+                if subscription is not None:
+                    # 送入 x264 编码，分片由 fmp4_response 的响应发送；观看者断开后结束采集
+                    egress.write_frame(processed_frame)
+                    if subscription.closed:
+                        break
+                    continue
+
                 # 将处理后的帧编码为JPEG格式
                 (flag, encodedImage) = cv2.imencode(".jpg", processed_frame)
                 if not flag:
@@ -185,11 +271,15 @@ def video_feed():
         finally:
             print("释放摄像头和模型资源...")
             cap.release()
+            if egress is not None:
+                egress.close()
+            detection_service.pose_history.drop(session.stream_id)
 
-            # 显式删除模型实例以释放内存
+            # 释放本会话的模型句柄（共享权重仍由注册表持有）
             del object_model_stream
             del face_model_stream
             del pose_model_stream
+            del person_model_stream
             
             if violence_model:
                 del violence_model
@@ -203,6 +293,14 @@ def video_feed():
             
             print("所有模型和摄像头资源已成功释放。")
 
+    if subscription is not None:
+        # 采集和编码在后台线程中进行，响应等待初始化分片后再给出编码字符串并开始输出
+        def encode_loop():
+            for _ in generate():
+                pass
+
+        threading.Thread(target=encode_loop, name='camera-fmp4', daemon=True).start()
+        return fmp4_response(subscription)
     return Response(generate(),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
@@ -0,0 +1,59 @@
+import os
+
+import cv2
+import numpy as np
+
+
+# 距离场栅格相对帧分辨率的缩放比例（0.5 表示半分辨率，误差约 2 像素）
+ZONE_RASTER_SCALE = float(os.environ.get('ZONE_RASTER_SCALE', 0.5))
+
+
+class ZoneDistanceField:
+    """
+    危险区域的预计算距离场。
+
+    区域变化时按帧分辨率（或缩小后的分辨率）栅格化一次：每个像素保存是否在区域内
+    （含边缘，与 fillPoly、point_in_polygon 一致）和边缘上最近点的索引。之后每个检测点
+    的判定只是一次数组索引，与区域顶点数无关。
+    """
+
+    def __init__(self, polygon, frame_shape, scale=ZONE_RASTER_SCALE):
+        self.frame_height, self.frame_width = frame_shape[:2]
+        self.scale = scale
+        width = max(1, int(round(self.frame_width * scale)))
+        height = max(1, int(round(self.frame_height * scale)))
+        self.shape = (height, width)
+
+        vertices = np.round(np.asarray(polygon, dtype=np.float64).reshape(-1, 2) * scale).astype(np.int32)
+
+        # 边缘像素为 0，其余为 255；distanceTransform 计算每个像素到最近边缘像素的距离
+        boundary = np.full(self.shape, 255, dtype=np.uint8)
+        cv2.polylines(boundary, [vertices.reshape(-1, 1, 2)], True, 0, 1)
+        inside = np.zeros(self.shape, dtype=np.uint8)
+        cv2.fillPoly(inside, [vertices.reshape(-1, 1, 2)], 1)
+
+        _, labels = cv2.distanceTransformWithLabels(
+            boundary, cv2.DIST_L2, 5, labelType=cv2.DIST_LABEL_PIXEL
+        )
+        # 每个标签对应的边缘像素坐标（原始分辨率）
+        edge_rows, edge_cols = np.nonzero(boundary == 0)
+        self.boundary_points = np.zeros((labels.max() + 1, 2), dtype=np.float32)
+        self.boundary_points[labels[edge_rows, edge_cols]] = np.stack([edge_cols, edge_rows], axis=1) / scale
+        self.nearest_index = labels
+        # 区域内部掩码：边缘像素的距离为 0，不能用距离的符号判断内外
+        self.inside = inside
+
+    def lookup(self, points):
+        """
+        批量查询一组点 (N, 2)（原始帧坐标）。
+
+        返回:
+            (inside, distances, nearest): 是否在区域内、到区域边缘的距离、边缘上的最近点
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        cols = np.clip((points[:, 0] * self.scale).astype(np.int64), 0, self.shape[1] - 1)
+        rows = np.clip((points[:, 1] * self.scale).astype(np.int64), 0, self.shape[0] - 1)
+        nearest = self.boundary_points[self.nearest_index[rows, cols]]
+        # 最近边缘点由栅格给出，距离按查询点的精确坐标计算
+        distances = np.hypot(points[:, 0] - nearest[:, 0], points[:, 1] - nearest[:, 1])
+        return self.inside[rows, cols] > 0, distances, nearest
@@ -0,0 +1,151 @@
+import math
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from app.utils.geometry import locate_points
+
+
+# 区域类型：危险区（停留告警 + 靠近告警）、禁入区（进入即告警）、排队区等，类型只用于展示和区分告警
+ZONE_TYPES = ('danger', 'restricted', 'queue', 'custom')
+# 各类型的默认阈值 (安全距离像素, 停留时间秒)
+ZONE_TYPE_DEFAULTS = {
+    'danger': (50, 2.0),
+    'restricted': (0, 0.0),
+    'queue': (0, 30.0),
+    'custom': (50, 2.0),
+}
+# 空间索引的网格边长（像素）
+ZONE_GRID_CELL = int(os.environ.get('ZONE_GRID_CELL', 64))
+
+# 一个点相对某个区域的判定结果
+ZoneHit = namedtuple('ZoneHit', ['zone', 'inside', 'distance', 'nearest'])
+
+
+class Zone:
+    """一个命名区域：多边形加上该区域自己的安全距离和停留时间阈值"""
+
+    def __init__(self, name, polygon, zone_type='danger', safety_distance=None, loitering_threshold=None,
+                 distance_field=None):
+        if zone_type not in ZONE_TYPES:
+            raise ValueError(f"未知的区域类型: {zone_type}")
+        self.name = str(name)
+        self.type = zone_type
+        self.polygon = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+        if len(self.polygon) < 3:
+            raise ValueError(f"区域 {self.name} 至少需要3个点")
+        default_distance, default_threshold = ZONE_TYPE_DEFAULTS[zone_type]
+        self.safety_distance = float(default_distance if safety_distance is None else safety_distance)
+        self.loitering_threshold = float(default_threshold if loitering_threshold is None else loitering_threshold)
+        if self.safety_distance < 0 or self.loitering_threshold < 0:
+            raise ValueError(f"区域 {self.name} 的阈值不能为负数")
+        # 可选：frame_shape -> ZoneDistanceField，提供时用预计算的距离场代替几何计算
+        self.distance_field = distance_field
+
+        # 需要关注的范围：外接矩形向外扩展两倍安全距离（靠近提示和连接线的绘制范围）
+        margin = 2 * self.safety_distance
+        x_min, y_min = self.polygon.min(axis=0) - margin
+        x_max, y_max = self.polygon.max(axis=0) + margin
+        self.bounds = (x_min, y_min, x_max, y_max)
+
+    @classmethod
+    def from_dict(cls, data):
+        """从配置字典创建区域，字段无效时抛出 ValueError"""
+        if not isinstance(data, dict) or not data.get('name'):
+            raise ValueError("区域配置必须包含 name")
+        try:
+            return cls(
+                data['name'], data.get('polygon', []), data.get('type', 'danger'),
+                data.get('safety_distance'), data.get('loitering_threshold')
+            )
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"无效的区域配置 {data.get('name')}: {e}")
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'type': self.type,
+            'polygon': self.polygon.astype(int).tolist(),
+            'safety_distance': self.safety_distance,
+            'loitering_threshold': self.loitering_threshold,
+        }
+
+    def locate(self, points, frame_shape=None):
+        """返回 (inside, distances, nearest)，与 geometry.locate_points 相同"""
+        field = None
+        if self.distance_field is not None and frame_shape is not None:
+            field = self.distance_field(frame_shape)
+        if field is not None:
+            return field.lookup(points)
+        return locate_points(points, self.polygon)
+
+
+def parse_zones(items):
+    """把配置列表解析为 Zone 列表，名称重复或字段无效时抛出 ValueError"""
+    zones = [Zone.from_dict(item) for item in items or []]
+    names = [zone.name for zone in zones]
+    if len(set(names)) != len(names):
+        raise ValueError("区域名称不能重复")
+    return zones
+
+
+class ZoneIndex:
+    """
+    区域的均匀网格空间索引。
+
+    每个区域按其关注范围（外接矩形加两倍安全距离）登记到覆盖的网格中，查询时
+    每个点只与所在网格登记的候选区域做几何判定，区域数量增加时单个检测点的
+    开销基本不变。
+    """
+
+    def __init__(self, zones, cell_size=ZONE_GRID_CELL):
+        self.zones = list(zones)
+        self.cell_size = max(1, int(cell_size))
+        self._cells = {}
+        for zone_index, zone in enumerate(self.zones):
+            x_min, y_min, x_max, y_max = zone.bounds
+            for cx in range(math.floor(x_min / self.cell_size), math.floor(x_max / self.cell_size) + 1):
+                for cy in range(math.floor(y_min / self.cell_size), math.floor(y_max / self.cell_size) + 1):
+                    self._cells.setdefault((cx, cy), []).append(zone_index)
+
+    def __len__(self):
+        return len(self.zones)
+
+    def candidates(self, points):
+        """返回 {区域下标: 候选点下标数组}"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if not self._cells or len(points) == 0:
+            return {}
+        cells = np.floor(points / self.cell_size).astype(np.int64)
+        keys, inverse = np.unique(cells, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        groups = {}
+        for key_index, (cx, cy) in enumerate(keys):
+            zone_indices = self._cells.get((int(cx), int(cy)))
+            if not zone_indices:
+                continue
+            point_indices = np.flatnonzero(inverse == key_index)
+            for zone_index in zone_indices:
+                groups.setdefault(zone_index, []).append(point_indices)
+        return {zone_index: np.concatenate(parts) for zone_index, parts in groups.items()}
+
+    def locate(self, points, frame_shape=None):
+        """
+        批量判定一组点 (N, 2) 与各区域的关系。
+
+        返回:
+            长度为 N 的列表，每项是该点命中的 ZoneHit 列表（点在区域内，或距离小于两倍
+            安全距离），所在区域排在前面，其余按距离从近到远排序
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        hits = [[] for _ in range(len(points))]
+        for zone_index, point_indices in self.candidates(points).items():
+            zone = self.zones[zone_index]
+            inside, distances, nearest = zone.locate(points[point_indices], frame_shape)
+            for i, is_inside, distance, nearest_point in zip(point_indices, inside, distances, nearest):
+                if is_inside or distance < 2 * zone.safety_distance:
+                    hits[i].append(ZoneHit(zone, bool(is_inside), float(distance), nearest_point))
+        for point_hits in hits:
+            point_hits.sort(key=lambda hit: (not hit.inside, hit.distance))
+        return hits
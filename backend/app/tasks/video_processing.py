@@ -16,13 +16,9 @@ def process_rtmp_stream(self, stream_id: str, stream_config: dict):
     rtmp_url = stream_config['rtmp_url']
     detection_modes = stream_config['detection_modes']
     
-    # 初始化AI模型（每个任务独立的模型实例）
-    from ultralytics import YOLO
-    models = {
-        'object': YOLO('yolo-Weights/yolov8n.pt'),
-        'face': YOLO('yolo-Weights/yolov8n-face.pt'),
-        'pose': YOLO('yolo-Weights/yolov8n-pose.pt')
-    }
+    # 初始化AI模型（每个任务独立的模型句柄，权重在worker进程内只加载一次）
+    from app.services.model_registry import model_registry
+    models = model_registry.create_handles('object', 'face', 'pose')
     
     # 打开RTMP流
     cap = cv2.VideoCapture(rtmp_url)
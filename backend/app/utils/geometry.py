@@ -1,6 +1,85 @@
-import math
 import numpy as np
 
+
+def _as_points(points):
+    return np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+
+def _polygon_edges(polygon):
+    """返回多边形各条边的起点和终点数组 (E, 2)"""
+    vertices = _as_points(polygon)
+    return vertices, np.roll(vertices, -1, axis=0)
+
+
+def points_in_polygon(points, polygon):
+    """
+    批量检查点是否在多边形内部（射线法，与 point_in_polygon 判定规则一致）
+
+    参数:
+        points: (N, 2) 待检查的点坐标
+        polygon: 多边形顶点坐标列表
+
+    返回:
+        np.ndarray: (N,) 布尔数组
+    """
+    points = _as_points(points)
+    if polygon is None or len(polygon) < 3 or len(points) == 0:
+        return np.zeros(len(points), dtype=bool)
+    p1, p2 = _polygon_edges(polygon)
+    x, y = points[:, 0:1], points[:, 1:2]
+    p1x, p1y, p2x, p2y = p1[:, 0], p1[:, 1], p2[:, 0], p2[:, 1]
+
+    dy = p2y - p1y
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xinters = (y - p1y) * (p2x - p1x) / np.where(dy != 0, dy, 1) + p1x
+    crosses = (
+        (y > np.minimum(p1y, p2y)) & (y <= np.maximum(p1y, p2y)) & (x <= np.maximum(p1x, p2x))
+        & ((p1x == p2x) | (x <= xinters))
+    )
+    return crosses.sum(axis=1) % 2 == 1
+
+
+def distances_to_polygon(points, polygon):
+    """
+    批量计算点到多边形边缘的最小距离及边缘上最近的点
+
+    参数:
+        points: (N, 2) 待计算的点坐标
+        polygon: 多边形顶点坐标列表
+
+    返回:
+        (distances, nearest): (N,) 最小距离, (N, 2) 多边形边缘上的最近点
+    """
+    points = _as_points(points)
+    if polygon is None or len(polygon) == 0 or len(points) == 0:
+        return np.full(len(points), np.inf), points.copy()
+    p1, p2 = _polygon_edges(polygon)
+    edge = p2 - p1
+    len_sq = (edge ** 2).sum(axis=1)
+
+    # 每个点在每条边上的投影参数，限制在线段范围内 (N, E)
+    offset = points[:, None, :] - p1[None, :, :]
+    param = (offset * edge[None]).sum(axis=2) / np.where(len_sq > 0, len_sq, 1)
+    param = np.clip(np.where(len_sq > 0, param, 0), 0, 1)
+    closest = p1[None] + param[..., None] * edge[None]
+    dists = np.sqrt(((points[:, None, :] - closest) ** 2).sum(axis=2))
+
+    nearest_edge = dists.argmin(axis=1)
+    rows = np.arange(len(points))
+    return dists[rows, nearest_edge], closest[rows, nearest_edge]
+
+
+def locate_points(points, polygon):
+    """
+    一次性计算一组点相对多边形的位置
+
+    返回:
+        (inside, distances, nearest): 是否在内部、到边缘的最小距离、边缘上的最近点
+    """
+    distances, nearest = distances_to_polygon(points, polygon)
+    return points_in_polygon(points, polygon), distances, nearest
+
+
 def point_in_polygon(point, polygon):
     """
     检查点是否在多边形内部
@@ -12,21 +91,7 @@ def point_in_polygon(point, polygon):
     返回:
         bool: 如果点在多边形内部则为True，否则为False
     """
-    x, y = point
-    n = len(polygon)
-    inside = False
-    p1x, p1y = polygon[0]
-    for i in range(1, n + 1):
-        p2x, p2y = polygon[i % n]
-        if y > min(p1y, p2y):
-            if y <= max(p1y, p2y):
-                if x <= max(p1x, p2x):
-                    if p1y != p2y:
-                        xinters = (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
-                    if p1x == p2x or x <= xinters:
-                        inside = not inside
-        p1x, p1y = p2x, p2y
-    return inside
+    return bool(points_in_polygon([point], polygon)[0])
 
 def distance_to_polygon(point, polygon):
     """
@@ -39,41 +104,4 @@ def distance_to_polygon(point, polygon):
     返回:
         float: 点到多边形边缘的最小距离
     """
-    min_distance = float('inf')
-    x, y = point
-    n = len(polygon)
-    
-    for i in range(n):
-        x1, y1 = polygon[i]
-        x2, y2 = polygon[(i + 1) % n]
-        
-        # 计算点到线段的距离
-        A = x - x1
-        B = y - y1
-        C = x2 - x1
-        D = y2 - y1
-        
-        dot = A * C + B * D
-        len_sq = C * C + D * D
-        
-        # 避免除以零
-        if len_sq == 0:
-            dist = math.sqrt(A * A + B * B)
-        else:
-            param = dot / len_sq
-            
-            if param < 0:
-                xx = x1
-                yy = y1
-            elif param > 1:
-                xx = x2
-                yy = y2
-            else:
-                xx = x1 + param * C
-                yy = y1 + param * D
-                
-            dist = math.sqrt((x - xx) ** 2 + (y - yy) ** 2)
-            
-        min_distance = min(min_distance, dist)
-    
-    return min_distance 
\ No newline at end of file
+    return float(distances_to_polygon([point], polygon)[0][0])
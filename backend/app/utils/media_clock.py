@@ -0,0 +1,22 @@
+import cv2
+
+
+def media_timestamp(cap, frame_index, fps=None):
+    """
+    返回刚读取的帧在媒体时间轴上的时间（秒）
+
+    优先使用解码器给出的显示时间戳 (PTS)；没有 PTS 时按 帧号/帧率 推算，
+    两者都没有（例如部分摄像头）时返回 None，由调用方退回到墙上时钟。
+    基于媒体时间的停留时长、速度等指标与处理速度无关，离线任务可以快于实时运行。
+
+    参数:
+        cap: cv2.VideoCapture
+        frame_index: 从 0 开始的帧号
+        fps: 源视频帧率
+    """
+    pos_msec = cap.get(cv2.CAP_PROP_POS_MSEC)
+    if pos_msec and pos_msec > 0:
+        return pos_msec / 1000.0
+    if fps and fps > 0:
+        return frame_index / fps
+    return None
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 测试从仓库根目录或 backend/ 运行时都能导入 app 包
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
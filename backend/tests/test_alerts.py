@@ -0,0 +1,54 @@
+import pytest
+
+from app.services import alerts as alerts_module
+from app.services.alerts import AlertStore, DetectionSession
+
+
+class Recorder:
+    def __init__(self):
+        self.alerts = []
+
+    def record_alert(self, alert):
+        self.alerts.append(alert)
+
+    def publish(self, alert):
+        self.alerts.append(alert)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setattr(alerts_module, 'event_sink', Recorder())
+    monkeypatch.setattr(alerts_module, 'alert_broadcaster', Recorder())
+    return AlertStore(capacity=100, suppress_window=10.0)
+
+
+def test_suppress_window_follows_media_time(store):
+    # 墙上时钟几乎没有前进，但媒体时间已超出抑制窗口
+    assert store.add('闯入', rule='zone', track=1, stream='a', media_time=0.0)
+    assert not store.add('闯入', rule='zone', track=1, stream='a', media_time=9.0)
+    assert store.add('闯入', rule='zone', track=1, stream='a', media_time=10.5)
+    items, total = store.query(stream='a')
+    assert total == 2 and items[0]['count'] == 2
+
+
+def test_streams_keep_separate_clocks(store):
+    assert store.add('闯入', rule='zone', stream='upload', media_time=100.0)
+    # 另一个流的媒体时间从 0 开始，不会清掉第一个流的去重状态
+    assert store.add('闯入', rule='zone', stream='camera', media_time=0.0)
+    assert not store.add('闯入', rule='zone', stream='upload', media_time=105.0)
+
+
+def test_media_time_rewind_expires_suppression(store):
+    assert store.add('闯入', rule='zone', stream='a', media_time=50.0)
+    assert store.add('闯入', rule='zone', stream='a', media_time=1.0)
+
+
+def test_session_uses_current_media_time(store):
+    session = DetectionSession('video:1', store=store)
+    session.update_detection_time(0.0)
+    assert session.add_alert('跌倒', rule='fall', track=3)
+    session.update_detection_time(4.0)
+    assert not session.add_alert('跌倒', rule='fall', track=3)
+    session.update_detection_time(12.0)
+    assert session.add_alert('跌倒', rule='fall', track=3)
+    assert session.get_alerts() == ['跌倒', '跌倒']
@@ -0,0 +1,121 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from app.services import event_sink as event_sink_module
+from app.services.event_sink import EventSink
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'events.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE passengers (passenger_id VARCHAR(36) PRIMARY KEY, name VARCHAR(50))")
+    conn.execute("INSERT INTO passengers VALUES ('p-alice', 'alice')")
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def sink(database, monkeypatch):
+    monkeypatch.setattr(event_sink_module, 'EVENT_CAMERA_ID', None)
+    monkeypatch.setattr(event_sink_module, 'EVENT_LOCATION_ID', None)
+    sink = EventSink(backend='sqlite', sqlite_path=database, batch_size=50, flush_interval=0.05)
+    sink.set_stream_source('cam-1', 'camera-1', 'location-1')
+    yield sink
+    sink.stop()
+
+
+def rows(database, sql):
+    conn = sqlite3.connect(database)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def alert(stream='cam-1', rule='loitering:danger zone', severity='critical', message='停留'):
+    return {'stream': stream, 'timestamp': time.time(), 'rule': rule, 'severity': severity, 'message': message}
+
+
+def test_alerts_with_rules_are_linked_to_behavior_logs(sink, database):
+    sink.record_alert(alert())
+    sink.record_alert(alert(rule=None, severity='warning', message='一般告警'))
+    sink.stop()
+
+    behaviors = rows(database, "SELECT detection_id, camera_id, behavior_type, risk_level, notes FROM behavior_detection_logs")
+    assert len(behaviors) == 1
+    detection_id, camera_id, behavior_type, risk_level, notes = behaviors[0]
+    assert (camera_id, behavior_type, risk_level, notes) == ('camera-1', 'loitering', 'high', '停留')
+
+    alerts = rows(database, "SELECT detection_id, alert_type, severity FROM alerts ORDER BY alert_type")
+    assert alerts == [(None, 'general', 'medium'), (detection_id, 'loitering', 'critical')]
+    assert sink.stats()['written'] == 3
+
+
+def test_streams_without_source_only_write_alerts(sink, database):
+    sink.record_alert(alert(stream='unconfigured'))
+    sink.record_face('alice', 'unconfigured')
+    sink.stop()
+
+    assert rows(database, "SELECT COUNT(*) FROM behavior_detection_logs") == [(0,)]
+    assert rows(database, "SELECT COUNT(*) FROM face_recognition_logs") == [(0,)]
+    assert rows(database, "SELECT COUNT(*) FROM alerts") == [(1,)]
+    assert sink.stats()['skipped'] == 2
+
+
+def test_face_logs_are_rate_limited_and_resolve_passengers(sink, database):
+    sink.record_face('alice', 'cam-1', 0.9)
+    sink.record_face('alice', 'cam-1', 0.8)
+    sink.record_face('Unknown', 'cam-1')
+    sink.stop()
+
+    faces = rows(database, "SELECT passenger_id, camera_id, confidence_score FROM face_recognition_logs ORDER BY passenger_id")
+    assert faces == [(None, 'camera-1', None), ('p-alice', 'camera-1', pytest.approx(0.9))]
+
+
+def test_face_rate_limit_state_is_pruned(sink, monkeypatch):
+    monkeypatch.setattr(event_sink_module, 'FACE_LOG_INTERVAL', 0.0)
+    for index in range(100):
+        sink.set_stream_source(f'camera:{index}', 'camera-1', 'location-1')
+        sink.record_face('alice', f'camera:{index}')
+    # 已超出记录间隔的 (视频流, 姓名) 在插入时被清理
+    assert len(sink._face_logged) == 1
+
+
+def test_passengers_registered_later_are_linked(sink, database, monkeypatch):
+    monkeypatch.setattr(event_sink_module, 'FACE_LOG_INTERVAL', 0.0)
+    monkeypatch.setattr(event_sink_module, 'PASSENGER_MISS_TTL', 0.0)
+    sink.record_face('bob', 'cam-1')
+    sink.stop()
+
+    conn = sqlite3.connect(database)
+    conn.execute("INSERT INTO passengers VALUES ('p-bob', 'bob')")
+    conn.commit()
+    conn.close()
+
+    sink.record_face('bob', 'cam-1')
+    sink.stop()
+
+    # 第一次查询时还未注册（不关联），注册后的记录关联到新乘客
+    assert {row[0] for row in rows(database, "SELECT passenger_id FROM face_recognition_logs")} == {None, 'p-bob'}
+
+
+def test_full_queue_drops_instead_of_blocking(database):
+    sink = EventSink(backend='sqlite', sqlite_path=database, queue_size=2)
+    # 不启动写入线程，直接填满队列
+    sink._thread = threading.Thread(target=lambda: None)
+    assert sink.submit('alerts', {}) and sink.submit('alerts', {})
+    assert not sink.submit('alerts', {})
+    assert sink.stats()['dropped'] == 1
+
+
+def test_disabled_sink_ignores_events():
+    sink = EventSink(backend='disabled')
+    sink.record_alert(alert())
+    sink.record_face('alice', 'cam-1')
+    assert not sink.submit('alerts', {})
+    assert sink.stats()['submitted'] == 0
@@ -0,0 +1,85 @@
+import pytest
+
+from app.services.frame_pacing import SOURCE_CLOCK_RESYNC, SourceClock, StagePacer, StreamPacing
+
+
+def test_source_clock_follows_media_timestamps():
+    clock = SourceClock()
+    assert clock.wait_time(10.0, now=100.0) == 0.0
+    # 源时间走了 0.04 秒、墙上时间只过了 0.01 秒：还要等 0.03 秒
+    assert clock.wait_time(10.04, now=100.01) == pytest.approx(0.03)
+    # 处理落后于源时间时不等待
+    assert clock.wait_time(10.08, now=100.2) == 0.0
+    assert clock.wait_time(None, now=100.3) == 0.0
+
+
+def test_source_clock_resyncs_on_jumps():
+    clock = SourceClock()
+    clock.wait_time(0.0, now=0.0)
+    # 时间戳跳变（重连）超过 resync 时重新对齐，不会长时间休眠
+    assert clock.wait_time(SOURCE_CLOCK_RESYNC + 60.0, now=0.1) == 0.0
+    assert clock.wait_time(SOURCE_CLOCK_RESYNC + 60.5, now=0.2) == pytest.approx(0.4)
+
+
+def run_source(pacer, fps, seconds, processing=0.0):
+    """按 fps 产生帧（解码后立即处理），返回被接受的帧的媒体时间"""
+    accepted = []
+    for index in range(int(fps * seconds)):
+        media_time = index / fps
+        if pacer.accept(media_time, captured_at=media_time, now=media_time):
+            accepted.append(media_time)
+            if processing:
+                pacer.record(processing, captured_at=media_time, now=media_time + processing)
+    return accepted
+
+
+def test_stage_pacer_decimates_to_target_fps():
+    pacer = StagePacer(target_fps=10, max_age=1.0)
+    accepted = run_source(pacer, fps=30, seconds=10)
+    assert len(accepted) == pytest.approx(100, abs=1)
+
+
+def test_stage_pacer_keeps_average_rate_for_non_divisor_fps():
+    pacer = StagePacer(target_fps=12, max_age=1.0)
+    accepted = run_source(pacer, fps=25, seconds=10)
+    assert len(accepted) == pytest.approx(120, abs=2)
+
+
+def test_stage_pacer_slows_down_to_processing_time():
+    pacer = StagePacer(target_fps=25, max_age=1.0)
+    accepted = run_source(pacer, fps=25, seconds=10, processing=0.2)
+    assert pacer.interval == pytest.approx(0.2)
+    assert len(accepted) == pytest.approx(50, abs=2)
+    stats = pacer.stats()
+    assert stats['effective_fps'] == pytest.approx(5)
+    assert stats['processed_frames'] == len(accepted)
+    assert stats['skipped_frames'] == 250 - len(accepted)
+
+
+def test_stage_pacer_drops_stale_frames():
+    pacer = StagePacer(target_fps=0, max_age=0.5)
+    assert not pacer.accept(1.0, captured_at=1.0, now=1.6)
+    assert pacer.accept(1.1, captured_at=1.1, now=1.2)
+    assert pacer.stats()['stale_frames'] == 1
+
+
+def test_stage_pacer_restarts_after_timestamp_rewind():
+    pacer = StagePacer(target_fps=5, max_age=0)
+    assert pacer.accept(100.0, captured_at=0.0, now=0.0)
+    # 时间戳回退很多（源重连），立即重新开始调度
+    assert pacer.accept(0.0, captured_at=0.1, now=0.1)
+    assert not pacer.accept(0.05, captured_at=0.15, now=0.15)
+
+
+def test_stream_pacing_config_and_update():
+    pacing = StreamPacing.from_config({'analysis_fps': 2, 'unknown': 1})
+    assert pacing.analysis.target_fps == 2.0
+    assert pacing.streaming.target_fps == pacing.output_fps
+
+    pacing.analysis.record(0.1, captured_at=0.0, now=0.1)
+    pacing.update({'output_fps': 10, 'max_frame_age': 2})
+    assert pacing.streaming.target_fps == 10.0
+    assert pacing.streaming.max_age == pacing.analysis.max_age == 2.0
+    # 已测得的处理耗时保留
+    assert pacing.analysis.processing_time == pytest.approx(0.1)
+    assert pacing.stats()['output_fps'] == 10.0
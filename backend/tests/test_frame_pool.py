@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from app.services.frame_pool import FramePool
+
+
+SHAPE = (4, 6, 3)
+
+
+def test_slot_returns_to_pool_when_last_reference_released():
+    pool = FramePool(2)
+    slot = pool.acquire(SHAPE)
+    assert slot.refs == 1 and pool.in_use() == 1
+
+    slot.retain()
+    slot.retain()
+    slot.release()
+    slot.release()
+    assert slot.refs == 1 and pool.in_use() == 1
+
+    slot.release()
+    assert slot.refs == 0 and pool.in_use() == 0
+    # 多余的 release 不会让引用计数变成负数，也不会重复放回空闲列表
+    slot.release()
+    assert slot.refs == 0 and len(pool._free) == 2
+
+
+def test_exhausted_pool_drops_frames():
+    pool = FramePool(2)
+    first, second = pool.acquire(SHAPE), pool.acquire(SHAPE)
+    assert pool.acquire(SHAPE) is None
+    assert pool.exhausted == 1
+
+    second.release()
+    third = pool.acquire(SHAPE)
+    assert third is second
+    assert third.sequence > first.sequence
+
+
+def test_buffers_are_reused_and_reallocated_on_resize():
+    pool = FramePool(1)
+    slot = pool.acquire(SHAPE)
+    buffer = slot.array
+    slot.timestamp, slot.media_time = 1.0, 2.0
+    slot.release()
+
+    slot = pool.acquire(SHAPE)
+    assert slot.array is buffer
+    assert slot.timestamp is None and slot.media_time is None
+    slot.release()
+
+    slot = pool.acquire((8, 8, 3))
+    assert slot.array is not buffer and slot.array.shape == (8, 8, 3)
+
+
+def test_consumers_get_read_only_view_of_the_buffer():
+    pool = FramePool(1)
+    slot = pool.acquire(SHAPE)
+    slot.array[:] = 7
+    assert np.shares_memory(slot.frame, slot.array)
+    assert (slot.frame == 7).all()
+    with pytest.raises(ValueError):
+        slot.frame[0, 0, 0] = 1
@@ -0,0 +1,82 @@
+import math
+
+import numpy as np
+import pytest
+
+from app.utils.geometry import distances_to_polygon, locate_points, points_in_polygon
+
+
+def scalar_point_in_polygon(point, polygon):
+    """逐边循环的射线法（向量化之前的实现），作为参考结果"""
+    x, y = point
+    n = len(polygon)
+    inside = False
+    p1x, p1y = polygon[0]
+    for i in range(1, n + 1):
+        p2x, p2y = polygon[i % n]
+        if y > min(p1y, p2y) and y <= max(p1y, p2y) and x <= max(p1x, p2x):
+            if p1y != p2y:
+                xinters = (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
+            if p1x == p2x or x <= xinters:
+                inside = not inside
+        p1x, p1y = p2x, p2y
+    return inside
+
+
+def scalar_distance_to_polygon(point, polygon):
+    """逐边计算点到线段距离的最小值，作为参考结果"""
+    x, y = point
+    best = math.inf
+    for i in range(len(polygon)):
+        x1, y1 = polygon[i]
+        x2, y2 = polygon[(i + 1) % len(polygon)]
+        dx, dy = x2 - x1, y2 - y1
+        len_sq = dx * dx + dy * dy
+        param = 0.0 if len_sq == 0 else min(1.0, max(0.0, ((x - x1) * dx + (y - y1) * dy) / len_sq))
+        best = min(best, math.hypot(x - (x1 + param * dx), y - (y1 + param * dy)))
+    return best
+
+
+POLYGONS = {
+    'square': [[200, 200], [600, 200], [600, 400], [200, 400]],
+    'concave': [[100, 100], [500, 100], [500, 450], [300, 250], [100, 450]],
+    'with_horizontal_and_vertical_edges': [[0, 0], [300, 0], [300, 100], [150, 100], [150, 300], [0, 300]],
+    'triangle': [[50.5, 400.25], [700.75, 120.5], [640.0, 610.0]],
+}
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(0)
+    random_points = rng.uniform(-50, 750, size=(500, 2))
+    # 加上落在顶点上和与水平边等高的点，覆盖边界情况
+    special = np.array([[200, 200], [600, 400], [300, 250], [150, 100], [250, 100], [500, 300]], dtype=np.float64)
+    return np.concatenate([random_points, special])
+
+
+@pytest.mark.parametrize('name', sorted(POLYGONS))
+def test_points_in_polygon_matches_scalar(name, points):
+    polygon = POLYGONS[name]
+    expected = [scalar_point_in_polygon(point, polygon) for point in points]
+    assert points_in_polygon(points, polygon).tolist() == expected
+
+
+@pytest.mark.parametrize('name', sorted(POLYGONS))
+def test_distances_to_polygon_matches_scalar(name, points):
+    polygon = POLYGONS[name]
+    distances, nearest = distances_to_polygon(points, polygon)
+    expected = [scalar_distance_to_polygon(point, polygon) for point in points]
+    np.testing.assert_allclose(distances, expected, atol=1e-9)
+    # 最近点与查询点的距离就是返回的距离，且最近点在边缘上
+    np.testing.assert_allclose(np.hypot(*(points - nearest).T), distances, atol=1e-9)
+    np.testing.assert_allclose(distances_to_polygon(nearest, polygon)[0], 0, atol=1e-9)
+
+
+def test_degenerate_inputs():
+    assert points_in_polygon([[1, 1]], [[0, 0], [2, 2]]).tolist() == [False]
+    assert points_in_polygon(np.zeros((0, 2)), POLYGONS['square']).shape == (0,)
+    distances, nearest = distances_to_polygon([[3, 4]], [])
+    assert np.isinf(distances[0])
+    inside, distances, _ = locate_points([[400, 300], [0, 300]], POLYGONS['square'])
+    assert inside.tolist() == [True, False]
+    np.testing.assert_allclose(distances, [100, 200])
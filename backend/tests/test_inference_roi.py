@@ -0,0 +1,72 @@
+import pytest
+
+from app.services import danger_zone as danger_zone_service
+from app.services.inference_roi import ROI_HEAD_ROOM, danger_zone_roi_bounds, roi_bounds, zones_roi_polygon
+from app.services.zones import Zone, ZoneIndex
+
+
+FRAME_SHAPE = (1080, 1920, 3)
+
+
+@pytest.fixture
+def zones(monkeypatch):
+    """用给定的区域替换当前配置，返回设置函数"""
+    monkeypatch.setattr(danger_zone_service, 'ROI_ENABLED', True)
+    monkeypatch.setattr(danger_zone_service, 'INFERENCE_ROI', [])
+
+    def configure(*items):
+        index = ZoneIndex(items)
+        monkeypatch.setattr(danger_zone_service, 'get_zone_index', lambda: index)
+
+    return configure
+
+
+def contains(bounds, x, y):
+    x1, y1, x2, y2 = bounds
+    return x1 <= x <= x2 and y1 <= y <= y2
+
+
+def test_roi_covers_named_zones(zones):
+    legacy = Zone('danger zone', [[200, 600], [400, 600], [400, 800], [200, 800]], safety_distance=20)
+    dock = Zone('dock', [[1400, 700], [1600, 700], [1600, 900], [1400, 900]], 'restricted')
+    zones(legacy, dock)
+
+    bounds = danger_zone_roi_bounds(FRAME_SHAPE)
+
+    assert bounds is not None
+    # 回归：以前只按全局危险区域裁剪，命名区域内的人永远检测不到
+    assert contains(bounds, 1500, 800)
+    assert contains(bounds, 300, 700)
+
+
+def test_roi_uses_each_zone_safety_distance(zones):
+    zone = Zone('platform', [[800, 600], [1000, 600], [1000, 700], [800, 700]], safety_distance=100)
+    zones(zone)
+
+    x1, y1, x2, y2 = danger_zone_roi_bounds(FRAME_SHAPE)
+
+    # 靠近提示的范围是两倍安全距离
+    assert (x1, x2, y2) == (600, 1200, 900)
+    assert y1 == int(max(0, 400 - ROI_HEAD_ROOM * FRAME_SHAPE[0]))
+
+
+def test_roi_disabled_without_zones(zones):
+    zones()
+    assert danger_zone_roi_bounds(FRAME_SHAPE) is None
+
+
+def test_explicit_inference_roi_wins(zones, monkeypatch):
+    zones(Zone('dock', [[1400, 700], [1600, 700], [1600, 900], [1400, 900]]))
+    monkeypatch.setattr(danger_zone_service, 'INFERENCE_ROI', [[0, 0], [400, 0], [400, 300], [0, 300]])
+    assert danger_zone_roi_bounds(FRAME_SHAPE) == (0, 0, 400, 300)
+
+
+def test_stream_zones_give_same_roi_as_global_zones(zones):
+    # RTMP 流只配置了区域时，按与本机摄像头相同的方式推导ROI
+    dock = Zone('dock', [[1400, 700], [1600, 700], [1600, 900], [1400, 900]], 'restricted', safety_distance=30)
+    zones(dock)
+
+    bounds = roi_bounds(zones_roi_polygon([dock]), FRAME_SHAPE, head_room=ROI_HEAD_ROOM)
+
+    assert bounds == danger_zone_roi_bounds(FRAME_SHAPE)
+    assert contains(bounds, 1500, 800)
@@ -0,0 +1,153 @@
+import io
+import shutil
+import struct
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from app.services import live_egress as live_egress_module
+from app.services.live_egress import (
+    FFMPEG_BINARY, EgressSubscription, FragmentedMP4Egress, avc_codec_string, read_box
+)
+
+
+def box(box_type, payload=b''):
+    return struct.pack('>I4s', 8 + len(payload), box_type.encode('latin-1')) + payload
+
+
+class TrickleStream(io.BytesIO):
+    """每次 read 最多返回 3 个字节，模拟无缓冲管道的短读"""
+
+    def read(self, size=-1):
+        return super().read(min(size, 3) if size and size > 0 else 3)
+
+
+@pytest.mark.parametrize('stream_type', [io.BytesIO, TrickleStream])
+def test_read_box_splits_consecutive_boxes(stream_type):
+    data = box('ftyp', b'isom\x00\x00\x02\x00') + box('moov', b'x' * 20) + box('mdat')
+    stream = stream_type(data)
+
+    assert read_box(stream) == ('ftyp', data[:16])
+    assert read_box(stream) == ('moov', data[16:44])
+    assert read_box(stream) == ('mdat', data[44:])
+    assert read_box(stream) == (None, None)
+
+
+def test_read_box_large_size_header():
+    payload = b'p' * 5
+    data = struct.pack('>I4sQ', 1, b'mdat', 16 + len(payload)) + payload
+    assert read_box(io.BytesIO(data)) == ('mdat', data)
+
+
+def test_read_box_truncated_and_invalid():
+    assert read_box(io.BytesIO(box('moof', b'abcdef')[:-2])) == (None, None)
+    assert read_box(io.BytesIO(b'\x00\x00')) == (None, None)
+    with pytest.raises(ValueError):
+        read_box(io.BytesIO(struct.pack('>I4s', 4, b'moov')))
+
+
+def test_avc_codec_string_from_avcc():
+    # avcC: configurationVersion, profile, compatibility, level ...
+    avcc = box('avcC', bytes([1, 0x64, 0x00, 0x28, 0xFF]))
+    init = box('ftyp', b'isom') + box('moov', box('trak', avcc))
+    assert avc_codec_string(init) == 'avc1.640028'
+    assert avc_codec_string(box('moov', box('avcC', bytes([1, 0x42, 0xE0, 0x1F])))) == 'avc1.42E01F'
+    assert avc_codec_string(box('ftyp', b'isom') + box('moov')) is None
+    assert avc_codec_string(b'avcC\x01') is None
+
+
+def test_subscription_drops_oldest_fragment_when_full():
+    subscription = EgressSubscription(egress=None, buffer_size=2)
+    for fragment in (b'1', b'2', b'3'):
+        subscription.offer(fragment)
+
+    assert subscription.dropped == 1
+    assert subscription._queue.get_nowait() == b'2'
+    assert subscription._queue.get_nowait() == b'3'
+
+
+class Owner:
+    """模拟帧池槽位的引用计数"""
+
+    def __init__(self):
+        self.refs = 0
+        self._lock = threading.Lock()
+
+    def retain(self):
+        with self._lock:
+            self.refs += 1
+
+    def release(self):
+        with self._lock:
+            self.refs -= 1
+
+
+class StalledProcess:
+    """写入和读取都会卡住的 ffmpeg 进程，直到被终止"""
+
+    def __init__(self, *args, **kwargs):
+        self.stopped = threading.Event()
+        self.stdin = self.stdout = self
+
+    def write(self, data):
+        self.stopped.wait(5)
+        raise BrokenPipeError()
+
+    def read(self, size):
+        self.stopped.wait(5)
+        return b''
+
+    def close(self):
+        self.stopped.set()
+
+    def poll(self):
+        return 0 if self.stopped.is_set() else None
+
+    def terminate(self):
+        self.stopped.set()
+
+    def wait(self, timeout=None):
+        return 0
+
+
+def test_stalled_encoder_does_not_block_writer(monkeypatch):
+    monkeypatch.setattr(live_egress_module.subprocess, 'Popen', StalledProcess)
+    egress = FragmentedMP4Egress('encode', fps=25)
+    egress.subscribe()
+    frame = np.zeros((64, 64, 3), dtype=np.uint8)
+    owners = [Owner() for _ in range(10)]
+
+    started = time.monotonic()
+    for owner in owners:
+        assert egress.write_frame(frame, owner)
+    assert time.monotonic() - started < 1.0
+    # 队列中最多 LIVE_EGRESS_FRAME_QUEUE 帧，另有一帧正在写入，其余的帧已丢弃并归还
+    assert sum(owner.refs for owner in owners) <= live_egress_module.LIVE_EGRESS_FRAME_QUEUE + 1
+    assert egress.dropped_frames >= len(owners) - live_egress_module.LIVE_EGRESS_FRAME_QUEUE - 1
+
+    egress.close()
+    deadline = time.monotonic() + 5
+    while any(owner.refs for owner in owners) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert all(owner.refs == 0 for owner in owners)
+
+
+@pytest.mark.skipif(shutil.which(FFMPEG_BINARY) is None, reason='需要 ffmpeg')
+def test_encode_mode_outputs_init_segment():
+    egress = FragmentedMP4Egress('encode', fps=25)
+    subscription = egress.subscribe()
+    try:
+        for index in range(50):
+            frame = np.full((120, 160, 3), index * 5, dtype=np.uint8)
+            assert egress.write_frame(frame)
+            time.sleep(0.02)
+        init_segment = egress.wait_init(10)
+        assert init_segment is not None
+        stream = io.BytesIO(init_segment)
+        assert read_box(stream)[0] == 'ftyp'
+        assert read_box(stream)[0] == 'moov'
+        assert egress.codec.startswith('avc1.')
+    finally:
+        subscription.close()
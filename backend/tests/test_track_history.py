@@ -0,0 +1,62 @@
+import numpy as np
+
+from app.services.track_history import TrackHistory, TrackHistoryStore
+
+
+def test_ring_buffer_wraps_in_time_order():
+    history = TrackHistory(capacity=3, fields=2, initial_tracks=2)
+    for frame in range(5):
+        history.append([7], np.array([[frame, frame * 10]]), frame)
+
+    np.testing.assert_array_equal(history.get(7), [[2, 20], [3, 30], [4, 40]])
+    np.testing.assert_array_equal(history.last([7]), [[4, 40]])
+
+
+def test_partial_history_and_unknown_ids():
+    history = TrackHistory(capacity=4, fields=1)
+    history.append([1, 2], np.array([[1.0], [2.0]]), 0)
+    history.append([1], np.array([[1.5]]), 1)
+
+    np.testing.assert_array_equal(history.get(1), [[1.0], [1.5]])
+    assert history.get(99).shape == (0, 1)
+    last = history.last([2, 99, 1])
+    assert last[0, 0] == 2.0 and np.isnan(last[1, 0]) and last[2, 0] == 1.5
+    assert 1 in history and 99 not in history
+
+
+def test_grows_beyond_initial_slots():
+    history = TrackHistory(capacity=2, fields=1, initial_tracks=2)
+    ids = list(range(10))
+    history.append(ids, np.arange(10, dtype=np.float64).reshape(-1, 1), 0)
+
+    assert len(history) == 10
+    np.testing.assert_array_equal(history.last(ids)[:, 0], ids)
+
+
+def test_evicts_stale_ids_and_reuses_slots():
+    history = TrackHistory(capacity=3, fields=1, ttl=5, initial_tracks=2)
+    history.append([1, 2], np.array([[1.0], [2.0]]), 0)
+    history.append([2], np.array([[2.5]]), 4)
+
+    assert history.evict(5) == 0
+    assert history.evict(6) == 1
+    assert 1 not in history and 2 in history
+
+    # 回收的槽位被新ID复用，且不会带上旧ID的历史
+    history.append([3], np.array([[3.0]]), 6)
+    np.testing.assert_array_equal(history.get(3), [[3.0]])
+    assert len(history._values) == 2
+
+    assert history.evict(100) == 2
+    assert len(history) == 0
+
+
+def test_store_isolates_streams():
+    store = TrackHistoryStore(capacity=2, fields=1)
+    store.get('a').append([1], np.array([[1.0]]), 0)
+    store.get('b').append([1], np.array([[9.0]]), 0)
+
+    assert store.get('a').last([1])[0, 0] == 1.0
+    assert store.get('b').last([1])[0, 0] == 9.0
+    store.drop('a')
+    assert 1 not in store.get('a')
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from app.services.zone_raster import ZoneDistanceField
+from app.utils.geometry import locate_points
+
+
+FRAME_SHAPE = (720, 1280)
+CONCAVE = [[200, 150], [900, 150], [900, 600], [550, 350], [200, 600]]
+
+
+def random_points(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform([0, 0], [FRAME_SHAPE[1], FRAME_SHAPE[0]], size=(count, 2))
+
+
+@pytest.mark.parametrize('scale', [1.0, 0.5])
+def test_distance_field_error_bound(scale):
+    field = ZoneDistanceField(CONCAVE, FRAME_SHAPE, scale=scale)
+    points = random_points(2000)
+
+    inside, distances, nearest = field.lookup(points)
+    exact_inside, exact_distances, _ = locate_points(points, CONCAVE)
+
+    # 误差来自边缘像素化（约 1/scale 像素）和 5x5 掩码距离变换对最近边缘点的近似
+    tolerance = 2.0 + 2.0 / scale
+    assert np.abs(distances - exact_distances).max() <= tolerance
+    # 最近点确实在边缘附近
+    assert np.abs(locate_points(nearest, CONCAVE)[1]).max() <= tolerance
+    # 内外判定只可能在边缘附近不同
+    mismatched = inside != exact_inside
+    assert np.all(exact_distances[mismatched] <= tolerance)
+
+
+@pytest.mark.parametrize('scale', [1.0, 0.5])
+def test_points_on_edge_are_inside(scale):
+    field = ZoneDistanceField(CONCAVE, FRAME_SHAPE, scale=scale)
+    # 右边上的点：point_in_polygon 和 fillPoly 都视为区域内（边缘像素的距离为 0，不能按符号判断）
+    points = np.array([[900, 300], [900, 400], [900, 500]], dtype=np.float64)
+
+    inside, distances, _ = field.lookup(points)
+
+    assert locate_points(points, CONCAVE)[0].all()
+    assert inside.all()
+    assert np.all(distances <= 2.0 / scale)
+    # 上边的点按 fillPoly 栅格同样在区域内
+    assert field.lookup([[500, 150]])[0].all()
+
+
+def test_distance_field_clips_points_outside_frame():
+    field = ZoneDistanceField(CONCAVE, FRAME_SHAPE)
+    inside, distances, _ = field.lookup([[-100, -100], [5000, 5000]])
+    assert inside.tolist() == [False, False]
+    assert np.all(np.isfinite(distances))
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from app.services.zone_raster import ZoneDistanceField
+from app.services.zones import Zone, ZoneIndex, parse_zones
+from app.utils.geometry import locate_points
+
+
+FRAME_SHAPE = (720, 1280)
+CONCAVE = [[200, 150], [900, 150], [900, 600], [550, 350], [200, 600]]
+
+
+def random_points(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform([0, 0], [FRAME_SHAPE[1], FRAME_SHAPE[0]], size=(count, 2))
+
+
+def brute_force_locate(zones, points):
+    """逐个区域做几何判定，命中规则与 ZoneIndex.locate 相同"""
+    hits = [[] for _ in points]
+    for zone in zones:
+        inside, distances, _ = locate_points(points, zone.polygon)
+        for i, (is_inside, distance) in enumerate(zip(inside, distances)):
+            if is_inside or distance < 2 * zone.safety_distance:
+                hits[i].append((zone.name, bool(is_inside), float(distance)))
+    for point_hits in hits:
+        point_hits.sort(key=lambda hit: (not hit[1], hit[2]))
+    return hits
+
+
+@pytest.mark.parametrize('cell_size', [16, 64, 500])
+def test_zone_index_matches_brute_force(cell_size):
+    zones = parse_zones([
+        {'name': 'platform', 'polygon': CONCAVE, 'safety_distance': 40},
+        {'name': 'gate', 'type': 'restricted', 'polygon': [[1000, 100], [1200, 100], [1200, 300], [1000, 300]]},
+        {'name': 'queue', 'type': 'queue', 'polygon': [[850, 500], [1100, 500], [1100, 700], [850, 700]],
+         'safety_distance': 25},
+        {'name': 'tiny', 'polygon': [[50, 50], [60, 50], [55, 60]], 'safety_distance': 5},
+    ])
+    points = np.concatenate([random_points(3000, seed=1), [[55, 55], [1100, 200], [900, 550]]])
+
+    index = ZoneIndex(zones, cell_size=cell_size)
+    actual = [
+        [(hit.zone.name, hit.inside, hit.distance) for hit in point_hits]
+        for point_hits in index.locate(points)
+    ]
+
+    expected = brute_force_locate(zones, points)
+    assert [[(name, inside) for name, inside, _ in hits] for hits in actual] == \
+        [[(name, inside) for name, inside, _ in hits] for hits in expected]
+    for actual_hits, expected_hits in zip(actual, expected):
+        np.testing.assert_allclose([hit[2] for hit in actual_hits], [hit[2] for hit in expected_hits])
+
+
+def test_zone_uses_distance_field_when_frame_shape_given():
+    calls = []
+
+    def distance_field(frame_shape):
+        calls.append(frame_shape)
+        return ZoneDistanceField(CONCAVE, frame_shape)
+
+    zone = Zone('platform', CONCAVE, distance_field=distance_field)
+    zone.locate([[500, 300]])
+    assert calls == []
+    inside, _, _ = zone.locate([[500, 300]], FRAME_SHAPE)
+    assert calls == [FRAME_SHAPE] and inside.tolist() == [True]
+
+
+def test_parse_zones_rejects_invalid_config():
+    with pytest.raises(ValueError):
+        parse_zones([{'name': 'a', 'polygon': CONCAVE}, {'name': 'a', 'polygon': CONCAVE}])
+    with pytest.raises(ValueError):
+        parse_zones([{'name': 'a', 'polygon': [[0, 0], [1, 1]]}])
+    with pytest.raises(ValueError):
+        parse_zones([{'name': 'a', 'type': 'unknown', 'polygon': CONCAVE}])
+    with pytest.raises(ValueError):
+        parse_zones([{'name': 'a', 'polygon': CONCAVE, 'safety_distance': -1}])